@@ -0,0 +1,251 @@
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from crop_engine import CropResult
+
+ZIP_EXTENSIONS = (".zip",)
+# Extension -> compression suffix of the tarfile stream modes ("r|gz", "w|xz"...).
+TAR_EXTENSIONS = {
+    ".tar": "",
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tbz2": "bz2",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+}
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + tuple(TAR_EXTENSIONS)
+# Archives are written through a buffer this large, so the disk sees a few big
+# sequential writes instead of one small write per crop.
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+# Members read ahead per worker while the pool is busy (bounds the memory held).
+_PREFETCH_PER_WORKER = 4
+
+
+class ArchiveError(ValueError):
+    """Raised for unsupported archives and unsafe or duplicate member names."""
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _tar_compression(path: str) -> Optional[str]:
+    lower = path.lower()
+    for extension, compression in TAR_EXTENSIONS.items():
+        if lower.endswith(extension):
+            return compression
+    return None
+
+
+def member_name(name: str) -> str:
+    """Normalize an archive member name, refusing absolute paths and ``..``."""
+    normalized = posixpath.normpath(name.replace("\\", "/"))
+    if normalized.startswith("/") or normalized == ".." or normalized.startswith("../") or normalized == ".":
+        raise ArchiveError(f"Nome non sicuro nell'archivio: '{name}'.")
+    return normalized
+
+
+def iter_members(path: str, select: Callable[[str], bool]) -> Iterator[Tuple[str, bytes]]:
+    """Yield ``(name, data)`` for the regular members of the archive ``path`` that ``select`` accepts.
+
+    Nothing is extracted to disk. Tar archives (optionally gz/bz2/xz
+    compressed) are read as a forward-only stream, one member at a time in
+    archive order; ZIP members are read in the order of the central directory.
+    Members with unsafe names are skipped.
+    """
+    if path.lower().endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                name = _selected_name(info.filename, select)
+                if name is not None:
+                    yield name, archive.read(info)
+        return
+    if _tar_compression(path) is None:
+        raise ArchiveError(f"Formato di archivio non supportato: '{path}'.")
+    with tarfile.open(path, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            name = _selected_name(info.name, select)
+            if name is not None:
+                with archive.extractfile(info) as fh:
+                    yield name, fh.read()
+
+
+def _selected_name(name: str, select: Callable[[str], bool]) -> Optional[str]:
+    try:
+        name = member_name(name)
+    except ArchiveError as exc:
+        print(f"Attenzione: {exc}")
+        return None
+    return name if select(name) else None
+
+
+class ArchiveWriter:
+    """Write files into a ZIP or tar archive sequentially, through a large buffer.
+
+    ZIP members are stored uncompressed (the crops are already compressed
+    images); tar archives are compressed as their extension says. The archive
+    is built under a temporary name and renamed into place by :meth:`close`,
+    so an interrupted run never leaves a truncated archive behind.
+    """
+
+    def __init__(self, path: str, buffer_size: int = WRITE_BUFFER_SIZE):
+        self.path = path
+        self.count = 0
+        self.size = 0
+        self._names = set()
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        compression = _tar_compression(path)
+        if not path.lower().endswith(ZIP_EXTENSIONS) and compression is None:
+            raise ArchiveError(f"Formato di archivio non supportato: '{path}'.")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._fh = open(self._tmp_path, "wb", buffering=buffer_size)
+        if compression is None:
+            # Without tell/seek zipfile streams each member with a data descriptor
+            # instead of seeking back to patch its header, which would flush the buffer.
+            self._zip = zipfile.ZipFile(_ForwardOnly(self._fh), "w", compression=zipfile.ZIP_STORED)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(fileobj=self._fh, mode=f"w|{compression}")
+
+    def write(self, name: str, data: bytes) -> None:
+        name = member_name(name)
+        if name in self._names:
+            raise ArchiveError(f"'{name}' è già nell'archivio.")
+        self._names.add(name)
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._tar.addfile(info, _BytesReader(data))
+        self.count += 1
+        self.size += len(data)
+
+    def close(self, keep: bool = True) -> None:
+        """Finish the archive and move it into place (or discard it when ``keep`` is false)."""
+        if self._fh.closed:
+            return
+        try:
+            (self._zip or self._tar).close()
+        finally:
+            self._fh.close()
+        if keep:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(keep=exc_type is None)
+
+
+class FolderWriter:
+    """Same interface as :class:`ArchiveWriter`, writing plain files under ``folder``."""
+
+    def __init__(self, folder: str):
+        self.path = folder
+        self.count = 0
+        self.size = 0
+        self._created = set()
+
+    def write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.path, *member_name(name).split("/"))
+        directory = os.path.dirname(path)
+        if directory not in self._created:
+            os.makedirs(directory, exist_ok=True)
+            self._created.add(directory)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        self.count += 1
+        self.size += len(data)
+
+    def close(self, keep: bool = True) -> None:
+        pass
+
+    def __enter__(self) -> "FolderWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+class _ForwardOnly:
+    """Write-only view of a file object that hides ``tell`` and ``seek``."""
+
+    def __init__(self, fh):
+        self._fh = fh
+
+    def write(self, data) -> int:
+        return self._fh.write(data)
+
+    def flush(self) -> None:
+        self._fh.flush()
+
+
+class _BytesReader:
+    """Minimal file object over ``data`` for ``TarFile.addfile`` (avoids a BytesIO copy)."""
+
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._offset + size
+        chunk = self._view[self._offset : end]
+        self._offset += len(chunk)
+        return chunk
+
+
+def crop_members(
+    jobs: Iterable[Tuple[str, bytes, tuple]],
+    workers: int,
+    jpegtran: Optional[str] = None,
+    roi: bool = False,
+) -> Iterator[Tuple[str, "CropResult", List[Tuple[str, bytes]]]]:
+    """Crop ``(name, data, outputs)`` jobs already in memory, yielding results in input order.
+
+    ``outputs`` are the ``(crop_box, output_name, encoding)`` triples of
+    :func:`crop_engine.crop_bytes`; each result comes with the encoded
+    ``(output_name, bytes)`` pairs, for the caller to write. At most a few
+    jobs per worker are held in memory at a time.
+    """
+    from pipeline import crop_bytes_job
+
+    if workers <= 1:
+        for name, data, outputs in jobs:
+            result, encoded = crop_bytes_job(data, outputs, jpegtran, False, roi)
+            yield name, result, encoded
+        return
+
+    window = workers * _PREFETCH_PER_WORKER
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name, data, outputs in jobs:
+            pending.append((name, executor.submit(crop_bytes_job, data, outputs, jpegtran, False, roi)))
+            if len(pending) >= window:
+                done_name, done = pending.popleft()
+                yield (done_name, *done.result())
+        while pending:
+            done_name, done = pending.popleft()
+            yield (done_name, *done.result())
@@ -0,0 +1,151 @@
+import math
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from orientation import display_size, exif_orientation, orient
+
+DEFAULT_SAMPLE = 64
+DEFAULT_THRESHOLD = 24
+# Long side of the thumbnails the detection runs on.
+_THUMBNAIL_SIDE = 512
+# Rows/columns need this fraction of content pixels, so dust and scanner specks are ignored.
+_MIN_CONTENT_FRACTION = 0.005
+# Share of the samples whose content must fit in the detected box.
+_COVERAGE = 0.95
+
+
+class AutoTemplateError(RuntimeError):
+    """Raised when no template can be derived from the sampled images."""
+
+
+def _require_numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise AutoTemplateError("--auto-template richiede numpy (pip install numpy).") from exc
+    return numpy
+
+
+def _image_size(path: str) -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+    """``(size, error)``: size of ``path`` as displayed (turned by its EXIF orientation), or why it is unreadable."""
+    try:
+        with Image.open(path) as img:
+            return display_size(img.size, exif_orientation(img)), None
+    except Exception as exc:  # a bad sample is skipped, not fatal
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+def _thumbnail(path: str, size: Tuple[int, int]) -> Tuple[Optional[bytes], Optional[str]]:
+    """``(thumbnail, error)``: grayscale ``size`` thumbnail of ``path`` as displayed, as raw bytes.
+
+    JPEGs are decoded at reduced scale.
+    """
+    try:
+        with Image.open(path) as img:
+            orientation = exif_orientation(img)
+            stored = display_size(size, orientation)
+            img.draft("L", stored)
+            thumbnail = img.convert("L").resize(stored, Image.BILINEAR, reducing_gap=2.0)
+            return orient(thumbnail, orientation).tobytes(), None
+    except Exception as exc:  # a bad sample is skipped, not fatal
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+def detect_box(
+    paths: Sequence[str],
+    sample: int = DEFAULT_SAMPLE,
+    threshold: int = DEFAULT_THRESHOLD,
+    margin: int = 0,
+    workers: int = 1,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """Find the box holding the content of a random sample of ``paths``.
+
+    Only images of the most common size in the sample are used. Each one is
+    reduced to a grayscale thumbnail; the thumbnails are stacked into one
+    array and compared with their own border colour (the median of the edge
+    pixels) in a single vectorized pass. The per-image content bounds are
+    then combined so the box holds the content of :data:`_COVERAGE` of the
+    samples, mapped back to full-resolution pixels and grown by ``margin``.
+    Samples that cannot be read are skipped and listed as ``(path, error)``
+    pairs under ``"unreadable"``. Returns the box with the image size and
+    the number of samples used.
+    """
+    np = _require_numpy()
+    if not paths:
+        raise AutoTemplateError("Nessuna immagine da campionare.")
+    chosen = random.Random(seed).sample(list(paths), min(sample, len(paths)))
+    unreadable: List[Tuple[str, str]] = []
+    blobs: List[bytes] = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        sizes = {}
+        for path, (size, error) in zip(chosen, executor.map(_image_size, chosen, chunksize=16)):
+            if error is None:
+                sizes[path] = size
+            else:
+                unreadable.append((path, error))
+        if not sizes:
+            raise AutoTemplateError("Nessuna delle immagini campionate è leggibile.")
+        (width, height), used = Counter(sizes.values()).most_common(1)[0]
+        chosen = [path for path, size in sizes.items() if size == (width, height)]
+        ratio = min(1.0, _THUMBNAIL_SIDE / max(width, height))
+        thumb_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        thumbnails = executor.map(_thumbnail, chosen, [thumb_size] * len(chosen), chunksize=8)
+        for path, (blob, error) in zip(chosen, thumbnails):
+            if error is None:
+                blobs.append(blob)
+            else:
+                unreadable.append((path, error))
+    if not blobs:
+        raise AutoTemplateError(f"Nessuna delle immagini campionate {width}x{height} è leggibile.")
+
+    thumb_w, thumb_h = thumb_size
+    stack = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), thumb_h, thumb_w)
+    border = np.concatenate((stack[:, 0, :], stack[:, -1, :], stack[:, :, 0], stack[:, :, -1]), axis=1)
+    background = np.median(border, axis=1).astype(np.int16)
+    content = np.abs(stack.astype(np.int16) - background[:, None, None]) > threshold
+
+    rows = content.sum(axis=2) > max(1, _MIN_CONTENT_FRACTION * thumb_w)
+    cols = content.sum(axis=1) > max(1, _MIN_CONTENT_FRACTION * thumb_h)
+    has_content = rows.any(axis=1) & cols.any(axis=1)
+    if not has_content.any():
+        raise AutoTemplateError("Nessun contenuto distinguibile dallo sfondo nelle immagini campionate.")
+    rows, cols = rows[has_content], cols[has_content]
+    tops = rows.argmax(axis=1)
+    bottoms = thumb_h - rows[:, ::-1].argmax(axis=1)
+    lefts = cols.argmax(axis=1)
+    rights = thumb_w - cols[:, ::-1].argmax(axis=1)
+
+    low, high = (1 - _COVERAGE) * 100, _COVERAGE * 100
+    scale_x, scale_y = width / thumb_w, height / thumb_h
+    left = math.floor(np.percentile(lefts, low) * scale_x) - margin
+    top = math.floor(np.percentile(tops, low) * scale_y) - margin
+    right = math.ceil(np.percentile(rights, high) * scale_x) + margin
+    bottom = math.ceil(np.percentile(bottoms, high) * scale_y) + margin
+    return {
+        "left": max(0, left),
+        "top": max(0, top),
+        "right": min(width, right),
+        "bottom": min(height, bottom),
+        "image_size": (width, height),
+        "samples": int(has_content.sum()),
+        "skipped": len(sizes) - used,
+        "unreadable": unreadable,
+    }
+
+
+def template_data(name: str, detected: Dict[str, object]) -> Dict[str, object]:
+    """Template JSON for a box found by :func:`detect_box`."""
+    width, height = detected["image_size"]
+    return {
+        "name": name,
+        "description": f"Rilevato automaticamente da {detected['samples']} immagini {width}x{height}.",
+        "left": detected["left"],
+        "top": detected["top"],
+        "right": detected["right"],
+        "bottom": detected["bottom"],
+    }
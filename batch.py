@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from encoding_presets import output_name as encoded_output_name
+from manifest import Manifest
+
+if TYPE_CHECKING:
+    from crop_engine import CropTarget
+
+VALID_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+
+def matches_any(rel_path: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatch(rel_path, pattern) for pattern in patterns)
+
+
+def is_selected(rel_path: str, include: Sequence[str] = (), exclude: Sequence[str] = ()) -> bool:
+    """Whether a relative path is an image accepted by the include/exclude globs."""
+    if not rel_path.lower().endswith(VALID_EXTENSIONS):
+        return False
+    if include and not matches_any(rel_path, include):
+        return False
+    return not (exclude and matches_any(rel_path, exclude))
+
+
+def iter_image_files(
+    folder: str,
+    recursive: bool = False,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    sort: bool = True,
+    skip_dirs: Sequence[str] = (),
+) -> Iterable[str]:
+    """Stream image paths relative to ``folder`` using ``os.scandir``.
+
+    Paths use ``/`` as separator and are matched against the ``include`` and
+    ``exclude`` glob patterns; an excluded directory is not descended into.
+    With ``sort`` each directory listing is sorted (files first, then
+    subfolders), giving a stable order; without it entries are yielded as the
+    filesystem returns them, so work starts before a huge listing is read.
+    ``skip_dirs`` holds absolute paths never to descend into (e.g. the output folder).
+    """
+    skipped = {os.path.realpath(path) for path in skip_dirs}
+    pending: List[Tuple[str, str]] = [(folder, "")]
+    while pending:
+        directory, prefix = pending.pop()
+        subdirs: List[Tuple[str, str]] = []
+        with os.scandir(directory) as entries:
+            if sort:
+                entries = sorted(entries, key=lambda entry: entry.name)
+            for entry in entries:
+                rel_path = f"{prefix}{entry.name}"
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    if exclude and matches_any(rel_path, exclude):
+                        continue
+                    if os.path.realpath(entry.path) not in skipped:
+                        subdirs.append((entry.path, f"{rel_path}/"))
+                    continue
+                if is_selected(rel_path, include, exclude) and entry.is_file():
+                    yield rel_path
+        pending.extend(reversed(subdirs))
+
+
+def plan_outputs(
+    fname: str,
+    input_path: str,
+    output_folder: str,
+    targets: Sequence[CropTarget],
+    manifests: Dict[str, Manifest],
+    created_dirs: set,
+):
+    """Return ``(stat, outputs, written)`` for the targets ``fname`` still needs.
+
+    ``outputs`` holds the ``(box, output_path, encoding)`` jobs for the worker
+    and ``written`` the matching ``(subfolder, output name, box, encoding)`` tuples. Targets
+    whose manifest says the output is current are left out; the output
+    directories of the remaining ones are created on first use.
+    """
+    stat = os.stat(input_path) if manifests else None
+    outputs = []
+    written = []
+    for target in targets:
+        output_name = encoded_output_name(fname, target.encoding)
+        output_path = os.path.join(output_folder, target.subfolder, output_name)
+        manifest = manifests.get(target.subfolder)
+        if manifest is not None and manifest.is_current(
+            fname, input_path, stat, output_path, target.box, target.encoding
+        ):
+            continue
+        output_dir = os.path.dirname(output_path)
+        if output_dir not in created_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            created_dirs.add(output_dir)
+        outputs.append((target.box, output_path, target.encoding))
+        written.append((target.subfolder, output_name, target.box, target.encoding))
+    return stat, tuple(outputs), written
+
+
+def record_outputs(
+    fname: str,
+    input_path: str,
+    stat,
+    written: Sequence[Tuple[str, str, Tuple[int, int, int, int], Optional[Dict[str, object]]]],
+    manifests: Dict[str, Manifest],
+) -> None:
+    for subfolder, output_name, box, encoding in written:
+        manifest = manifests.get(subfolder)
+        if manifest is not None:
+            manifest.record(fname, input_path, stat, output_name, box, encoding)
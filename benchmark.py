@@ -0,0 +1,318 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from batch import iter_image_files
+from jpeg_lossless import find_jpegtran
+from main import DEFAULT_WORKERS, process_images
+
+DEFAULT_SMALL_SIZE = (640, 480)
+DEFAULT_HUGE_SIZE = (4000, 3000)
+DEFAULT_COUNT = 20
+DEFAULT_BOX = (16, 16, 336, 256)
+# (extension, mode) pairs of the synthetic corpus; JPEG cannot hold alpha or a palette.
+CORPUS_KINDS = (('png', 'RGB'), ('png', 'RGBA'), ('png', 'P'), ('jpg', 'RGB'), ('tif', 'RGB'))
+CONFIGS: Dict[str, Dict[str, object]] = {
+    'serial': {'workers': 1},
+    # Same as serial with region-of-interest decoding: compare their peak RSS.
+    'roi': {'workers': 1, 'roi': True},
+    'parallel': {'workers': DEFAULT_WORKERS},
+    'lossless': {'workers': DEFAULT_WORKERS, 'lossless_jpeg': True},
+    'fanout3': {'workers': DEFAULT_WORKERS, 'fanout': 3},
+}
+RESULT_VERSION = 1
+# Metrics compared by --compare, with True when a higher value is better.
+COMPARED_METRICS = (
+    ('images_per_s', True),
+    ('mb_per_s', True),
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('peak_rss_mb', False),
+)
+
+
+def _synthetic_image(size: Tuple[int, int], mode: str, rng: random.Random) -> Image.Image:
+    """Smooth pseudo-random content: compresses like a photo, unlike pure noise."""
+    width, height = size
+    coarse_size = (max(1, width // 16), max(1, height // 16))
+    bands = 4 if mode == 'RGBA' else 3
+    coarse = Image.frombytes(
+        'RGBA' if bands == 4 else 'RGB',
+        coarse_size,
+        rng.randbytes(coarse_size[0] * coarse_size[1] * bands),
+    )
+    image = coarse.resize(size, Image.BICUBIC)
+    if mode == 'P':
+        image = image.quantize(colors=256)
+    return image
+
+
+def build_corpus(folder: str, count: int, small_size, huge_size, seed: int = 0) -> int:
+    """Write the deterministic synthetic corpus into ``folder`` and return its file count.
+
+    Every kind of :data:`CORPUS_KINDS` gets ``count`` small images and
+    ``count // 10`` (at least one) huge ones.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    written = 0
+    for extension, mode in CORPUS_KINDS:
+        for label, size, amount in (('small', small_size, count), ('huge', huge_size, max(1, count // 10))):
+            for index in range(amount):
+                path = os.path.join(folder, f"{label}_{mode.lower()}_{index:04d}.{extension}")
+                if not os.path.exists(path):
+                    _synthetic_image(size, mode, rng).save(path)
+                written += 1
+    return written
+
+
+def _fanout_boxes(box: Tuple[int, int, int, int], count: int) -> Dict[str, Tuple[int, int, int, int]]:
+    left, top, right, bottom = box
+    step = max(1, (bottom - top) // (count + 1))
+    return {f"t{index}": (left, top + index * step, right, bottom + index * step) for index in range(count)}
+
+
+def _self_peak_rss_kib() -> int:
+    """Peak RSS of this process in KiB.
+
+    ``ru_maxrss`` survives ``execve`` and would report the launching process'
+    peak, so the per-address-space ``VmHWM`` is preferred when available.
+    """
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_config(corpus: str, config: Dict[str, object], box: Tuple[int, int, int, int]) -> Dict[str, object]:
+    """Run ``process_images`` once in this process and return its raw measurements."""
+    crop_box = box
+    fanout = int(config.get('fanout', 1))
+    if fanout > 1:
+        crop_box = _fanout_boxes(box, fanout)
+    input_bytes = sum(os.path.getsize(os.path.join(corpus, name)) for name in iter_image_files(corpus))
+    latencies: List[float] = []
+    with tempfile.TemporaryDirectory(prefix='bulk_crop_bench_') as scratch:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            processed = process_images(
+                corpus,
+                scratch,
+                crop_box,
+                workers=int(config.get('workers', 1)),
+                lossless_jpeg=bool(config.get('lossless_jpeg', False)),
+                latencies=latencies,
+                roi=bool(config.get('roi', False)),
+            )
+            elapsed = time.perf_counter() - start
+    # RUSAGE_CHILDREN covers the pool workers, which have been joined by now.
+    peak_kib = max(_self_peak_rss_kib(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'images': processed,
+        'seconds': elapsed,
+        'input_bytes': input_bytes,
+        'latencies': latencies,
+        'peak_rss_mb': peak_kib / 1024,
+    }
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(name: str, config: Dict[str, object], raw: Dict[str, object]) -> Dict[str, object]:
+    seconds = max(float(raw['seconds']), 1e-9)
+    latencies = list(raw['latencies'])
+    return {
+        'config': name,
+        'settings': config,
+        'images': raw['images'],
+        'seconds': round(seconds, 4),
+        'images_per_s': round(raw['images'] / seconds, 2),
+        'mb_per_s': round(raw['input_bytes'] / seconds / 1e6, 2),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+        'peak_rss_mb': round(float(raw['peak_rss_mb']), 1),
+    }
+
+
+def _run_isolated(corpus: str, name: str, box: Tuple[int, int, int, int]) -> Dict[str, object]:
+    """Run one configuration in a fresh interpreter so peak RSS is not shared between runs."""
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        '--run-one',
+        name,
+        '--corpus',
+        corpus,
+        '--box',
+        ','.join(str(value) for value in box),
+    ]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE)
+    return json.loads(result.stdout)
+
+
+def run_suite(
+    corpus: str,
+    names: List[str],
+    box: Tuple[int, int, int, int],
+    repeat: int,
+) -> Dict[str, object]:
+    results = []
+    for name in names:
+        config = CONFIGS[name]
+        if config.get('lossless_jpeg') and find_jpegtran() is None:
+            print(f"Configurazione '{name}' saltata: jpegtran non trovato.", file=sys.stderr)
+            continue
+        # Best of ``repeat`` runs by throughput; the other metrics come from that same run.
+        best: Optional[Dict[str, object]] = None
+        for _ in range(max(1, repeat)):
+            summary = summarize(name, config, _run_isolated(corpus, name, box))
+            if best is None or summary['images_per_s'] > best['images_per_s']:
+                best = summary
+        print(
+            f"{name:<10} {best['images_per_s']:8.1f} img/s {best['mb_per_s']:8.1f} MB/s "
+            f"p50 {best['p50_ms']:7.1f} ms p95 {best['p95_ms']:7.1f} ms RSS {best['peak_rss_mb']:7.1f} MB",
+            file=sys.stderr,
+        )
+        results.append(best)
+    return {
+        'version': RESULT_VERSION,
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': Image.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'corpus': os.path.abspath(corpus),
+            'corpus_files': sum(1 for _ in iter_image_files(corpus)),
+            'box': list(box),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline_path: str, candidate_path: str, threshold: float) -> int:
+    """Print per-metric deltas between two result files; return 1 if any metric regressed."""
+    with open(baseline_path, 'r', encoding='utf-8') as fh:
+        baseline = {entry['config']: entry for entry in json.load(fh)['results']}
+    with open(candidate_path, 'r', encoding='utf-8') as fh:
+        candidate = {entry['config']: entry for entry in json.load(fh)['results']}
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(candidate)):
+        print(f"{name}:")
+        for metric, higher_is_better in COMPARED_METRICS:
+            before = float(baseline[name].get(metric, 0.0))
+            after = float(candidate[name].get(metric, 0.0))
+            change = (after - before) / before * 100 if before else 0.0
+            worse = change < -threshold if higher_is_better else change > threshold
+            better = change > threshold if higher_is_better else change < -threshold
+            verdict = 'PEGGIORATO' if worse else 'migliorato' if better else 'invariato'
+            regressions += worse
+            print(f"  {metric:<13} {before:10.2f} -> {after:10.2f} ({change:+6.1f}%) {verdict}")
+    for name in sorted(set(baseline) ^ set(candidate)):
+        print(f"{name}: presente in un solo file, non confrontato.")
+    return 1 if regressions else 0
+
+
+def _parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def _parse_box(value: str) -> Tuple[int, int, int, int]:
+    left, top, right, bottom = (int(part) for part in value.split(','))
+    return left, top, right, bottom
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark riproducibile della pipeline di ritaglio su un corpus sintetico.',
+    )
+    parser.add_argument(
+        '--corpus',
+        help='Cartella del corpus: viene generata se non esiste (predefinito: cartella temporanea).',
+    )
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help='Immagini piccole per tipo.')
+    parser.add_argument('--small', type=_parse_size, default=DEFAULT_SMALL_SIZE, help='Dimensione piccola, es. 640x480.')
+    parser.add_argument('--huge', type=_parse_size, default=DEFAULT_HUGE_SIZE, help='Dimensione grande, es. 4000x3000.')
+    parser.add_argument('--seed', type=int, default=0, help='Seme del generatore del corpus.')
+    parser.add_argument('--box', type=_parse_box, default=DEFAULT_BOX, help='Area di ritaglio left,top,right,bottom.')
+    parser.add_argument(
+        '--configs',
+        default=','.join(CONFIGS),
+        help=f"Configurazioni da eseguire, separate da virgola (disponibili: {', '.join(CONFIGS)}).",
+    )
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Ripetizioni per configurazione; conta la migliore.')
+    parser.add_argument('--json', metavar='FILE', help='Scrive i risultati JSON nel file invece che su stdout.')
+    parser.add_argument(
+        '--compare',
+        nargs=2,
+        metavar=('BASE', 'NUOVO'),
+        help='Confronta due file di risultati e termina con 1 se qualche metrica peggiora.',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=5.0,
+        help='Variazione percentuale oltre la quale una metrica conta come cambiata (predefinito: 5).',
+    )
+    parser.add_argument('--run-one', metavar='CONFIG', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    if args.run_one:
+        raw = run_config(args.corpus, CONFIGS[args.run_one], args.box)
+        json.dump(raw, sys.stdout)
+        return 0
+
+    names = [name.strip() for name in args.configs.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CONFIGS]
+    if unknown:
+        print(f"Configurazioni sconosciute: {', '.join(unknown)}")
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix='bulk_crop_corpus_') as scratch:
+        corpus = args.corpus or scratch
+        if not os.path.isdir(corpus) or not any(True for _ in iter_image_files(corpus)):
+            print(f"Generazione del corpus sintetico in '{corpus}'...", file=sys.stderr)
+            build_corpus(corpus, args.count, args.small, args.huge, seed=args.seed)
+        report = run_suite(corpus, names, args.box, args.repeat)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,449 @@
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image
+
+from encoding_presets import MAX_SIDE, OUTPUT_FORMATS, merge_encoding, save_options, scaled_size
+from encoding_presets import label as encoding_label
+from jpeg_lossless import JPEG_EXTENSIONS, crop_lossless
+from orientation import exif_orientation, orient, stored_box
+from profiling import StageTimer
+from roi import decode_region, open_unchecked
+
+# Jobs submitted per worker ahead of the one being yielded: keeps the pool busy
+# without turning the whole input listing into pending futures.
+_PREFETCH_PER_WORKER = 4
+
+Box = Tuple[int, int, int, int]
+# A path, the encoded bytes of an image or a binary file object.
+Source = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+class CropTarget(NamedTuple):
+    """One crop to produce from every input image."""
+
+    subfolder: str
+    box: Tuple[int, int, int, int]
+    encoding: Optional[Dict[str, object]] = None
+
+
+class CropResult(NamedTuple):
+    """Outcome of one :func:`crop_job`, sent back from the worker processes."""
+
+    warning: Optional[str]
+    error: Optional[str]
+    seconds: float
+    profile: Optional[Dict[str, float]] = None
+    # One ``(encoding label, seconds, bytes)`` entry per output written.
+    encodes: Tuple[Tuple[str, float, int], ...] = ()
+
+
+def encode_image(image: Image.Image, output_path: str, encoding: Optional[Dict[str, object]] = None) -> bytes:
+    """Encode ``image`` in the format implied by the extension of ``output_path``.
+
+    ``encoding`` is a spec from :mod:`encoding_presets`; modes the target
+    format cannot store (e.g. RGBA or palette as JPEG) are converted first.
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    image_format = Image.registered_extensions().get(extension)
+    if image_format is None:
+        raise ValueError(f"Formato di output non riconosciuto per '{output_path}'.")
+    return encode_as(image, image_format, encoding)
+
+
+def encode_as(image: Image.Image, image_format: str, encoding: Optional[Dict[str, object]] = None) -> bytes:
+    """Encode ``image`` as the Pillow format ``image_format`` (``'PNG'``, ``'JPEG'``...)."""
+    if image_format == 'JPEG' and image.mode not in ('1', 'L', 'RGB', 'CMYK'):
+        image = image.convert('RGB')
+    elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    options = save_options(encoding, image_format)
+    for key in ('icc_profile', 'dpi'):
+        if image.info.get(key):
+            options.setdefault(key, image.info[key])
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def read_input(input_path: str) -> bytes:
+    with open(input_path, 'rb') as fh:
+        return fh.read()
+
+
+def write_output(output_path: str, data: bytes) -> None:
+    with open(output_path, 'wb') as fh:
+        fh.write(data)
+
+
+def crop_bytes(
+    data: bytes,
+    outputs,
+    jpegtran: Optional[str] = None,
+    timer: Optional[StageTimer] = None,
+    encodes: Optional[List[Tuple[str, float, int]]] = None,
+    roi: bool = False,
+) -> Tuple[List[Tuple[str, bytes]], Optional[str]]:
+    """Crop the encoded image ``data`` into every ``(crop_box, output_path, encoding)``.
+
+    Pure CPU work: returns the ``(output_path, encoded bytes)`` pairs to write
+    and a warning to log, if any. The image is decoded once whatever the
+    number of outputs. With ``jpegtran`` set, baseline JPEGs written as JPEG
+    are cropped losslessly in the DCT domain; anything else is decoded,
+    cropped and re-encoded. When a ``timer`` is given, each stage is charged
+    to it; ``encodes`` receives the encoding label, seconds and bytes of each
+    output. With ``roi`` only the part of the image covering the boxes is
+    decoded where the format allows it (see :func:`roi.decode_region`).
+    Boxes are on the image as displayed: with an EXIF orientation they are
+    mapped to the stored pixels and only the crops are rotated; the ICC
+    profile and DPI of the source are kept on the outputs.
+    Outputs whose encoding sets ``max_side`` are derivatives: the crop scaled
+    down, successively from the largest size to the smallest. When only
+    derivatives are needed, JPEGs are decoded at a reduced DCT scale.
+    """
+    warnings: List[str] = []
+    encoded: List[Tuple[str, bytes]] = []
+    remaining = []
+    # Only the header is parsed here; with roi the size check is left to decode_region.
+    img = (open_unchecked(data) if roi else None) or Image.open(io.BytesIO(data))
+    orientation = exif_orientation(img)
+    if timer is not None:
+        timer.lap('open')
+    for crop_box, output_path, encoding in outputs:
+        lossless = None
+        if (
+            jpegtran
+            and orientation == 1
+            and not (encoding or {}).get(MAX_SIDE)
+            and output_path.lower().endswith(JPEG_EXTENSIONS)
+        ):
+            start = time.perf_counter()
+            lossless = crop_lossless(data, tuple(crop_box), jpegtran)
+        if lossless is None:
+            remaining.append((crop_box, output_path, encoding))
+            continue
+        blob, used_box = lossless
+        encoded.append((output_path, blob))
+        if encodes is not None:
+            encodes.append(('lossless', time.perf_counter() - start, len(blob)))
+        if timer is not None:
+            # jpegtran parses, crops and re-serializes in one go: charge it all to "crop".
+            timer.lap('crop')
+        if used_box != tuple(crop_box):
+            warnings.append(
+                f"area allineata ai blocchi MCU per il ritaglio JPEG senza perdita: {tuple(crop_box)} -> {used_box}"
+            )
+    if not remaining:
+        img.close()
+        return encoded, '; '.join(warnings) or None
+
+    # Boxes are given on the image as displayed: map them to the stored pixels,
+    # so only the crops, never the whole image, are rotated.
+    stored = {tuple(output[0]): stored_box(output[0], orientation, img.size) for output in remaining}
+    if roi:
+        img.close()
+        img, origin = decode_region(data, bounding_box(stored.values()))
+        factor = 1
+    else:
+        origin = (0, 0)
+        factor = _draft_factor(img, remaining)
+        img.load()
+    with img:
+        if timer is not None:
+            timer.lap('decode')
+        # Full-size crops first, then derivatives from the largest down: each one
+        # is scaled from the previous (smaller) image of the same box.
+        remaining.sort(key=lambda output: -(output[2] or {}).get(MAX_SIDE, float('inf')))
+        scaled: Dict[Box, Image.Image] = {}
+        for crop_box, output_path, encoding in remaining:
+            box = tuple(crop_box)
+            max_side = (encoding or {}).get(MAX_SIDE)
+            cropped = scaled.get(box)
+            if cropped is None:
+                cropped = orient(img.crop(_reduce_box(shift_box(stored[box], origin), factor)), orientation)
+            if max_side:
+                size = scaled_size((box[2] - box[0], box[3] - box[1]), max_side)
+                if cropped.size != size:
+                    cropped = cropped.resize(size, Image.LANCZOS)
+            scaled[box] = cropped
+            if timer is not None:
+                timer.lap('crop')
+            start = time.perf_counter()
+            blob = encode_image(cropped, output_path, encoding)
+            if encodes is not None:
+                encodes.append((encoding_label(encoding), time.perf_counter() - start, len(blob)))
+            if timer is not None:
+                timer.lap('encode')
+            encoded.append((output_path, blob))
+    return encoded, '; '.join(warnings) or None
+
+
+def _draft_factor(img: Image.Image, outputs) -> int:
+    """Decode a JPEG at 1/2, 1/4 or 1/8 scale when every output is a small enough derivative.
+
+    Returns the scale factor applied (1 when the image is decoded at full size).
+    """
+    if img.format != 'JPEG':
+        return 1
+    factor = 8
+    for crop_box, _, encoding in outputs:
+        max_side = (encoding or {}).get(MAX_SIDE)
+        longest = max(crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+        if not max_side or max_side >= longest:
+            return 1
+        while factor > 1 and longest / factor < max_side:
+            factor //= 2
+    if factor == 1:
+        return 1
+    width, height = img.size
+    img.draft(img.mode, (-(-width // factor), -(-height // factor)))
+    return round(width / img.size[0])
+
+
+def _reduce_box(box: Box, factor: int) -> Box:
+    if factor == 1:
+        return box
+    left, top, right, bottom = box
+    return left // factor, top // factor, -(-right // factor), -(-bottom // factor)
+
+
+def crop_file(
+    input_path: str,
+    outputs,
+    jpegtran: Optional[str] = None,
+    timer: Optional[StageTimer] = None,
+    encodes: Optional[List[Tuple[str, float, int]]] = None,
+    roi: bool = False,
+) -> Optional[str]:
+    """Read ``input_path``, crop it with :func:`crop_bytes` and write every output.
+
+    Returns a warning to log, if any.
+    """
+    data = read_input(input_path)
+    if timer is not None:
+        timer.bytes_read += len(data)
+        timer.lap('read')
+    encoded, warning = crop_bytes(data, outputs, jpegtran, timer, encodes, roi)
+    for output_path, blob in encoded:
+        write_output(output_path, blob)
+        if timer is not None:
+            timer.bytes_written += len(blob)
+            timer.lap('write')
+    return warning
+
+
+def crop_job(
+    input_path: str,
+    outputs,
+    jpegtran: Optional[str],
+    profile: bool = False,
+    roi: bool = False,
+) -> CropResult:
+    """Run :func:`crop_file` and return a :class:`CropResult` instead of raising."""
+    start = time.perf_counter()
+    timer = StageTimer() if profile else None
+    encodes: List[Tuple[str, float, int]] = []
+    try:
+        warning = crop_file(input_path, outputs, jpegtran, timer, encodes, roi)
+    except Exception as exc:  # a bad file must not abort the whole batch
+        return CropResult(None, f"{type(exc).__name__}: {exc}", time.perf_counter() - start)
+    return CropResult(
+        warning,
+        None,
+        time.perf_counter() - start,
+        timer.as_dict() if timer else None,
+        tuple(encodes),
+    )
+
+
+def run_ordered(
+    jobs: Iterable[Tuple[str, str, tuple]],
+    workers: int,
+    jpegtran: Optional[str] = None,
+    profile: bool = False,
+    cancel=None,
+    roi: bool = False,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> Iterator[Tuple[str, CropResult]]:
+    """Yield ``(fname, result)`` for every ``(fname, input_path, outputs)`` job, in input order.
+
+    ``outputs`` are the ``(crop_box, output_path, encoding)`` triples of
+    :func:`crop_bytes`. With ``workers > 1`` the files are cropped by a
+    process pool, ``executor`` when given (e.g. one kept warm by a server)
+    or a new one. Once ``cancel`` (a :class:`threading.Event`) is set no new
+    job is started: queued jobs are dropped and only those already running
+    are still yielded.
+    """
+    if workers <= 1 and executor is None:
+        for fname, input_path, outputs in jobs:
+            if cancel is not None and cancel.is_set():
+                return
+            yield fname, crop_job(input_path, outputs, jpegtran, profile, roi)
+        return
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from run_ordered(jobs, workers, jpegtran, profile, cancel, roi, executor)
+        return
+    window = max(1, workers) * _PREFETCH_PER_WORKER
+    pending = deque()
+    replacement = None  # the pool started after a worker died, shut down here
+    try:
+        for fname, input_path, outputs in jobs:
+            if cancel is not None and cancel.is_set():
+                break
+            args = (crop_job, input_path, outputs, jpegtran, profile, roi)
+            try:
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory): its files already
+                # failed, the rest of the batch goes on in a fresh pool.
+                if replacement is not None:
+                    replacement.shutdown(wait=False)
+                executor = replacement = ProcessPoolExecutor(max_workers=max(1, workers))
+                future = executor.submit(*args)
+            pending.append((fname, future))
+            if len(pending) >= window:
+                yield _collect(*pending.popleft())
+        while pending:
+            if cancel is not None and cancel.is_set():
+                pending = deque(item for item in pending if not item[1].cancel())
+                if not pending:
+                    break
+            yield _collect(*pending.popleft())
+    finally:
+        if replacement is not None:
+            replacement.shutdown(cancel_futures=True)
+
+
+def _collect(fname: str, future) -> Tuple[str, CropResult]:
+    """``(fname, result)`` of a pool job; a file lost with a dead worker gets an error result."""
+    try:
+        return fname, future.result()
+    except BrokenProcessPool as exc:
+        return fname, CropResult(None, f"{type(exc).__name__}: {exc}", 0.0)
+
+
+def as_targets(crop_box) -> List[CropTarget]:
+    """Normalize ``crop_box`` (a box, a ``{subfolder: box}`` mapping or targets) to targets."""
+    if isinstance(crop_box, dict):
+        return [CropTarget(subfolder, tuple(box)) for subfolder, box in crop_box.items()]
+    if crop_box and isinstance(crop_box[0], CropTarget):
+        return list(crop_box)
+    return [CropTarget('', tuple(crop_box))]
+
+
+def bounding_box(boxes: Iterable[Box]) -> Box:
+    """Smallest box containing every box of ``boxes``."""
+    lefts, tops, rights, bottoms = zip(*boxes)
+    return min(lefts), min(tops), max(rights), max(bottoms)
+
+
+def shift_box(box: Box, origin: Tuple[int, int]) -> Box:
+    """``box`` in the coordinates of a region whose top-left pixel is at ``origin``."""
+    left, top, right, bottom = box
+    return left - origin[0], top - origin[1], right - origin[0], bottom - origin[1]
+
+
+def template_box(template) -> Box:
+    """Return the crop box of a template from :func:`template_manager.load_template`, or of a box."""
+    if isinstance(template, dict):
+        return (template['left'], template['top'], template['right'], template['bottom'])
+    return tuple(template)
+
+
+def _source_bytes(source: Source) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        return read_input(os.fspath(source))
+    return source.read()
+
+
+def _crop_source(
+    source: Source,
+    box: Box,
+    encoding: Optional[Dict[str, object]],
+    as_image: bool,
+    roi: bool = False,
+) -> Union[bytes, Image.Image]:
+    data = _source_bytes(source)
+    header = (open_unchecked(data) if roi else None) or Image.open(io.BytesIO(data))
+    orientation = exif_orientation(header)
+    box = stored_box(box, orientation, header.size)
+    if roi:
+        header.close()
+        img, origin = decode_region(data, box)
+    else:
+        img, origin = header, (0, 0)
+    with img:
+        source_format = img.format
+        cropped = orient(img.crop(shift_box(box, origin)), orientation)
+    if as_image:
+        return cropped
+    if encoding and 'format' in encoding:
+        image_format = OUTPUT_FORMATS[str(encoding['format'])][0]
+    else:
+        image_format = source_format if source_format in ('PNG', 'JPEG', 'WEBP') else 'PNG'
+    return encode_as(cropped, image_format, encoding)
+
+
+def crop_image(
+    source: Source,
+    template,
+    encoding: Optional[Dict[str, object]] = None,
+    as_image: bool = False,
+    roi: bool = False,
+) -> Union[bytes, Image.Image]:
+    """Crop one image in memory and return the encoded crop (or a PIL image with ``as_image``).
+
+    ``source`` is a path, the encoded bytes or a binary file object;
+    ``template`` is a template from :func:`template_manager.load_template` or
+    a plain ``(left, top, right, bottom)`` box. The crop is encoded with the
+    template's encoding updated by ``encoding``, in its ``format`` if set and
+    otherwise in the format of the source. ``roi`` decodes only the part of
+    the source the box needs, as in :func:`crop_bytes`.
+    """
+    encoding = merge_encoding(template.get('encoding') if isinstance(template, dict) else None, encoding)
+    return _crop_source(source, template_box(template), encoding, as_image, roi)
+
+
+def crop_images(
+    sources: Iterable[Source],
+    template,
+    encoding: Optional[Dict[str, object]] = None,
+    as_image: bool = False,
+    workers: int = 1,
+    roi: bool = False,
+) -> Iterator[Union[bytes, Image.Image]]:
+    """Lazily yield :func:`crop_image` of every source, in order.
+
+    With ``workers > 1`` the crops run in a process pool, a bounded number of
+    sources ahead of the consumer. File objects are read in the calling
+    process; paths are read by the workers. The first failing source raises
+    its exception when its result is reached.
+    """
+    encoding = merge_encoding(template.get('encoding') if isinstance(template, dict) else None, encoding)
+    box = template_box(template)
+    if workers <= 1:
+        for source in sources:
+            yield _crop_source(source, box, encoding, as_image, roi)
+        return
+
+    window = workers * _PREFETCH_PER_WORKER
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for source in sources:
+            if not isinstance(source, (str, os.PathLike, bytes, bytearray)):
+                source = _source_bytes(source)
+            pending.append(executor.submit(_crop_source, source, box, encoding, as_image, roi))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
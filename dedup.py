@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEDUP_FILENAME = ".bulk_crop_dedup.json"
+DEDUP_VERSION = 1
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_digest(path: str) -> str:
+    """BLAKE2b-128 of a file, streamed in fixed-size chunks (faster than SHA-256 on 64-bit CPUs)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_key(digest: str, box: Sequence[int], encoding: Optional[Dict[str, object]]) -> str:
+    """Key of the crop of content ``digest`` with ``box`` and ``encoding``."""
+    spec = json.dumps([list(box), encoding], sort_keys=True)
+    return f"{digest}:{hashlib.blake2b(spec.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def link_or_copy(source: str, dest: str) -> bool:
+    """Make ``dest`` a hardlink of ``source``, or a copy where links are not possible.
+
+    Returns whether a hardlink was made. An existing ``dest`` is replaced.
+    """
+    try:
+        os.unlink(dest)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(source, dest)
+        return True
+    except OSError:
+        shutil.copyfile(source, dest)
+        return False
+
+
+class DedupIndex:
+    """Content hashes of the inputs and the outputs already produced from each content.
+
+    ``inputs`` caches the digest of each input by size and mtime, so unchanged
+    files are not hashed again; ``outputs`` maps :func:`output_key` to the
+    output written for that content, with its size and mtime to check it was
+    not replaced since. Both persist in the output folder, so a re-upload is
+    recognized in a later batch too.
+    """
+
+    def __init__(self, output_folder: str, filename: str = DEDUP_FILENAME):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, filename)
+        self.inputs: Dict[str, List[object]] = {}
+        self.outputs: Dict[str, List[object]] = {}
+        # Content being cropped in this run -> name of the input cropping it,
+        # and the duplicates waiting for that crop.
+        self.in_flight: Dict[str, str] = {}
+        self.waiting: Dict[str, List[tuple]] = {}
+        self.hashed = 0
+        self.saved = 0
+        self.linked = 0
+        self.copied = 0
+
+    @classmethod
+    def load(cls, output_folder: str, filename: str = DEDUP_FILENAME, force: bool = False) -> "DedupIndex":
+        """Load the index of ``output_folder``; with ``force`` earlier outputs are not reused."""
+        index = cls(output_folder, filename)
+        try:
+            with open(index.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return index
+        if data.get("version") == DEDUP_VERSION:
+            index.inputs = dict(data.get("inputs") or {})
+            if not force:
+                index.outputs = dict(data.get("outputs") or {})
+        return index
+
+    def digest(self, name: str, input_path: str, stat: os.stat_result) -> str:
+        """Digest of ``input_path``, hashed only when its size or mtime changed."""
+        cached = self.inputs.get(name)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return str(cached[2])
+        digest = content_digest(input_path)
+        self.hashed += 1
+        self.inputs[name] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def job_key(self, digest: str, outputs: Sequence[tuple]) -> str:
+        """Key shared by the inputs with this content and these ``(box, output_path, encoding)`` jobs."""
+        return "|".join(output_key(digest, box, encoding) for box, _, encoding in outputs)
+
+    def existing(self, digest: str, outputs: Sequence[tuple]) -> Optional[List[str]]:
+        """Paths of earlier outputs matching every job of ``outputs``, or ``None`` if one is missing."""
+        sources = []
+        for box, output_path, encoding in outputs:
+            entry = self.outputs.get(output_key(digest, box, encoding))
+            if entry is None:
+                return None
+            source = os.path.join(self.output_folder, str(entry[0]))
+            try:
+                stat = os.stat(source)
+            except OSError:
+                return None
+            if stat.st_size != entry[1] or stat.st_mtime_ns != entry[2]:
+                return None
+            sources.append(source)
+        return sources
+
+    def record(self, digest: str, outputs: Sequence[tuple]) -> None:
+        """Remember the outputs just written for content ``digest``."""
+        for box, output_path, encoding in outputs:
+            stat = os.stat(output_path)
+            rel_path = os.path.relpath(output_path, self.output_folder).replace(os.sep, "/")
+            self.outputs[output_key(digest, box, encoding)] = [rel_path, stat.st_size, stat.st_mtime_ns]
+
+    def materialize(self, sources: Sequence[str], outputs: Sequence[tuple]) -> None:
+        """Create the outputs of a duplicate input from ``sources``, without decoding it."""
+        for source, (_, output_path, _) in zip(sources, outputs):
+            if os.path.abspath(source) == os.path.abspath(output_path):
+                continue
+            if link_or_copy(source, output_path):
+                self.linked += 1
+            else:
+                self.copied += 1
+        self.saved += 1
+
+    def summary(self) -> str:
+        return (
+            f"Deduplicazione: {self.saved} decodifiche risparmiate su input duplicati "
+            f"({self.linked} hardlink, {self.copied} copie); {self.hashed} file sottoposti a hash."
+        )
+
+    def save(self) -> None:
+        """Write the index atomically next to the outputs."""
+        data = {"version": DEDUP_VERSION, "inputs": self.inputs, "outputs": self.outputs}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def unlink_outputs(outputs: Sequence[Tuple[object, str, object]]) -> None:
+    """Remove the current outputs before they are rewritten, so files hardlinked to them keep their content."""
+    for _, output_path, _ in outputs:
+        try:
+            os.unlink(output_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,10 @@
+import os
+
+# Kept apart from the modules that use them so the command line can be parsed
+# (and ``--list`` answered) without importing Pillow.
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Staged pipeline (see pipeline.py): I/O threads and queue bounds.
+DEFAULT_READ_THREADS = 4
+DEFAULT_WRITE_THREADS = 4
+DEFAULT_READ_AHEAD = 16
+DEFAULT_WRITE_QUEUE = 16
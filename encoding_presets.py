@@ -0,0 +1,144 @@
+import os
+from typing import Dict, Optional, Tuple
+
+DEFAULT_PRESET = "default"
+# Save parameters per preset and Pillow format. "default" keeps Pillow's own defaults.
+PRESETS: Dict[str, Dict[str, Dict[str, object]]] = {
+    DEFAULT_PRESET: {"PNG": {}, "JPEG": {}, "WEBP": {}},
+    "fast": {
+        "PNG": {"compress_level": 1},
+        "JPEG": {"quality": 85, "subsampling": 2, "optimize": False},
+        "WEBP": {"quality": 80, "method": 0},
+    },
+    "balanced": {
+        "PNG": {"compress_level": 6},
+        "JPEG": {"quality": 90, "subsampling": 2},
+        "WEBP": {"quality": 85, "method": 4},
+    },
+    "small": {
+        "PNG": {"compress_level": 9, "optimize": True},
+        "JPEG": {"quality": 75, "subsampling": 2, "optimize": True, "progressive": True},
+        "WEBP": {"quality": 75, "method": 6},
+    },
+}
+# Output format name -> (Pillow format, file extension).
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+# Explicit overrides, their type and the formats they apply to.
+OVERRIDES = {
+    "quality": (int, ("JPEG", "WEBP")),
+    "compress_level": (int, ("PNG",)),
+    "subsampling": (int, ("JPEG",)),
+    "optimize": (bool, ("PNG", "JPEG")),
+    "progressive": (bool, ("JPEG",)),
+    "method": (int, ("WEBP",)),
+}
+# Spec key set on derivatives: longest side, in pixels, the crop is scaled down to.
+MAX_SIDE = "max_side"
+_RANGES = {"quality": (1, 100), "compress_level": (0, 9), "subsampling": (0, 2), "method": (0, 6)}
+
+
+class EncodingError(ValueError):
+    """Raised for an unknown preset, format or out-of-range override."""
+
+
+def build_encoding(
+    preset: Optional[str] = None,
+    output_format: Optional[str] = None,
+    **overrides,
+) -> Dict[str, object]:
+    """Validate and return an encoding spec; unset values are left out.
+
+    A spec is a plain dict (``preset``, ``format`` and any override from
+    :data:`OVERRIDES`), so it can live in template JSON and cross process
+    boundaries unchanged.
+    """
+    spec: Dict[str, object] = {}
+    if preset is not None:
+        if preset not in PRESETS:
+            raise EncodingError(f"Preset '{preset}' sconosciuto. Disponibili: {', '.join(PRESETS)}.")
+        spec["preset"] = preset
+    if output_format is not None:
+        output_format = str(output_format).lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise EncodingError(f"Formato '{output_format}' non supportato. Disponibili: {', '.join(OUTPUT_FORMATS)}.")
+        spec["format"] = output_format
+    for key, value in overrides.items():
+        if value is None:
+            continue
+        if key not in OVERRIDES:
+            raise EncodingError(f"Opzione di codifica '{key}' sconosciuta.")
+        kind = OVERRIDES[key][0]
+        try:
+            value = kind(value)
+        except (TypeError, ValueError) as exc:
+            raise EncodingError(f"Valore non valido per '{key}': {value!r}.") from exc
+        low, high = _RANGES.get(key, (value, value))
+        if kind is int and not low <= value <= high:
+            raise EncodingError(f"'{key}' deve essere tra {low} e {high}.")
+        spec[key] = value
+    return spec
+
+
+def encoding_from_dict(data: Optional[Dict[str, object]]) -> Dict[str, object]:
+    """Build a spec from a template's ``encoding`` object."""
+    if not data:
+        return {}
+    if not isinstance(data, dict):
+        raise EncodingError("'encoding' deve essere un oggetto.")
+    values = dict(data)
+    return build_encoding(values.pop("preset", None), values.pop("format", None), **values)
+
+
+def merge_encoding(base: Optional[Dict[str, object]], override: Optional[Dict[str, object]]) -> Dict[str, object]:
+    """Return ``base`` updated with the values set in ``override``."""
+    merged = dict(base or {})
+    merged.update(override or {})
+    return merged
+
+
+def output_name(rel_path: str, spec: Optional[Dict[str, object]]) -> str:
+    """Return the output path for ``rel_path``, with the extension of the requested format."""
+    if not spec or "format" not in spec:
+        return rel_path
+    return os.path.splitext(rel_path)[0] + OUTPUT_FORMATS[str(spec["format"])][1]
+
+
+def with_max_side(spec: Optional[Dict[str, object]], max_side: int) -> Dict[str, object]:
+    """Spec of a derivative: ``spec`` scaled so the longest side is at most ``max_side``."""
+    return {**(spec or {}), MAX_SIDE: int(max_side)}
+
+
+def scaled_size(size: Tuple[int, int], max_side: Optional[int]) -> Tuple[int, int]:
+    """``size`` shrunk (never enlarged) so its longest side is ``max_side``, keeping the aspect ratio."""
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    ratio = max_side / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def save_options(spec: Optional[Dict[str, object]], image_format: str) -> Dict[str, object]:
+    """Pillow ``save`` keyword arguments for ``image_format`` under ``spec``."""
+    spec = spec or {}
+    options = dict(PRESETS[str(spec.get("preset", DEFAULT_PRESET))].get(image_format, {}))
+    for key, (_, formats) in OVERRIDES.items():
+        if key in spec and image_format in formats:
+            options[key] = spec[key]
+    return options
+
+
+def label(spec: Optional[Dict[str, object]]) -> str:
+    """Short human-readable name of a spec, used to group the run summary."""
+    spec = spec or {}
+    parts = [str(spec.get("preset", DEFAULT_PRESET))]
+    if "format" in spec:
+        parts.append(f"->{spec['format']}")
+    parts.extend(f"{key}={spec[key]}" for key in OVERRIDES if key in spec)
+    if MAX_SIDE in spec:
+        parts.append(f"max={spec[MAX_SIDE]}px")
+    return " ".join(parts)
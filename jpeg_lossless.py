@@ -0,0 +1,139 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+JPEGTRAN_BINARY = "jpegtran"
+
+# Huffman-coded sequential frames: the only ones cropped losslessly. Progressive
+# (SOF2/SOF6), lossless (SOF3/SOF7) and arithmetic-coded frames use the decode path.
+_SEQUENTIAL_SOF = {0xC0, 0xC1}
+_ALL_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+_SOS = 0xDA
+
+
+class LosslessCropError(RuntimeError):
+    """Raised when jpegtran fails on a file that looked croppable."""
+
+
+def find_jpegtran() -> Optional[str]:
+    """Return the path of the jpegtran executable, if installed."""
+    return shutil.which(JPEGTRAN_BINARY)
+
+
+def read_jpeg_header(source: Union[str, bytes]) -> Optional[Dict[str, int]]:
+    """Parse the frame header of a JPEG (a path or its bytes) without decoding pixel data.
+
+    Returns ``None`` when the data is not a JPEG. The result holds the frame
+    marker, the image size and the MCU size derived from the sampling factors.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _read_header(io.BytesIO(source))
+    with open(source, "rb") as fh:
+        return _read_header(fh)
+
+
+def _read_header(fh: BinaryIO) -> Optional[Dict[str, int]]:
+    if fh.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        byte = fh.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = fh.read(1)
+        while marker == b"\xff":
+            marker = fh.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code in _STANDALONE_MARKERS:
+            continue
+        raw_length = fh.read(2)
+        if len(raw_length) < 2:
+            return None
+        (length,) = struct.unpack(">H", raw_length)
+        if code in _ALL_SOF:
+            payload = fh.read(length - 2)
+            return _parse_frame(code, payload)
+        if code == _SOS:
+            return None
+        fh.seek(length - 2, os.SEEK_CUR)
+
+
+def _parse_frame(code: int, payload: bytes) -> Optional[Dict[str, int]]:
+    if len(payload) < 6:
+        return None
+    _, height, width, components = struct.unpack(">BHHB", payload[:6])
+    max_h = max_v = 1
+    for index in range(components):
+        offset = 6 + index * 3
+        if offset + 2 > len(payload):
+            return None
+        sampling = payload[offset + 1]
+        max_h = max(max_h, sampling >> 4)
+        max_v = max(max_v, sampling & 0x0F)
+    # A single-component scan is non-interleaved: its MCU is one 8x8 block.
+    if components == 1:
+        max_h = max_v = 1
+    return {
+        "marker": code,
+        "width": width,
+        "height": height,
+        "components": components,
+        "mcu_width": 8 * max_h,
+        "mcu_height": 8 * max_v,
+    }
+
+
+def snap_to_mcu(crop_box: Tuple[int, int, int, int], header: Dict[str, int]) -> Tuple[int, int, int, int]:
+    """Move the top-left corner of ``crop_box`` down to the enclosing MCU boundary.
+
+    The right and bottom edges are kept: a partial MCU on those sides is valid
+    in the output stream, so only ``left``/``top`` ever grow the crop.
+    """
+    left, top, right, bottom = crop_box
+    left -= left % header["mcu_width"]
+    top -= top % header["mcu_height"]
+    return left, top, right, bottom
+
+
+def is_croppable(crop_box: Tuple[int, int, int, int], header: Optional[Dict[str, int]]) -> bool:
+    """Whether the file can be cropped in the DCT domain with the given box."""
+    if header is None or header["marker"] not in _SEQUENTIAL_SOF:
+        return False
+    left, top, right, bottom = crop_box
+    # Out-of-bounds boxes are padded by the decode path; keep that behaviour.
+    return left >= 0 and top >= 0 and right <= header["width"] and bottom <= header["height"]
+
+
+def crop_lossless(
+    data: bytes,
+    crop_box: Tuple[int, int, int, int],
+    jpegtran: str,
+) -> Optional[Tuple[bytes, Tuple[int, int, int, int]]]:
+    """Crop a baseline JPEG by rewriting its entropy-coded MCUs with jpegtran.
+
+    The JPEG travels through jpegtran's stdin/stdout, so no temporary file is
+    needed. Returns the cropped JPEG and the MCU-aligned box actually used,
+    or ``None`` when the data is not eligible (not a JPEG, progressive,
+    arithmetic-coded, box out of bounds) and the caller should use the
+    decode path instead.
+    """
+    header = read_jpeg_header(data)
+    if not is_croppable(crop_box, header):
+        return None
+
+    left, top, right, bottom = snap_to_mcu(crop_box, header)
+    geometry = f"{right - left}x{bottom - top}+{left}+{top}"
+    command = [jpegtran, "-copy", "all", "-crop", geometry]
+    result = subprocess.run(command, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", "replace").strip()
+        raise LosslessCropError(f"jpegtran ha restituito {result.returncode}: {message}")
+    return result.stdout, (left, top, right, bottom)
@@ -1,74 +1,768 @@
+from __future__ import annotations
+
 import argparse
 import os
-from typing import Iterable
-
-from PIL import Image
+import posixpath
+import sys
+import tarfile
+import time
+import zipfile
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
+# Modules that import Pillow (crop_engine, pipeline, preflight, scheduler) are
+# imported where they are used, so ``--list``, ``--search`` and the server
+# client start without loading it.
+from archives import ArchiveError, ArchiveWriter, FolderWriter, crop_members, is_archive, iter_members
+from batch import is_selected, iter_image_files, plan_outputs, record_outputs
+from dedup import DEDUP_FILENAME, DedupIndex, unlink_outputs
+from defaults import (
+    DEFAULT_READ_AHEAD,
+    DEFAULT_READ_THREADS,
+    DEFAULT_WORKERS,
+    DEFAULT_WRITE_QUEUE,
+    DEFAULT_WRITE_THREADS,
+)
+from encoding_presets import OUTPUT_FORMATS, PRESETS, EncodingError, build_encoding, merge_encoding, with_max_side
+from encoding_presets import output_name as encoded_output_name
+from jpeg_lossless import find_jpegtran
+from manifest import MANIFEST_FILENAME, Manifest
+from profiling import DEFAULT_SLOWEST, Profiler
+from sharding import ShardError, ShardLog, load_logs, manifest_filename, parse_shard, verify_coverage
 from template_manager import (
     DEFAULT_TEMPLATE_NAME,
     TemplateError,
     list_templates,
     load_template,
+    load_template_group,
+    save_template,
+    search_templates,
 )
 
-VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+if TYPE_CHECKING:
+    from crop_engine import CropTarget
+
 DEFAULT_INPUT_FOLDER = 'input'
 DEFAULT_OUTPUT_FOLDER = 'output'
+# Completed files between manifest checkpoints, so an interrupted run keeps its progress.
+_MANIFEST_SAVE_INTERVAL = 500
+
+
+def _print_encoding_summary(totals: Dict[str, List[float]]) -> None:
+    print('Codifica per preset:')
+    for name, (count, seconds, size) in sorted(totals.items()):
+        print(
+            f" - {name}: {int(count)} file, {seconds:.2f}s ({seconds / count * 1000:.1f} ms/file), "
+            f"{size / 1e6:.2f} MB ({size / count / 1024:.1f} KiB/file)"
+        )
+
 
+def resolve_jpegtran(lossless_jpeg: bool) -> Optional[str]:
+    """Return the jpegtran to use for lossless mode, warning when it is missing."""
+    if not lossless_jpeg:
+        return None
+    jpegtran = find_jpegtran()
+    if jpegtran is None:
+        print('Attenzione: jpegtran non trovato, i JPEG verranno decodificati e ricompressi.')
+    return jpegtran
 
-def iter_image_files(folder: str) -> Iterable[str]:
-    for fname in sorted(os.listdir(folder)):
-        if fname.lower().endswith(VALID_EXTENSIONS):
-            yield fname
 
+def process_images(
+    input_folder: str,
+    output_folder: str,
+    crop_box,
+    workers: Optional[int] = None,
+    lossless_jpeg: bool = False,
+    manifests: Optional[Dict[str, Manifest]] = None,
+    prune: bool = False,
+    recursive: bool = False,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    sort: bool = True,
+    latencies: Optional[List[float]] = None,
+    profiler: Optional[Profiler] = None,
+    pipeline: Optional[Dict[str, int]] = None,
+    roi: bool = False,
+    shard: Optional[ShardLog] = None,
+    routes: Optional[Dict[Tuple[int, int], CropTarget]] = None,
+    dedup: Optional[DedupIndex] = None,
+    budget: Optional[int] = None,
+    executor=None,
+):
+    """Crop every image of ``input_folder`` and return how many were processed.
 
-def process_images(input_folder: str, output_folder: str, crop_box):
+    ``crop_box`` is either a single box, written straight into
+    ``output_folder``, or a ``{subfolder: box}`` mapping / list of
+    :class:`CropTarget`: each image is then decoded once and cropped into
+    every subfolder. ``manifests`` maps the same subfolders to their
+    :class:`Manifest`, so unchanged inputs are skipped.
+    When ``latencies`` is given, the seconds spent on each cropped image are
+    appended to it; a ``profiler`` receives the per-stage timings of each file.
+    ``pipeline`` switches to the staged runner of :mod:`pipeline` (reads and
+    writes on I/O threads, decoding in worker processes) and holds its
+    ``read_threads``/``write_threads``/``read_ahead``/``write_queue`` settings.
+    With ``roi`` only the rows/tiles covering the crop boxes are decoded.
+    With a ``shard`` log only the files of that shard are processed, and the
+    log, listing what the shard covered, is written into ``output_folder``.
+    ``routes`` maps image sizes to the target used instead of ``crop_box``
+    for images of that size; sizes are read from the image headers.
+    With a ``dedup`` index each distinct input content is cropped once: byte-identical
+    inputs get hardlinks (or copies) of the first one's outputs, also across runs.
+    With a ``budget`` (bytes) files are started as the estimated memory of
+    their decoded pixels allows (see :func:`scheduler.run_budgeted`) instead
+    of in fixed windows, and the budget use is reported at the end.
+    ``executor`` is a process pool to reuse (kept warm by :mod:`server`).
+    """
+    from crop_engine import as_targets, run_ordered
+    from preflight import read_header
+
+    targets = as_targets(crop_box)
+    manifests = manifests or {}
     os.makedirs(output_folder, exist_ok=True)
+    jpegtran = resolve_jpegtran(lossless_jpeg)
+
+    pending_records = {}
+    dedup_pending = {}
+    created_dirs = {output_folder}
+    skipped = 0
+    files = iter_image_files(
+        input_folder,
+        recursive=recursive,
+        include=include,
+        exclude=exclude,
+        sort=sort,
+        skip_dirs=(output_folder,),
+    )
+
+    if shard is not None:
+        shard.save(output_folder, finished=False)
+
     processed = 0
-    for fname in iter_image_files(input_folder):
-        input_path = os.path.join(input_folder, fname)
-        output_path = os.path.join(output_folder, fname)
-        with Image.open(input_path) as img:
-            cropped = img.crop(crop_box)
-            cropped.save(output_path)
+    # Headers read for routing, handed to the budget scheduler so it does not read them again.
+    routed_headers = {} if routes and budget is not None else None
+
+    def jobs():
+        nonlocal skipped, processed
+        for fname in files:
+            if shard is not None and not shard.owns(fname):
+                continue
+            input_path = os.path.join(input_folder, fname)
+            file_targets = targets
+            if routes:
+                header = read_header(input_path)
+                route = routes.get((header.width, header.height))
+                if route is not None:
+                    file_targets = [route]
+            stat, outputs, written = plan_outputs(
+                fname, input_path, output_folder, file_targets, manifests, created_dirs
+            )
+            if not outputs:
+                skipped += 1
+                if shard is not None:
+                    shard.covered.append(fname)
+                continue
+            if dedup is not None:
+                stat = stat or os.stat(input_path)
+                digest = dedup.digest(fname, input_path, stat)
+                sources = dedup.existing(digest, outputs)
+                if sources is not None:
+                    dedup.materialize(sources, outputs)
+                    print(f"Duplicato {fname}: ritagli collegati da un'esecuzione precedente")
+                    processed += 1
+                    record_outputs(fname, input_path, stat, written, manifests)
+                    if shard is not None:
+                        shard.covered.append(fname)
+                    continue
+                key = dedup.job_key(digest, outputs)
+                original = dedup.in_flight.get(key)
+                if original is not None:
+                    dedup.waiting[original].append((fname, input_path, stat, outputs, written))
+                    continue
+                dedup.in_flight[key] = fname
+                dedup.waiting[fname] = []
+                dedup_pending[fname] = (digest, outputs, key)
+                unlink_outputs(outputs)
+            pending_records[fname] = (stat, written)
+            if routed_headers is not None:
+                routed_headers[input_path] = header
+            yield fname, input_path, outputs
+
+    warned = set()
+    encoding_totals: Dict[str, List[float]] = {}
+    usage = None
+    if pipeline is not None:
+        from pipeline import run_pipelined
+
+        results = run_pipelined(
+            jobs(), workers or DEFAULT_WORKERS, jpegtran, profile=profiler is not None, roi=roi, **pipeline
+        )
+    elif budget is not None:
+        from scheduler import BudgetUsage, run_budgeted
+
+        usage = BudgetUsage(budget)
+        results = run_budgeted(
+            jobs(),
+            workers or DEFAULT_WORKERS,
+            budget,
+            jpegtran,
+            profile=profiler is not None,
+            roi=roi,
+            usage=usage,
+            executor=executor,
+            headers=routed_headers,
+        )
+    else:
+        results = run_ordered(
+            jobs(), workers or DEFAULT_WORKERS, jpegtran, profile=profiler is not None, roi=roi, executor=executor
+        )
+    for fname, result in results:
+        stat, written = pending_records.pop(fname)
+        duplicates = []
+        if dedup is not None:
+            digest, outputs, key = dedup_pending.pop(fname)
+            del dedup.in_flight[key]
+            duplicates = dedup.waiting.pop(fname)
+            if result.error is None:
+                dedup.record(digest, outputs)
+                sources = [output_path for _, output_path, _ in outputs]
+                for dup_name, dup_path, dup_stat, dup_outputs, dup_written in duplicates:
+                    dedup.materialize(sources, dup_outputs)
+                    print(f"Duplicato {dup_name}: ritagli collegati da {fname}")
+                    processed += 1
+                    record_outputs(dup_name, dup_path, dup_stat, dup_written, manifests)
+                    if shard is not None:
+                        shard.covered.append(dup_name)
+        if result.error is not None:
+            for failed_name in [fname] + [duplicate[0] for duplicate in duplicates]:
+                print(f"Errore su {failed_name}: {result.error}")
+                if shard is not None:
+                    shard.failed[failed_name] = result.error
+            continue
+        if latencies is not None:
+            latencies.append(result.seconds)
+        if profiler is not None:
+            profiler.add(fname, result.profile)
+        for name, seconds, size in result.encodes:
+            totals = encoding_totals.setdefault(name, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += size
+        if result.warning is not None and result.warning not in warned:
+            warned.add(result.warning)
+            print(f"Attenzione ({fname}): {result.warning}")
         print(f"Ritagliata {fname}")
         processed += 1
+        record_outputs(fname, os.path.join(input_folder, fname), stat, written, manifests)
+        if shard is not None:
+            shard.covered.append(fname)
+        if processed % _MANIFEST_SAVE_INTERVAL == 0:
+            for manifest in manifests.values():
+                manifest.save()
+            if dedup is not None:
+                dedup.save()
+            if shard is not None:
+                shard.save(output_folder, finished=False)
+
+    for subfolder, manifest in manifests.items():
+        if prune:
+            target_folder = os.path.join(output_folder, subfolder)
+            for removed in manifest.prune(input_folder, target_folder):
+                print(f"Rimossa {os.path.join(subfolder, removed)} (input non più presente)")
+            for old, new in manifest.prune_replaced(target_folder):
+                print(f"Rimossa {os.path.join(subfolder, old)} (sostituita da {new})")
+        manifest.save()
+    if shard is not None:
+        shard.save(output_folder)
+    if dedup is not None:
+        dedup.save()
+        print(dedup.summary())
+    if usage is not None:
+        for line in usage.report():
+            print(line)
+    if any(target.encoding for target in targets) and encoding_totals:
+        _print_encoding_summary(encoding_totals)
+    if skipped:
+        print(f"Saltate {skipped} immagini già ritagliate e invariate (usa --force per rifarle).")
+    return processed
+
+
+def process_archive(
+    input_path: str,
+    output_path: str,
+    crop_box,
+    workers: Optional[int] = None,
+    lossless_jpeg: bool = False,
+    recursive: bool = False,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    sort: bool = True,
+    roi: bool = False,
+):
+    """Crop images read from and/or written to a ZIP or tar archive; return how many were processed.
+
+    An input archive is read as a stream, member by member, and every member
+    path is kept (as with ``recursive`` on a folder). An output archive
+    receives the crops in input order through one large buffered sequential
+    writer (see :mod:`archives`); nothing is extracted or staged on disk.
+    Manifests are not used: every image is cropped.
+    """
+    from crop_engine import as_targets, read_input
+
+    targets = as_targets(crop_box)
+    jpegtran = resolve_jpegtran(lossless_jpeg)
+    if is_archive(input_path):
+        members = iter_members(input_path, lambda name: is_selected(name, include, exclude))
+    else:
+        names = iter_image_files(input_path, recursive=recursive, include=include, exclude=exclude, sort=sort)
+        members = ((name, read_input(os.path.join(input_path, name))) for name in names)
+
+    def jobs():
+        for name, data in members:
+            outputs = tuple(
+                (
+                    target.box,
+                    posixpath.join(target.subfolder, encoded_output_name(name, target.encoding)),
+                    target.encoding,
+                )
+                for target in targets
+            )
+            yield name, data, outputs
+
+    processed = 0
+    warned = set()
+    writer = ArchiveWriter(output_path) if is_archive(output_path) else FolderWriter(output_path)
+    with writer:
+        for name, result, encoded in crop_members(jobs(), workers or DEFAULT_WORKERS, jpegtran, roi):
+            if result.error is None:
+                try:
+                    for output_name, blob in encoded:
+                        writer.write(output_name, blob)
+                except (ArchiveError, OSError) as exc:
+                    result = result._replace(error=str(exc))
+            if result.error is not None:
+                print(f"Errore su {name}: {result.error}")
+                continue
+            if result.warning is not None and result.warning not in warned:
+                warned.add(result.warning)
+                print(f"Attenzione ({name}): {result.warning}")
+            print(f"Ritagliata {name}")
+            processed += 1
+    if is_archive(output_path):
+        print(f"Scritti {writer.count} file ({writer.size / 1e6:.1f} MB) in '{output_path}'.")
     return processed
 
 
-def parse_args():
+def auto_template(args) -> int:
+    """Detect the content box of a sample of the input images and store it as a template."""
+    from auto_template import AutoTemplateError, detect_box, template_data
+
+    names = iter_image_files(
+        args.input,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        skip_dirs=(args.output,),
+    )
+    paths = [os.path.join(args.input, name) for name in names]
+    try:
+        detected = detect_box(paths, sample=args.sample, margin=args.margin, workers=args.workers)
+        name = save_template(template_data(args.auto_template, detected), overwrite=args.force)
+    except (AutoTemplateError, TemplateError) as exc:
+        print(f"Errore: {exc}")
+        return 1
+    width, height = detected['image_size']
+    print(
+        f"Template '{name}' salvato da {detected['samples']} immagini {width}x{height}: "
+        f"sinistra={detected['left']}, sopra={detected['top']}, destra={detected['right']}, sotto={detected['bottom']}"
+    )
+    if detected['skipped']:
+        print(f"Ignorate {detected['skipped']} immagini campionate di dimensione diversa.")
+    if detected['unreadable']:
+        print(f"Ignorate {len(detected['unreadable'])} immagini campionate illeggibili:")
+        for path, error in detected['unreadable']:
+            print(f" - {os.path.relpath(path, args.input)}: {error}")
+    return 0
+
+
+def dry_run(args, templates: Dict[str, Dict[str, int]], routed: Dict[Tuple[int, int], Dict[str, int]]) -> int:
+    """Check every template against the input image sizes, reading only the headers."""
+    from crop_engine import template_box
+    from preflight import report, scan
+
+    names = iter_image_files(
+        args.input,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        sort=args.sort,
+        skip_dirs=(args.output,),
+    )
+    start = time.perf_counter()
+    headers = scan(args.input, names)
+    boxes = {template['template_name']: template_box(template) for template in templates.values()}
+    routes = {size: (template['template_name'], template_box(template)) for size, template in routed.items()}
+    lines, problems = report(headers, boxes, routes, time.perf_counter() - start)
+    for line in lines:
+        print(line)
+    return 1 if problems else 0
+
+
+def stack_output(args, template: Dict[str, object], executor=None) -> int:
+    """Crop every input image into one memory-mapped ``.npy`` array (see :mod:`npy_stack`)."""
+    from crop_engine import template_box
+    from npy_stack import StackError, StackWriter, fill_stack, index_path
+
+    names = list(
+        iter_image_files(
+            args.input,
+            recursive=args.recursive,
+            include=args.include,
+            exclude=args.exclude,
+            sort=args.sort,
+            skip_dirs=(args.output,),
+        )
+    )
+    if not names:
+        print('Nessuna immagine PNG o JPG trovata nella cartella di input.')
+        return 0
+    try:
+        writer = StackWriter(args.stack, names, template_box(template), args.stack_mode, template['template_name'])
+    except (StackError, OSError) as exc:
+        print(f"Errore: {exc}")
+        return 1
+    failed = 0
+    warned = set()
+    with writer:
+        input_paths = [os.path.join(args.input, name) for name in names]
+        for row, result in fill_stack(writer, input_paths, args.workers, args.roi, executor):
+            if result.error is not None:
+                print(f"Errore su {names[row]}: {result.error}")
+                writer.failed(row)
+                failed += 1
+            elif result.warning is not None and result.warning not in warned:
+                warned.add(result.warning)
+                print(f"Attenzione ({names[row]}): {result.warning}")
+    shape = 'x'.join(map(str, writer.shape))
+    print(
+        f"Array {shape} ({writer.nbytes / 1e6:.1f} MB) salvato in '{args.stack}', "
+        f"indice in '{index_path(args.stack)}'."
+    )
+    if failed:
+        print(f"{failed} righe lasciate a zero per errori (null nell'indice).")
+    print(f"Completato: {len(names) - failed} immagini ritagliate nell'array.")
+    return 1 if failed == len(names) else 0
+
+
+def merge_shards(args) -> int:
+    """Check the shard logs in the output folder against the current input listing."""
+    inputs = iter_image_files(
+        args.input,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        skip_dirs=(args.output,),
+    )
+    report, ok = verify_coverage(inputs, load_logs(args.output))
+    for line in report:
+        print(line)
+    print('Tutti gli input sono stati coperti una sola volta.' if ok else 'Copertura degli shard incompleta.')
+    return 0 if ok else 1
+
+
+def parse_args(argv: Optional[Sequence[str]] = None):
     parser = argparse.ArgumentParser(
         description='Ritaglia tutte le immagini nella cartella di input usando un template salvato.',
     )
     parser.add_argument(
         '-t',
         '--template',
-        default=DEFAULT_TEMPLATE_NAME,
-        help='Nome del template da usare (senza estensione).',
+        nargs='+',
+        default=[DEFAULT_TEMPLATE_NAME],
+        help='Nome del template da usare (senza estensione). Con più nomi ogni immagine viene '
+        'decodificata una sola volta e ritagliata in una sottocartella per template.',
+    )
+    parser.add_argument(
+        '-g',
+        '--template-group',
+        metavar='FILE',
+        help='File JSON con un gruppo di template da applicare insieme (sostituisce --template).',
     )
     parser.add_argument(
         '-i',
         '--input',
         default=DEFAULT_INPUT_FOLDER,
-        help='Cartella di input contenente le immagini.',
+        help='Cartella di input contenente le immagini, oppure un archivio ZIP/tar (.zip, .tar, .tar.gz, '
+        '.tgz, .tar.bz2, .tar.xz) letto in streaming senza estrarlo.',
     )
     parser.add_argument(
         '-o',
         '--output',
         default=DEFAULT_OUTPUT_FOLDER,
-        help='Cartella di output per le immagini ritagliate.',
+        help='Cartella di output per le immagini ritagliate, oppure un archivio ZIP/tar in cui '
+        'scriverle in sequenza con un buffer ampio.',
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='Avvia un server persistente su un socket Unix (vedi --socket) con template e worker già caricati.',
+    )
+    parser.add_argument(
+        '--socket',
+        metavar='PERCORSO',
+        help='Socket Unix del server. Con --serve è quello su cui ascoltare (predefinito: '
+        '$XDG_RUNTIME_DIR/bulk_crop.sock o /tmp/bulk_crop-UID.sock); altrimenti il comando viene '
+        'inviato al server e il client termina a lavoro finito (se il server non risponde, esegue in locale).',
     )
     parser.add_argument(
         '--list',
         action='store_true',
         help='Elenca i template disponibili e termina.',
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--search',
+        metavar='TESTO',
+        help='Cerca TESTO nel nome e nella descrizione dei template e termina.',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Numero di processi paralleli per il ritaglio (predefinito: {DEFAULT_WORKERS}).',
+    )
+    parser.add_argument(
+        '--lossless-jpeg',
+        action='store_true',
+        help='Ritaglia i JPEG baseline senza ricompressione (richiede jpegtran); '
+        "l'area viene allineata ai blocchi MCU.",
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Ritaglia tutte le immagini ignorando il manifest delle esecuzioni precedenti.',
+    )
+    parser.add_argument(
+        '--hash',
+        action='store_true',
+        help='Registra nel manifest anche lo SHA-256 degli input per riconoscere i file solo "toccati".',
+    )
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='Ritaglia una sola volta gli input con contenuto identico (hash BLAKE2b) e crea hardlink '
+        "o copie per i duplicati; l'indice degli hash resta nella cartella di output tra un'esecuzione e l'altra.",
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help="Elimina gli output il cui file di input non esiste più e quelli rimasti con la vecchia "
+        "estensione dopo un cambio di formato.",
+    )
+    parser.add_argument(
+        '--stack',
+        metavar='FILE.npy',
+        help="Invece di un file per ritaglio, scrive tutti i ritagli in un unico array .npy (N, H, W, C) "
+        "mappato in memoria, con un indice FILE.index.json riga -> file di input (richiede numpy).",
+    )
+    parser.add_argument(
+        '--stack-mode',
+        choices=('L', 'RGB', 'RGBA'),
+        default='RGB',
+        help='Con --stack, canali dei pixel salvati: L (1), RGB (3) o RGBA (4) (predefinito: RGB).',
+    )
+    parser.add_argument(
+        '-r',
+        '--recursive',
+        action='store_true',
+        help="Cerca le immagini anche nelle sottocartelle, replicandone la struttura nell'output.",
+    )
+    parser.add_argument(
+        '--include',
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help='Elabora solo i percorsi relativi che corrispondono al pattern (ripetibile).',
+    )
+    parser.add_argument(
+        '--exclude',
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help='Salta i file e le cartelle che corrispondono al pattern (ripetibile).',
+    )
+    parser.add_argument(
+        '--no-sort',
+        dest='sort',
+        action='store_false',
+        help="Non ordina gli elenchi delle cartelle: l'elaborazione parte subito anche su cartelle enormi.",
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Resta in ascolto (inotify) e ritaglia ogni nuova immagine appena completata.',
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=0,
+        help='Massimo di file in attesa in modalità --watch (predefinito: 8 per worker).',
+    )
+    parser.add_argument(
+        '--settle',
+        type=float,
+        default=1.0,
+        help="Secondi senza nuovi eventi prima di considerare un file completo (predefinito: 1).",
+    )
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=30.0,
+        help='Secondi tra un rapporto di throughput e il successivo in modalità --watch (predefinito: 30).',
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Misura lettura, apertura, decodifica, ritaglio, codifica e scrittura di ogni file e stampa un riepilogo.',
+    )
+    parser.add_argument(
+        '--profile-trace',
+        metavar='FILE',
+        help='Con --profile, salva i tempi per file in CSV (o JSON se il nome termina in .json).',
+    )
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=DEFAULT_SLOWEST,
+        help=f'Con --profile, numero di file più lenti da evidenziare (predefinito: {DEFAULT_SLOWEST}).',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help="Legge solo le intestazioni: raggruppa le immagini per dimensione e segnala quelle in cui "
+        'il template non rientra (esce con 1 se ce ne sono).',
+    )
+    parser.add_argument(
+        '--route',
+        action='append',
+        default=[],
+        metavar='LxA=TEMPLATE',
+        help='Usa TEMPLATE per le immagini di dimensione LxA, es. 1240x1754=a5 (ripetibile, con un solo template).',
+    )
+    parser.add_argument(
+        '--auto-template',
+        metavar='NOME',
+        help="Rileva l'area del contenuto da un campione di immagini e la salva come template NOME (richiede numpy).",
+    )
+    parser.add_argument(
+        '--sample',
+        type=int,
+        default=64,
+        help='Con --auto-template, numero di immagini da campionare (predefinito: 64).',
+    )
+    parser.add_argument(
+        '--margin',
+        type=int,
+        default=0,
+        help="Con --auto-template, pixel aggiunti attorno all'area rilevata (predefinito: 0).",
+    )
+    parser.add_argument(
+        '--shard',
+        metavar='i/N',
+        help='Elabora solo lo shard i di N (1 <= i <= N), scelto da un hash stabile del percorso relativo: '
+        'più macchine possono dividersi la stessa cartella di input.',
+    )
+    parser.add_argument(
+        '--merge-shards',
+        action='store_true',
+        help='Verifica dai log nella cartella di output che gli shard abbiano coperto ogni input una sola volta.',
+    )
+    parser.add_argument(
+        '--roi',
+        action='store_true',
+        help="Decodifica solo le righe/tile che contengono l'area (PNG, JPEG baseline, TIFF non compressi): "
+        'memoria limitata dal ritaglio anche su scansioni enormi.',
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        metavar='MB',
+        help='Avvia i file in base alla memoria stimata dei pixel decodificati (letta dalle intestazioni) '
+        'invece che a finestre fisse: molte foto piccole in parallelo, le scansioni enormi senza esaurire la RAM. '
+        'I worker restano il massimo di processi.',
+    )
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Legge e scrive su thread separati mentre i worker decodificano: utile su dischi di rete (NFS/SMB).',
+    )
+    parser.add_argument(
+        '--read-threads',
+        type=int,
+        default=DEFAULT_READ_THREADS,
+        help=f'Con --pipeline, thread di lettura (predefinito: {DEFAULT_READ_THREADS}).',
+    )
+    parser.add_argument(
+        '--write-threads',
+        type=int,
+        default=DEFAULT_WRITE_THREADS,
+        help=f'Con --pipeline, thread di scrittura (predefinito: {DEFAULT_WRITE_THREADS}).',
+    )
+    parser.add_argument(
+        '--read-ahead',
+        type=int,
+        default=DEFAULT_READ_AHEAD,
+        help=f'Con --pipeline, massimo di file letti in anticipo (predefinito: {DEFAULT_READ_AHEAD}).',
+    )
+    parser.add_argument(
+        '--write-queue',
+        type=int,
+        default=DEFAULT_WRITE_QUEUE,
+        help=f'Con --pipeline, massimo di ritagli in attesa di scrittura (predefinito: {DEFAULT_WRITE_QUEUE}).',
+    )
+    parser.add_argument(
+        '--preset',
+        choices=sorted(PRESETS),
+        help='Preset di codifica: fast (più veloce), balanced, small (file più piccoli). '
+        'Prevale su quello dei template.',
+    )
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        choices=sorted(OUTPUT_FORMATS),
+        help="Converte i ritagli in questo formato (cambia l'estensione dei file di output).",
+    )
+    parser.add_argument('--quality', type=int, help='Qualità JPEG/WebP (1-100).')
+    parser.add_argument('--compress-level', type=int, help='Livello di compressione PNG (0-9).')
+    parser.add_argument('--subsampling', type=int, help='Sottocampionamento JPEG: 0=4:4:4, 1=4:2:2, 2=4:2:0.')
+    parser.add_argument(
+        '--optimize',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='Attiva o disattiva il passaggio di ottimizzazione PNG/JPEG.',
+    )
+    parser.add_argument(
+        '--progressive',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='Salva i JPEG in modalità progressiva.',
+    )
+    return parser.parse_args(argv)
+
 
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.serve:
+        from server import serve
 
-def main() -> int:
-    args = parse_args()
+        return serve(args.socket, args.workers)
+    if args.socket:
+        from server import run_client
 
+        return run_client(args.socket, list(sys.argv[1:] if argv is None else argv))
+    return run(args)
+
+
+def run(args, executor=None) -> int:
+    """Run the command described by the parsed ``args``; ``executor`` is a warm process pool to reuse."""
     if args.list:
         templates = list_templates()
         if not templates:
@@ -79,25 +773,276 @@ def main() -> int:
                 print(f' - {name}')
         return 0
 
-    if not os.path.isdir(args.input):
+    if args.search is not None:
+        matches = search_templates(args.search)
+        if not matches:
+            print(f"Nessun template corrisponde a '{args.search}'.")
+        for name, template in matches:
+            description = f": {template['description']}" if template['description'] else ''
+            print(f' - {name}{description}')
+        return 0
+
+    if args.workers < 1:
+        print('Il numero di worker deve essere almeno 1.')
+        return 1
+
+    if min(args.read_threads, args.write_threads, args.read_ahead, args.write_queue) < 1:
+        print('Thread e code della pipeline devono essere almeno 1.')
+        return 1
+
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        print('Il budget di memoria deve essere positivo.')
+        return 1
+    if args.memory_budget is not None and args.pipeline:
+        print('--memory-budget e --pipeline non si possono usare insieme.')
+        return 1
+
+    archived = is_archive(args.input) or is_archive(args.output)
+    if is_archive(args.input):
+        if not os.path.isfile(args.input):
+            print(f"L'archivio '{args.input}' non esiste.")
+            return 1
+    elif not os.path.isdir(args.input):
         print(f"La cartella '{args.input}' non esiste.")
         return 1
+    if archived:
+        unsupported = [
+            option
+            for option, value in (
+                ('--watch', args.watch),
+                ('--shard', args.shard),
+                ('--merge-shards', args.merge_shards),
+                ('--route', args.route),
+                ('--dry-run', args.dry_run),
+                ('--auto-template', args.auto_template),
+                ('--pipeline', args.pipeline),
+                ('--prune', args.prune),
+                ('--dedup', args.dedup),
+                ('--profile', args.profile),
+            )
+            if value
+        ]
+        if unsupported:
+            print(f"{', '.join(unsupported)} non supportato con input o output in archivio ZIP/tar.")
+            return 1
+
+    if args.auto_template:
+        return auto_template(args)
+
+    shard = None
+    try:
+        if args.shard:
+            shard = parse_shard(args.shard)
+        if args.merge_shards:
+            return merge_shards(args)
+    except ShardError as exc:
+        print(f"Errore: {exc}")
+        return 1
+    if shard is not None and args.watch:
+        print('--shard non è supportato con --watch.')
+        return 1
+    if args.dedup and args.watch:
+        print('--dedup non è supportato con --watch.')
+        return 1
+    if args.stack:
+        unsupported = [
+            option
+            for option, value in (
+                ('--watch', args.watch),
+                ('--shard', args.shard),
+                ('--route', args.route),
+                ('--pipeline', args.pipeline),
+                ('--memory-budget', args.memory_budget is not None),
+                ('--prune', args.prune),
+                ('--dedup', args.dedup),
+                ('--profile', args.profile),
+                ('--lossless-jpeg', args.lossless_jpeg),
+            )
+            if value
+        ]
+        if archived:
+            unsupported.insert(0, 'input o output in archivio')
+        if unsupported:
+            print(f"--stack non è supportato con {', '.join(unsupported)}.")
+            return 1
 
     try:
-        template = load_template(args.template)
+        if args.template_group:
+            templates = load_template_group(args.template_group)
+        else:
+            templates = {name: load_template(name) for name in args.template}
     except TemplateError as exc:
         print(f"Errore nel caricamento del template: {exc}")
         return 1
 
-    crop_box = (template['left'], template['top'], template['right'], template['bottom'])
-    processed = process_images(args.input, args.output, crop_box)
+    try:
+        cli_encoding = build_encoding(
+            args.preset,
+            args.output_format,
+            quality=args.quality,
+            compress_level=args.compress_level,
+            subsampling=args.subsampling,
+            optimize=args.optimize,
+            progressive=args.progressive,
+        )
+    except EncodingError as exc:
+        print(f"Errore nelle opzioni di codifica: {exc}")
+        return 1
+
+    from crop_engine import CropTarget, template_box
+    from preflight import parse_route
+
+    try:
+        routed = {size: load_template(name) for size, name in map(parse_route, args.route)}
+    except (ValueError, TemplateError) as exc:
+        print(f"Errore nell'instradamento per dimensione: {exc}")
+        return 1
+    if routed and len(templates) > 1:
+        print('--route si può usare con un solo template.')
+        return 1
+    if routed and args.watch:
+        print('--route non è supportato con --watch.')
+        return 1
+    if args.dry_run:
+        return dry_run(args, templates, routed)
+    if args.stack:
+        if len(templates) > 1:
+            print("--stack si può usare con un solo template: le righe dell'array hanno tutte la stessa forma.")
+            return 1
+        return stack_output(args, next(iter(templates.values())), executor)
+
+    # A single template writes straight into the output folder, as it always did.
+    if len(templates) == 1:
+        templates = {'': next(iter(templates.values()))}
+    targets = []
+    manifests = {}
+    for subfolder, template in templates.items():
+        encoding = merge_encoding(template.get('encoding'), cli_encoding)
+        box = (template['left'], template['top'], template['right'], template['bottom'])
+        # Derivatives go into one subfolder per size, next to the full-size crops.
+        variants = [(subfolder, encoding)] + [
+            (posixpath.join(subfolder, str(size)), with_max_side(encoding, size))
+            for size in template.get('derivatives') or ()
+        ]
+        changed = False
+        for variant, variant_encoding in variants:
+            targets.append(CropTarget(variant, box, variant_encoding or None))
+            if archived:
+                continue
+            manifest = Manifest.load(
+                os.path.join(args.output, variant),
+                {**template, 'encoding': variant_encoding},
+                use_hash=args.hash,
+                force=args.force,
+                filename=manifest_filename(MANIFEST_FILENAME, shard),
+            )
+            changed = changed or manifest.template_changed
+            manifests[variant] = manifest
+        if changed:
+            print(
+                f"Coordinate o codifica del template '{template['template_name']}' cambiate: "
+                'tutte le immagini verranno ritagliate di nuovo.'
+            )
+    routes = {
+        size: CropTarget('', template_box(template), merge_encoding(template.get('encoding'), cli_encoding) or None)
+        for size, template in routed.items()
+    }
+
+    if archived:
+        try:
+            processed = process_archive(
+                args.input,
+                args.output,
+                targets,
+                workers=args.workers,
+                lossless_jpeg=args.lossless_jpeg,
+                recursive=args.recursive,
+                include=args.include,
+                exclude=args.exclude,
+                sort=args.sort,
+                roi=args.roi,
+            )
+        except (ArchiveError, OSError, tarfile.TarError, zipfile.BadZipFile) as exc:
+            print(f"Errore nell'archivio: {exc}")
+            return 1
+        if processed == 0:
+            print("Nessuna immagine PNG o JPG trovata nell'input.")
+        else:
+            print(f"Completato: {processed} immagini ritagliate.")
+        return 0
+
+    if args.watch:
+        from watcher import WatchError, watch_folder
+
+        os.makedirs(args.output, exist_ok=True)
+        try:
+            watch_folder(
+                args.input,
+                args.output,
+                targets,
+                manifests,
+                workers=args.workers,
+                jpegtran=resolve_jpegtran(args.lossless_jpeg),
+                recursive=args.recursive,
+                include=args.include,
+                exclude=args.exclude,
+                queue_size=args.queue_size,
+                settle=args.settle,
+                stats_interval=args.stats_interval,
+                roi=args.roi,
+            )
+        except WatchError as exc:
+            print(f"Errore: {exc}")
+            return 1
+        return 0
+
+    profiler = Profiler(slowest=args.profile_top) if args.profile else None
+    pipeline = None
+    if args.pipeline:
+        pipeline = {
+            'read_threads': args.read_threads,
+            'write_threads': args.write_threads,
+            'read_ahead': args.read_ahead,
+            'write_queue': args.write_queue,
+        }
+    processed = process_images(
+        args.input,
+        args.output,
+        targets,
+        workers=args.workers,
+        lossless_jpeg=args.lossless_jpeg,
+        manifests=manifests,
+        prune=args.prune,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        sort=args.sort,
+        profiler=profiler,
+        pipeline=pipeline,
+        roi=args.roi,
+        shard=ShardLog(shard) if shard is not None else None,
+        routes=routes,
+        dedup=DedupIndex.load(args.output, manifest_filename(DEDUP_FILENAME, shard), args.force)
+        if args.dedup
+        else None,
+        budget=int(args.memory_budget * 1024 * 1024) if args.memory_budget is not None else None,
+        executor=executor,
+    )
 
-    if processed == 0:
+    if profiler is not None:
+        print(profiler.summary())
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+            print(f"Traccia del profilo salvata in '{args.profile_trace}'.")
+
+    names = ', '.join(f"'{template['template_name']}'" for template in templates.values())
+    if processed == 0 and not any(manifest.skipped for manifest in manifests.values()):
         print('Nessuna immagine PNG o JPG trovata nella cartella di input.')
+    elif processed == 0:
+        print('Nessuna immagine nuova o modificata da ritagliare.')
     else:
-        print(
-            f"Completato: {processed} immagini ritagliate usando il template '{template['template_name']}'."
-        )
+        label = 'il template' if len(templates) == 1 else 'i template'
+        print(f"Completato: {processed} immagini ritagliate usando {label} {names}.")
     return 0
 
 
@@ -1,11 +1,18 @@
+import hashlib
 import json
 import os
-from typing import List, Optional, Tuple
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
 
+from crop_engine import run_ordered
+from defaults import DEFAULT_WORKERS
+from orientation import display_size, exif_orientation, orient
 from template_manager import (
     TemplateError,
     export_template_to_file,
@@ -16,7 +23,17 @@ from template_manager import (
 
 INPUT_FOLDER = 'input'
 OUTPUT_FOLDER = 'output'
-VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VALID_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+PREVIEW_MAX_SIZE = (1000, 700)
+# Previews of non-JPEG sources, which are decoded at full resolution, are kept
+# here so reopening the same scan does not decode it again.
+PREVIEW_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'bulk_crop', 'previews'
+)
+_PREVIEW_CACHE_ENTRIES = 20
+_PREVIEW_POLL_MS = 50
+_BATCH_POLL_MS = 100
+_FAILURES_SHOWN = 10
 
 
 def iter_image_files(folder: str):
@@ -35,18 +52,41 @@ def process_all_images(
     crop_box: Tuple[int, int, int, int],
     input_folder: str = INPUT_FOLDER,
     output_folder: str = OUTPUT_FOLDER,
-) -> int:
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[int, int, str, Optional[str]], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[int, List[Tuple[str, str]]]:
+    """Crop every image of ``input_folder`` with :func:`crop_engine.run_ordered`.
+
+    Returns the number of cropped images and the ``(fname, error)`` failures.
+    ``on_progress(done, total, fname, error)`` is called after each file, from
+    the calling thread. Once ``cancel`` is set no new file is started: queued
+    files are dropped and the call returns after the in-flight ones finish.
+    """
     os.makedirs(output_folder, exist_ok=True)
+    names = list(iter_image_files(input_folder))
+    total = len(names)
+    jobs = (
+        (fname, os.path.join(input_folder, fname), [(crop_box, os.path.join(output_folder, fname), None)])
+        for fname in names
+    )
     processed = 0
-    for fname in iter_image_files(input_folder):
-        input_path = os.path.join(input_folder, fname)
-        output_path = os.path.join(output_folder, fname)
-        with Image.open(input_path) as img:
-            cropped = img.crop(crop_box)
-            cropped.save(output_path)
-        print(f"Ritagliata {fname}")
-        processed += 1
-    return processed
+    failures: List[Tuple[str, str]] = []
+    for fname, result in run_ordered(jobs, workers or DEFAULT_WORKERS, cancel=cancel):
+        if result.error is None:
+            print(f"Ritagliata {fname}")
+            processed += 1
+        else:
+            failures.append((fname, result.error))
+        if on_progress is not None:
+            on_progress(processed + len(failures), total, fname, result.error)
+    return processed, failures
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 
 class CropUI:
@@ -61,12 +101,13 @@ class CropUI:
         self.master.configure(padx=10, pady=10)
         self.master.resizable(False, False)
 
+        # Only the header is read here: the preview is decoded in the background.
+        # Sizes and coordinates are those of the image as displayed (EXIF orientation applied).
         with Image.open(image_path) as img:
-            self.original_width, self.original_height = img.size
-            self.display_image, self.scale = self._prepare_display_image(img)
-
-        self.photo = ImageTk.PhotoImage(self.display_image)
-        self.display_width, self.display_height = self.display_image.size
+            self.original_width, self.original_height = display_size(img.size, exif_orientation(img))
+        self.display_width, self.display_height = self._display_size(self.original_width, self.original_height)
+        self.scale = self.original_width / self.display_width
+        self.photo = None
 
         self.canvas = tk.Canvas(
             master,
@@ -74,8 +115,22 @@ class CropUI:
             height=self.display_height,
             highlightthickness=0,
             cursor='cross',
+            background='#d9d9d9',
         )
         self.canvas.pack()
+        self.placeholder_id = self.canvas.create_text(
+            self.display_width // 2,
+            self.display_height // 2,
+            text='Caricamento anteprima...',
+            fill='#555555',
+        )
+        self._preview_queue: queue.Queue = queue.Queue(maxsize=1)
+        threading.Thread(
+            target=self._load_preview,
+            args=(image_path, (self.display_width, self.display_height), self._preview_queue),
+            daemon=True,
+        ).start()
+        self.master.after(_PREVIEW_POLL_MS, self._poll_preview)
 
         self.template_var = tk.StringVar(value='')
 
@@ -120,12 +175,12 @@ class CropUI:
 
         button_frame = tk.Frame(master)
         button_frame.pack(fill='x', pady=10)
-        confirm_btn = tk.Button(
+        self.confirm_btn = tk.Button(
             button_frame,
             text='Applica ritaglio a tutte le immagini',
             command=self.on_confirm,
         )
-        confirm_btn.pack(side='left')
+        self.confirm_btn.pack(side='left')
         reset_btn = tk.Button(
             button_frame,
             text='Ripristina dal template',
@@ -137,20 +192,108 @@ class CropUI:
         self.canvas.bind('<B1-Motion>', self.on_move_press)
         self.canvas.bind('<ButtonRelease-1>', self.on_button_release)
 
+        self.batch_thread: Optional[threading.Thread] = None
+        self.batch_cancel = threading.Event()
+        self.batch_queue: queue.Queue = queue.Queue()
+        self.batch_started = 0.0
+        self.close_after_batch = False
+        self.master.protocol('WM_DELETE_WINDOW', self.on_close)
+
         self.on_refresh_templates(apply_template=True)
 
-    def _prepare_display_image(self, image: Image.Image):
-        max_width = 1000
-        max_height = 700
-        width, height = image.size
+    @staticmethod
+    def _display_size(width: int, height: int) -> Tuple[int, int]:
+        max_width, max_height = PREVIEW_MAX_SIZE
         ratio = min(max_width / width, max_height / height, 1)
         if ratio < 1:
-            new_size = (int(width * ratio), int(height * ratio))
-            resized = image.resize(new_size, Image.LANCZOS)
-        else:
-            resized = image.copy()
-        scale = width / resized.width
-        return resized, scale
+            return max(1, int(width * ratio)), max(1, int(height * ratio))
+        return width, height
+
+    @staticmethod
+    def _preview_cache_path(image_path: str, size: Tuple[int, int]) -> str:
+        """Cache file of the ``size`` preview of ``image_path``; a changed source gets a new one."""
+        stat = os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size[0]}x{size[1]}"
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(PREVIEW_CACHE_DIR, f"{digest}.png")
+
+    @staticmethod
+    def _store_preview(cache_path: str, preview: Image.Image) -> None:
+        """Save ``preview`` in the cache, keeping only the most recent entries; a failure is ignored."""
+        try:
+            os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            preview.save(tmp_path, 'PNG')
+            os.replace(tmp_path, cache_path)
+            with os.scandir(PREVIEW_CACHE_DIR) as entries:
+                cached = sorted(
+                    (entry for entry in entries if entry.name.endswith('.png')),
+                    key=lambda entry: entry.stat().st_mtime,
+                    reverse=True,
+                )
+            for entry in cached[_PREVIEW_CACHE_ENTRIES:]:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+    @classmethod
+    def _load_preview(cls, image_path: str, size: Tuple[int, int], results: queue.Queue):
+        """Decode ``image_path`` at roughly ``size`` and resize it to exactly ``size``.
+
+        JPEGs are decoded at a reduced DCT scale (draft mode) and other formats
+        are shrunk with ``reduce`` before the final LANCZOS pass, so a huge scan
+        is never resampled at full resolution. Draft mode only exists for JPEG:
+        other formats are still decoded in full, so their preview is cached
+        on disk and decoded once per file. Runs on a worker thread: the result
+        goes through ``results`` and Tk objects are built on the main loop.
+        """
+        try:
+            cache_path = cls._preview_cache_path(image_path, size)
+            if os.path.exists(cache_path):
+                try:
+                    with Image.open(cache_path) as cached:
+                        if cached.size == size:
+                            preview = cached.copy()
+                            os.utime(cache_path)  # most recently used: pruned last
+                            results.put(preview)
+                            return
+                except OSError:
+                    pass  # an unreadable cache entry is rebuilt
+            with Image.open(image_path) as img:
+                cache = img.format != 'JPEG'
+                orientation = exif_orientation(img)
+                stored = display_size(size, orientation)
+                if img.format == 'JPEG':
+                    img.draft('RGB' if img.mode not in ('L', 'CMYK') else img.mode, stored)
+                if img.mode not in ('1', 'L', 'P', 'RGB', 'RGBA'):
+                    img = img.convert('RGBA' if 'A' in img.mode else 'RGB')
+                if img.size == stored:
+                    preview = img.copy()
+                else:
+                    preview = img.resize(stored, Image.LANCZOS, reducing_gap=2.0)
+                preview = orient(preview, orientation)
+            if cache:
+                cls._store_preview(cache_path, preview)
+        except Exception as exc:
+            results.put(exc)
+            return
+        results.put(preview)
+
+    def _poll_preview(self):
+        try:
+            result = self._preview_queue.get_nowait()
+        except queue.Empty:
+            self.master.after(_PREVIEW_POLL_MS, self._poll_preview)
+            return
+        if isinstance(result, Exception):
+            self.canvas.itemconfigure(self.placeholder_id, text=f"Anteprima non disponibile: {result}")
+            return
+        self.display_image = result
+        self.photo = ImageTk.PhotoImage(result)
+        self.canvas.delete(self.placeholder_id)
+        image_id = self.canvas.create_image(0, 0, image=self.photo, anchor='nw')
+        # The selection may already be drawn from a template: keep it on top.
+        self.canvas.tag_lower(image_id)
 
     def on_export_template(self):
         if self.crop_coords is None:
@@ -324,14 +467,113 @@ class CropUI:
         if self.crop_coords is None:
             messagebox.showwarning('Ritaglio', 'Seleziona un\'area da ritagliare prima di procedere.')
             return
+        if self.batch_thread is not None:
+            return
+        self.batch_cancel.clear()
+        self.batch_queue = queue.Queue()
+        self.batch_started = time.perf_counter()
+        self._open_progress_dialog()
+        self.confirm_btn.configure(state='disabled')
+        self.batch_thread = threading.Thread(target=self._run_batch, args=(self.crop_coords,), daemon=True)
+        self.batch_thread.start()
+        self.master.after(_BATCH_POLL_MS, self._poll_batch)
+
+    def _run_batch(self, crop_box: Tuple[int, int, int, int]):
+        """Worker thread: run the batch and report back through ``batch_queue``."""
         try:
-            processed = process_all_images(self.crop_coords)
+            result = process_all_images(
+                crop_box,
+                on_progress=lambda *progress: self.batch_queue.put(('progress', progress)),
+                cancel=self.batch_cancel,
+            )
         except Exception as exc:
-            messagebox.showerror('Errore', f"Impossibile ritagliare le immagini: {exc}")
+            self.batch_queue.put(('error', exc))
             return
-        messagebox.showinfo('Completato', f"Ritagliate {processed} immagini nella cartella '{OUTPUT_FOLDER}'.")
-        self.completed = True
-        self.master.destroy()
+        self.batch_queue.put(('done', result))
+
+    def _open_progress_dialog(self):
+        self.progress_window = tk.Toplevel(self.master)
+        self.progress_window.title('Ritaglio in corso')
+        self.progress_window.resizable(False, False)
+        self.progress_window.transient(self.master)
+        self.progress_window.configure(padx=10, pady=10)
+        self.progress_window.protocol('WM_DELETE_WINDOW', self.on_cancel_batch)
+        self.progress_bar = ttk.Progressbar(self.progress_window, length=360, mode='determinate')
+        self.progress_bar.pack(fill='x')
+        self.progress_var = tk.StringVar(value='Avvio dei worker...')
+        tk.Label(self.progress_window, textvariable=self.progress_var, anchor='w').pack(fill='x', pady=(8, 0))
+        self.cancel_btn = tk.Button(self.progress_window, text='Annulla', command=self.on_cancel_batch)
+        self.cancel_btn.pack(anchor='e', pady=(8, 0))
+        self.progress_window.grab_set()
+
+    def on_cancel_batch(self):
+        if self.batch_thread is None or self.batch_cancel.is_set():
+            return
+        self.batch_cancel.set()
+        self.cancel_btn.configure(state='disabled')
+        self.progress_var.set('Annullamento: attendo il termine delle immagini in corso...')
+
+    def on_close(self):
+        if self.batch_thread is None:
+            self.master.destroy()
+            return
+        if messagebox.askyesno('Ritaglio', 'Interrompere il ritaglio in corso e chiudere?'):
+            self.close_after_batch = True
+            self.on_cancel_batch()
+
+    def _poll_batch(self):
+        outcome = None
+        while True:
+            try:
+                kind, payload = self.batch_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                self._show_progress(*payload)
+            else:
+                outcome = (kind, payload)
+        if outcome is None:
+            self.master.after(_BATCH_POLL_MS, self._poll_batch)
+            return
+        self.batch_thread = None
+        self.progress_window.grab_release()
+        self.progress_window.destroy()
+        self.confirm_btn.configure(state='normal')
+        self._finish_batch(*outcome)
+
+    def _show_progress(self, done: int, total: int, fname: str, error: Optional[str]):
+        self.progress_bar.configure(maximum=max(total, 1), value=done)
+        if self.batch_cancel.is_set():
+            return
+        elapsed = time.perf_counter() - self.batch_started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = _format_duration((total - done) / rate) if rate > 0 else '--'
+        self.progress_var.set(f"{done}/{total} immagini · {rate:.1f} img/s · tempo rimanente {eta}")
+
+    def _finish_batch(self, kind: str, payload):
+        if kind == 'error':
+            messagebox.showerror('Errore', f"Impossibile ritagliare le immagini: {payload}")
+            if self.close_after_batch:
+                self.master.destroy()
+            return
+        processed, failures = payload
+        cancelled = self.batch_cancel.is_set()
+        if cancelled:
+            message = f"Ritaglio interrotto: {processed} immagini ritagliate nella cartella '{OUTPUT_FOLDER}'."
+        else:
+            message = f"Ritagliate {processed} immagini nella cartella '{OUTPUT_FOLDER}'."
+        if failures:
+            lines = [f"{fname}: {error}" for fname, error in failures[:_FAILURES_SHOWN]]
+            if len(failures) > _FAILURES_SHOWN:
+                lines.append(f"... e altre {len(failures) - _FAILURES_SHOWN}.")
+            message += f"\n\n{len(failures)} immagini non ritagliate:\n" + '\n'.join(lines)
+            messagebox.showwarning('Completato con errori', message)
+        else:
+            messagebox.showinfo('Interrotto' if cancelled else 'Completato', message)
+        if not cancelled:
+            self.completed = True
+        if not cancelled or self.close_after_batch:
+            self.master.destroy()
 
     def _draw_rectangle(self, x0, y0, x1, y1):
         if self.rect_id is None:
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MANIFEST_FILENAME = ".bulk_crop_manifest.json"
+MANIFEST_VERSION = 1
+# Template fields that change the produced crops; any difference re-crops everything.
+# Each entry also records its own box and encoding, which routed size buckets may override.
+_OUTPUT_KEYS = ("left", "top", "right", "bottom", "encoding")
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Record of the inputs already cropped into an output folder.
+
+    Each entry is keyed by the input name and stores its size, mtime and
+    (optionally) content hash together with the output it produced. The
+    normalized template is stored alongside: when its coordinates or its
+    encoding change, the entries are set aside as ``stale`` and the whole
+    folder is cropped again. Stale entries never count as current (not even
+    after a checkpoint or an interrupted run); they are kept, until their input
+    is cropped again, only so that ``prune`` can still find their outputs.
+    """
+
+    def __init__(self, path: str, template: Dict[str, int], use_hash: bool = False):
+        self.path = path
+        self.template = dict(template)
+        self.use_hash = use_hash
+        self.entries: Dict[str, Dict[str, object]] = {}
+        self.stale: Dict[str, Dict[str, object]] = {}
+        self.template_changed = False
+        self.force = False
+        self.skipped = 0
+        self._seen: set = set()
+
+    @classmethod
+    def load(
+        cls,
+        output_folder: str,
+        template: Dict[str, int],
+        use_hash: bool = False,
+        force: bool = False,
+        filename: str = MANIFEST_FILENAME,
+    ) -> "Manifest":
+        """Load the manifest of ``output_folder``; with ``force`` no entry counts as current."""
+        manifest = cls(os.path.join(output_folder, filename), template, use_hash)
+        manifest.force = force
+        if not os.path.isfile(manifest.path):
+            return manifest
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return manifest
+        if data.get("version") != MANIFEST_VERSION:
+            return manifest
+        stored = data.get("template") or {}
+        manifest.template_changed = any(
+            (stored.get(key) or None) != (template.get(key) or None) for key in _OUTPUT_KEYS
+        )
+        manifest.entries = dict(data.get("files") or {})
+        manifest.stale = dict(data.get("stale") or {})
+        if manifest.template_changed:
+            manifest.stale.update(manifest.entries)
+            manifest.entries = {}
+        return manifest
+
+    def is_current(
+        self,
+        name: str,
+        input_path: str,
+        stat: os.stat_result,
+        output_path: str,
+        box: Optional[Sequence[int]] = None,
+        encoding: Optional[Dict[str, object]] = None,
+    ) -> bool:
+        """Whether ``name`` was already cropped from identical content into ``output_path``.
+
+        ``box`` and ``encoding`` are the crop the file gets now; an entry
+        recorded with another box or encoding (e.g. a size bucket routed to a
+        different template) is not current.
+        """
+        self._seen.add(name)
+        entry = self.entries.get(name)
+        if entry is None or self.force or not os.path.exists(output_path):
+            return False
+        if box is not None and entry.get("box") is not None and list(entry["box"]) != list(box):
+            return False
+        if "encoding" in entry and (entry["encoding"] or None) != (encoding or None):
+            return False
+        if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            self.skipped += 1
+            return True
+        if self.use_hash and entry.get("sha256") and entry.get("size") == stat.st_size:
+            if file_digest(input_path) == entry["sha256"]:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self.skipped += 1
+                return True
+        return False
+
+    def record(
+        self,
+        name: str,
+        input_path: str,
+        stat: os.stat_result,
+        output_name: str,
+        box: Optional[Sequence[int]] = None,
+        encoding: Optional[Dict[str, object]] = None,
+    ) -> None:
+        """Remember the output just written for ``name``.
+
+        When the previous output had another name (the format, hence the
+        extension, changed), it is kept under ``replaced`` for
+        :meth:`prune_replaced`.
+        """
+        entry: Dict[str, object] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "output": output_name,
+            "encoding": encoding or None,
+        }
+        if box is not None:
+            entry["box"] = list(box)
+        if self.use_hash:
+            entry["sha256"] = file_digest(input_path)
+        previous = self.stale.pop(name, None) or self.entries.get(name) or {}
+        replaced = [str(old) for old in previous.get("replaced") or () if old != output_name]
+        if previous.get("output") and previous["output"] != output_name and previous["output"] not in replaced:
+            replaced.append(str(previous["output"]))
+        if replaced:
+            entry["replaced"] = replaced
+        self.entries[name] = entry
+
+    def prune(self, input_folder: str, output_folder: str) -> List[str]:
+        """Delete outputs whose input no longer exists and return their names.
+
+        Only entries not seen in this run and stale entries are checked, and
+        filtered-out inputs that still exist on disk keep their outputs.
+        """
+        removed: List[str] = []
+        unseen = [(name, self.entries) for name in set(self.entries) - self._seen]
+        for name, entries in sorted(unseen + [(name, self.stale) for name in self.stale], key=lambda item: item[0]):
+            if os.path.exists(os.path.join(input_folder, name)):
+                continue
+            entry = entries.pop(name)
+            output_name = str(entry.get("output") or name)
+            try:
+                os.remove(os.path.join(output_folder, output_name))
+            except FileNotFoundError:
+                pass
+            removed.append(output_name)
+        return removed
+
+    def prune_replaced(self, output_folder: str) -> List[Tuple[str, str]]:
+        """Delete earlier outputs of inputs now written under another name; return ``(old, new)`` pairs."""
+        removed: List[Tuple[str, str]] = []
+        for name in sorted(self.entries):
+            entry = self.entries[name]
+            for old in entry.pop("replaced", None) or ():
+                try:
+                    os.remove(os.path.join(output_folder, old))
+                except FileNotFoundError:
+                    pass
+                removed.append((old, str(entry["output"])))
+        return removed
+
+    def save(self) -> None:
+        """Write the manifest atomically next to the outputs."""
+        data = {
+            "version": MANIFEST_VERSION,
+            "template": self.template,
+            "files": self.entries,
+            "stale": self.stale,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
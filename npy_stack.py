@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from crop_engine import CropResult, crop_image
+
+STACK_VERSION = 1
+# Pillow mode of the stored crops -> channels of the last axis.
+STACK_MODES = {"L": 1, "RGB": 3, "RGBA": 4}
+DEFAULT_STACK_MODE = "RGB"
+# Jobs submitted per worker ahead of the one being collected.
+_PREFETCH_PER_WORKER = 4
+
+Box = Tuple[int, int, int, int]
+
+# The array a worker process last wrote to, mapped once and reused for every
+# row: (path, memmap). Only one is kept, so a warm pool does not pile up mappings.
+_mapped: Optional[Tuple[str, object]] = None
+
+
+class StackError(ValueError):
+    """Raised when the stacked array cannot be created."""
+
+
+def _require_numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise StackError("--stack richiede numpy (pip install numpy).") from exc
+    return numpy
+
+
+def index_path(path: str) -> str:
+    """Path of the JSON index mapping the rows of the array ``path`` to their input files."""
+    return f"{os.path.splitext(path)[0]}.index.json"
+
+
+def stack_shape(count: int, box: Box, mode: str) -> Tuple[int, int, int, int]:
+    """``(N, H, W, C)`` of ``count`` crops of ``box`` stored in the Pillow ``mode``."""
+    left, top, right, bottom = box
+    return count, bottom - top, right - left, STACK_MODES[mode]
+
+
+def _stack_rows(path: str):
+    """Memory map of the array ``path``, opened read-write once per process."""
+    global _mapped
+    if _mapped is None or _mapped[0] != path:
+        np = _require_numpy()
+        _mapped = None  # drop the previous mapping before opening the next one
+        _mapped = (path, np.load(path, mmap_mode="r+"))
+    return _mapped[1]
+
+
+def _release() -> None:
+    global _mapped
+    if _mapped is not None:
+        _mapped[1].flush()
+        _mapped = None
+
+
+def stack_job(path: str, row: int, input_path: str, box: Box, mode: str, roi: bool = False) -> CropResult:
+    """Crop ``input_path`` and write its pixels into ``row`` of the array ``path``.
+
+    The crop goes from Pillow's buffer straight into the mapped slice: nothing
+    is encoded and no file is written per image. Returns a :class:`CropResult`
+    instead of raising.
+    """
+    start = time.perf_counter()
+    try:
+        rows = _stack_rows(path)
+        cropped = crop_image(input_path, box, as_image=True, roi=roi)
+        if cropped.mode != mode:
+            cropped = cropped.convert(mode)
+        rows[row] = _require_numpy().asarray(cropped).reshape(rows.shape[1:])
+    except Exception as exc:  # a bad file must not abort the whole batch
+        return CropResult(None, f"{type(exc).__name__}: {exc}", time.perf_counter() - start)
+    return CropResult(None, None, time.perf_counter() - start)
+
+
+class StackWriter:
+    """A pre-allocated ``(N, H, W, C)`` uint8 ``.npy`` array filled row by row, plus its index.
+
+    The array is created with ``numpy.lib.format.open_memmap`` under a
+    temporary name (sparse on most filesystems, so allocating is instant) and
+    renamed into place by :meth:`close` with its index, so an interrupted run
+    never leaves a half-filled array behind. The result loads zero-copy with
+    ``np.load(path, mmap_mode="r")``. Rows of inputs that failed stay zero
+    and are ``null`` in the index.
+    """
+
+    def __init__(self, path: str, names: Sequence[str], box: Box, mode: str = DEFAULT_STACK_MODE, template: str = ""):
+        np = _require_numpy()
+        if mode not in STACK_MODES:
+            raise StackError(f"Modalità '{mode}' non supportata (usa {', '.join(STACK_MODES)}).")
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise StackError(f"Area di ritaglio vuota: {tuple(box)}.")
+        self.path = path
+        self.box = tuple(box)
+        self.mode = mode
+        self.template = template
+        self.names: List[Optional[str]] = list(names)
+        self.shape = stack_shape(len(self.names), self.box, mode)
+        self.nbytes = int(np.prod(self.shape, dtype=np.int64))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Writing into a sparse file past the free space kills the workers with
+        # SIGBUS instead of raising, so the space is checked up front.
+        free = shutil.disk_usage(directory).free
+        if free < self.nbytes:
+            raise StackError(
+                f"Spazio insufficiente per l'array {self.shape}: servono {self.nbytes / 1e9:.2f} GB, "
+                f"liberi {free / 1e9:.2f} GB."
+            )
+        # A fresh name per run: a warm worker must never reuse the mapping of an older array.
+        self.tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp.npy"
+        np.lib.format.open_memmap(self.tmp_path, mode="w+", dtype=np.uint8, shape=self.shape).flush()
+
+    def failed(self, row: int) -> None:
+        self.names[row] = None
+
+    def close(self, keep: bool = True) -> None:
+        """Write the index and move the array into place (or discard it when ``keep`` is false)."""
+        if not os.path.exists(self.tmp_path):
+            return
+        _release()
+        if not keep:
+            os.remove(self.tmp_path)
+            return
+        data = {
+            "version": STACK_VERSION,
+            "array": os.path.basename(self.path),
+            "shape": list(self.shape),
+            "dtype": "uint8",
+            "mode": self.mode,
+            "template": self.template,
+            "box": list(self.box),
+            "files": self.names,
+        }
+        target = index_path(self.path)
+        tmp_index = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_index, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=1)
+        os.replace(self.tmp_path, self.path)
+        os.replace(tmp_index, target)
+
+    def __enter__(self) -> "StackWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(keep=exc_type is None)
+
+
+def fill_stack(
+    writer: StackWriter,
+    input_paths: Sequence[str],
+    workers: int,
+    roi: bool = False,
+    executor: Optional[ProcessPoolExecutor] = None,
+) -> Iterator[Tuple[int, CropResult]]:
+    """Crop ``input_paths[row]`` into each row of ``writer``, yielding ``(row, result)`` in row order.
+
+    Each worker maps the array once and writes the rows it is given; only the
+    results travel back. ``executor`` is a process pool to reuse.
+    """
+    args = (writer.box, writer.mode, roi)
+    if workers <= 1 and executor is None:
+        for row, input_path in enumerate(input_paths):
+            yield row, stack_job(writer.tmp_path, row, input_path, *args)
+        return
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from fill_stack(writer, input_paths, workers, roi, executor)
+        return
+    window = max(1, workers) * _PREFETCH_PER_WORKER
+    pending = deque()
+    for row, input_path in enumerate(input_paths):
+        pending.append((row, executor.submit(stack_job, writer.tmp_path, row, input_path, *args)))
+        if len(pending) >= window:
+            done_row, done = pending.popleft()
+            yield done_row, done.result()
+    while pending:
+        done_row, done = pending.popleft()
+        yield done_row, done.result()
@@ -0,0 +1,90 @@
+from typing import Optional, Tuple
+
+from PIL import Image
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientation -> transpose turning stored pixels into the displayed image
+# (the same table as ``ImageOps.exif_transpose``).
+TRANSPOSE_METHODS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+Box = Tuple[int, int, int, int]
+
+
+def exif_orientation(img: Optional[Image.Image]) -> int:
+    """EXIF orientation still to apply to an opened image (1, upright, when absent or invalid).
+
+    Pillow's TIFF plugin applies the orientation tag itself: it reports the
+    displayed size and transposes the pixels when loading, so TIFFs are 1.
+    """
+    if img is None or img.format == "TIFF":
+        return 1
+    try:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:  # a broken EXIF block must not stop the crop
+        return 1
+    return orientation if orientation in TRANSPOSE_METHODS else 1
+
+
+def swaps_axes(orientation: int) -> bool:
+    """Whether the displayed image is the stored one turned by 90 degrees."""
+    return orientation >= 5
+
+
+def display_size(size: Tuple[int, int], orientation: int) -> Tuple[int, int]:
+    width, height = size
+    return (height, width) if swaps_axes(orientation) else (width, height)
+
+
+def stored_box(box: Box, orientation: int, size: Tuple[int, int]) -> Box:
+    """Map ``box``, given on the displayed image, to the stored pixels of an image of ``size``.
+
+    ``size`` is the stored (undecoded, unrotated) size. Cropping the result
+    and applying :func:`orient` to the crop gives the same pixels as
+    cropping ``box`` from the fully transposed image.
+    """
+    if orientation not in TRANSPOSE_METHODS:
+        return tuple(box)
+    width, height = size
+    left, top, right, bottom = box
+    corners = [_to_stored(x, y, orientation, width, height) for x, y in ((left, top), (right, bottom))]
+    xs = [x for x, _ in corners]
+    ys = [y for _, y in corners]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _to_stored(x: int, y: int, orientation: int, width: int, height: int) -> Tuple[int, int]:
+    """Pixel-edge coordinates ``(x, y)`` of the displayed image in the stored one."""
+    if orientation == 2:
+        return width - x, y
+    if orientation == 3:
+        return width - x, height - y
+    if orientation == 4:
+        return x, height - y
+    if orientation == 5:
+        return y, x
+    if orientation == 6:
+        return y, height - x
+    if orientation == 7:
+        return width - y, height - x
+    return width - y, x
+
+
+def orient(image: Image.Image, orientation: int) -> Image.Image:
+    """Turn a crop of the stored pixels the way the EXIF orientation says, keeping its metadata."""
+    method = TRANSPOSE_METHODS.get(orientation)
+    if method is None:
+        return image
+    turned = image.transpose(method)
+    turned.info = dict(image.info)
+    dpi = turned.info.get("dpi")
+    if dpi and swaps_axes(orientation):
+        turned.info["dpi"] = (dpi[1], dpi[0])
+    return turned
@@ -0,0 +1,189 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from crop_engine import CropResult, crop_bytes, read_input, write_output
+from defaults import DEFAULT_READ_AHEAD, DEFAULT_READ_THREADS, DEFAULT_WRITE_QUEUE, DEFAULT_WRITE_THREADS
+from profiling import StageTimer
+
+# CPU jobs in flight per worker process, as in the plain process pool.
+_CPU_PER_WORKER = 2
+
+
+def crop_bytes_job(
+    data: bytes,
+    outputs,
+    jpegtran: Optional[str],
+    profile: bool,
+    roi: bool = False,
+) -> Tuple[CropResult, List[Tuple[str, bytes]]]:
+    """Worker side of the pipeline: decode, crop and encode without touching the disk."""
+    start = time.perf_counter()
+    timer = StageTimer() if profile else None
+    encodes: List[Tuple[str, float, int]] = []
+    try:
+        encoded, warning = crop_bytes(data, outputs, jpegtran, timer, encodes, roi)
+    except Exception as exc:  # a bad file must not abort the whole batch
+        return CropResult(None, f"{type(exc).__name__}: {exc}", time.perf_counter() - start), []
+    profile_data = timer.as_dict() if timer else None
+    return CropResult(warning, None, time.perf_counter() - start, profile_data, tuple(encodes)), encoded
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _read_timed(path: str) -> Tuple[bytes, float]:
+    start = time.perf_counter()
+    data = read_input(path)
+    return data, time.perf_counter() - start
+
+
+def _write_all(encoded: List[Tuple[str, bytes]]) -> float:
+    return sum(_timed(write_output, path, blob) for path, blob in encoded)
+
+
+class _Slot:
+    """One file moving through read -> cpu -> write, kept in input order."""
+
+    __slots__ = ("fname", "outputs", "stage", "future", "result", "read_seconds", "bytes_read", "encoded")
+
+    def __init__(self, fname: str, outputs, future: Future):
+        self.fname = fname
+        self.outputs = outputs
+        self.stage = "read"
+        self.future = future
+        self.result: Optional[CropResult] = None
+        self.read_seconds = 0.0
+        self.bytes_read = 0
+        self.encoded: List[Tuple[str, bytes]] = []
+
+
+def run_pipelined(
+    jobs: Iterable[Tuple[str, str, tuple]],
+    workers: int,
+    jpegtran: Optional[str] = None,
+    profile: bool = False,
+    read_threads: int = DEFAULT_READ_THREADS,
+    write_threads: int = DEFAULT_WRITE_THREADS,
+    read_ahead: int = DEFAULT_READ_AHEAD,
+    write_queue: int = DEFAULT_WRITE_QUEUE,
+    roi: bool = False,
+) -> Iterator[Tuple[str, CropResult]]:
+    """Yield ``(fname, result)`` in input order, overlapping I/O with CPU work.
+
+    Input bytes are prefetched by ``read_threads`` threads, decoded, cropped
+    and encoded by ``workers`` processes, then written by ``write_threads``
+    threads. At most ``read_ahead`` files are being read or waiting for a
+    CPU slot and at most ``write_queue`` encoded results are waiting to be
+    written, so memory stays bounded however slow the storage is. When a
+    worker process dies (e.g. killed for lack of memory), the files it took
+    down get an error result and a new pool crops the rest.
+    """
+    cpu_window = max(1, workers) * _CPU_PER_WORKER
+    max_slots = read_ahead + cpu_window + write_queue
+    jobs = iter(jobs)
+    exhausted = False
+    slots: deque = deque()
+    counts = {"read": 0, "cpu": 0, "write": 0}
+    cpus = ProcessPoolExecutor(max_workers=max(1, workers))
+
+    try:
+        with ThreadPoolExecutor(max_workers=read_threads) as readers, ThreadPoolExecutor(
+            max_workers=write_threads
+        ) as writers:
+            while True:
+                while not exhausted and len(slots) < max_slots and counts["read"] < read_ahead:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    fname, input_path, outputs = job
+                    slots.append(_Slot(fname, outputs, readers.submit(_read_timed, input_path)))
+                    counts["read"] += 1
+
+                progressed = False
+                for slot in slots:
+                    if slot.stage == "read" and slot.future.done() and counts["cpu"] < cpu_window:
+                        counts["read"] -= 1
+                        try:
+                            data, slot.read_seconds = slot.future.result()
+                        except OSError as exc:
+                            slot.result = CropResult(None, f"{type(exc).__name__}: {exc}", 0.0)
+                            slot.stage = "done"
+                        else:
+                            slot.bytes_read = len(data)
+                            args = (crop_bytes_job, data, slot.outputs, jpegtran, profile, roi)
+                            try:
+                                slot.future = cpus.submit(*args)
+                            except BrokenProcessPool:
+                                cpus.shutdown(wait=False)
+                                cpus = ProcessPoolExecutor(max_workers=max(1, workers))
+                                slot.future = cpus.submit(*args)
+                            slot.stage = "cpu"
+                            counts["cpu"] += 1
+                        progressed = True
+                    elif slot.stage == "cpu" and slot.future.done() and counts["write"] < write_queue:
+                        counts["cpu"] -= 1
+                        try:
+                            slot.result, encoded = slot.future.result()
+                        except BrokenProcessPool as exc:
+                            slot.result, encoded = CropResult(None, f"{type(exc).__name__}: {exc}", 0.0), []
+                        if slot.result.error is None:
+                            slot.encoded = encoded
+                            slot.future = writers.submit(_write_all, encoded)
+                            slot.stage = "write"
+                            counts["write"] += 1
+                        else:
+                            slot.stage = "done"
+                        progressed = True
+                    elif slot.stage == "write" and slot.future.done():
+                        counts["write"] -= 1
+                        slot.result = _finish(slot, profile)
+                        slot.stage = "done"
+                        progressed = True
+
+                while slots and slots[0].stage == "done":
+                    slot = slots.popleft()
+                    yield slot.fname, slot.result
+                    progressed = True
+
+                if exhausted and not slots:
+                    return
+                if not progressed:
+                    # Only futures whose next stage has room can move: a finished one held back
+                    # by a full stage would make wait() return at once and spin this loop.
+                    wait(
+                        [
+                            slot.future
+                            for slot in slots
+                            if slot.stage == "write"
+                            or (slot.stage == "cpu" and counts["write"] < write_queue)
+                            or (slot.stage == "read" and counts["cpu"] < cpu_window)
+                        ],
+                        return_when=FIRST_COMPLETED,
+                    )
+    finally:
+        cpus.shutdown(cancel_futures=True)
+
+
+def _finish(slot: _Slot, profile: bool) -> CropResult:
+    """Fold the reader/writer timings of ``slot`` into its worker result."""
+    try:
+        write_seconds = slot.future.result()
+    except OSError as exc:
+        return CropResult(None, f"{type(exc).__name__}: {exc}", slot.result.seconds)
+    result = slot.result._replace(seconds=slot.read_seconds + slot.result.seconds + write_seconds)
+    if profile and result.profile is not None:
+        merged = dict(result.profile)
+        merged["read"] = merged.get("read", 0.0) + slot.read_seconds
+        merged["write"] = merged.get("write", 0.0) + write_seconds
+        merged["bytes_read"] = slot.bytes_read
+        merged["bytes_written"] = sum(len(blob) for _, blob in slot.encoded)
+        result = result._replace(profile=merged)
+    slot.encoded = []
+    return result
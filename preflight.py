@@ -0,0 +1,110 @@
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from orientation import display_size, exif_orientation
+from roi import open_unchecked
+
+# Header reads are small and I/O bound: threads overlap the filesystem latency.
+DEFAULT_THREADS = 16
+_ROUTE_PATTERN = re.compile(r"^\s*(\d+)\s*[xX]\s*(\d+)\s*=\s*(.+?)\s*$")
+_EXAMPLES = 5
+
+Size = Tuple[int, int]
+Box = Tuple[int, int, int, int]
+
+
+class ImageHeader(NamedTuple):
+    """Size and mode read from an image header, or why it could not be read."""
+
+    width: int = 0
+    height: int = 0
+    mode: str = ""
+    error: Optional[str] = None
+
+
+def read_header(path: str) -> ImageHeader:
+    """Read size and mode from the header of ``path`` without decoding pixels.
+
+    Unlike ``Image.open`` this also works for images over the decompression
+    bomb limit, which the pre-flight must report rather than fail on. The
+    size is the displayed one, turned as the EXIF orientation says, since
+    template boxes are given on the image as displayed.
+    """
+    try:
+        with open(path, "rb") as fh:
+            img = open_unchecked(fh) or Image.open(fh)
+            width, height = display_size(img.size, exif_orientation(img))
+            return ImageHeader(width, height, img.mode)
+    except Exception as exc:  # an unreadable file is a finding, not a crash
+        return ImageHeader(error=f"{type(exc).__name__}: {exc}")
+
+
+def scan(folder: str, names: Iterable[str], threads: int = DEFAULT_THREADS) -> Dict[str, ImageHeader]:
+    """Read the header of every ``folder/name``, in input order."""
+    names = list(names)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        headers = executor.map(read_header, (os.path.join(folder, name) for name in names))
+        return dict(zip(names, headers))
+
+
+def fits(box: Box, size: Size) -> bool:
+    """Whether ``box`` lies inside an image of ``size``, so no padding would be added."""
+    left, top, right, bottom = box
+    return left >= 0 and top >= 0 and right <= size[0] and bottom <= size[1]
+
+
+def parse_route(value: str) -> Tuple[Size, str]:
+    """Parse ``WxH=template``."""
+    match = _ROUTE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Instradamento '{value}' non valido: usa LARGHEZZAxALTEZZA=template, es. 1240x1754=a5.")
+    return (int(match.group(1)), int(match.group(2))), match.group(3)
+
+
+def report(
+    headers: Dict[str, ImageHeader],
+    boxes: Dict[str, Box],
+    routes: Optional[Dict[Size, Tuple[str, Box]]] = None,
+    seconds: float = 0.0,
+) -> Tuple[List[str], int]:
+    """Group ``headers`` by size and mode and check every template box against each group.
+
+    ``boxes`` maps template names to their boxes; a size listed in ``routes``
+    is checked against its routed template instead. Returns the report lines
+    and the number of files that would be padded or could not be read.
+    """
+    routes = routes or {}
+    buckets: Dict[Tuple[int, int, str], List[str]] = defaultdict(list)
+    unreadable: List[str] = []
+    for name, header in headers.items():
+        if header.error is not None:
+            unreadable.append(name)
+        else:
+            buckets[(header.width, header.height, header.mode)].append(name)
+
+    lines = [f"Analizzate {len(headers)} immagini (solo intestazioni) in {seconds:.2f} s."]
+    problems = len(unreadable)
+    for (width, height, mode), names in sorted(buckets.items(), key=lambda item: -len(item[1])):
+        route = routes.get((width, height))
+        checked = {route[0]: route[1]} if route else boxes
+        misfits = [name for name, box in checked.items() if not fits(box, (width, height))]
+        status = "ok" if not misfits else f"non rientra: {', '.join(misfits)}"
+        if route:
+            status = f"-> template '{route[0]}', {status}"
+        lines.append(f"  {f'{width}x{height}':>11} {mode:<5} {len(names):>7} file  {status}")
+        if misfits:
+            problems += len(names)
+            lines.append(f"      es. {', '.join(names[:_EXAMPLES])}")
+    if unreadable:
+        lines.append(f"  illeggibili: {len(unreadable)} file")
+        lines.extend(f"      {name}: {headers[name].error}" for name in unreadable[:_EXAMPLES])
+    if problems:
+        lines.append(f"{problems} immagini verrebbero riempite ai bordi o non sono leggibili.")
+    else:
+        lines.append("Tutti i template rientrano in tutte le immagini.")
+    return lines, problems
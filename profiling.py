@@ -0,0 +1,100 @@
+import csv
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+STAGES = ("read", "open", "decode", "crop", "encode", "write")
+DEFAULT_SLOWEST = 10
+
+
+class StageTimer:
+    """Accumulates the time one file spends in each pipeline stage.
+
+    :meth:`lap` charges the time elapsed since the previous lap to a stage,
+    so instrumenting a sequence of stages costs one ``perf_counter`` call each.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.seconds[stage] += now - self._last
+        self._last = now
+
+    def as_dict(self) -> Dict[str, float]:
+        data: Dict[str, float] = dict(self.seconds)
+        data["bytes_read"] = self.bytes_read
+        data["bytes_written"] = self.bytes_written
+        return data
+
+
+class Profiler:
+    """Collects the per-file stage timings of a run and reports on them."""
+
+    def __init__(self, slowest: int = DEFAULT_SLOWEST):
+        self.slowest = slowest
+        self.records: List[Tuple[str, Dict[str, float]]] = []
+
+    def add(self, fname: str, profile: Optional[Dict[str, float]]) -> None:
+        if profile is not None:
+            self.records.append((fname, profile))
+
+    @staticmethod
+    def _total(profile: Dict[str, float]) -> float:
+        return sum(profile.get(stage, 0.0) for stage in STAGES)
+
+    def summary(self) -> str:
+        """Return the per-stage table followed by the slowest files."""
+        if not self.records:
+            return "Profilo: nessun file elaborato."
+        count = len(self.records)
+        totals = {stage: sum(profile.get(stage, 0.0) for _, profile in self.records) for stage in STAGES}
+        grand_total = sum(totals.values()) or 1e-9
+        bytes_read = sum(profile.get("bytes_read", 0) for _, profile in self.records)
+        bytes_written = sum(profile.get("bytes_written", 0) for _, profile in self.records)
+
+        lines = [
+            f"Profilo per fase ({count} file, tempo cumulato dei worker):",
+            f"  {'fase':<8} {'totale s':>10} {'media ms':>10} {'quota':>7}",
+        ]
+        for stage in STAGES:
+            lines.append(
+                f"  {stage:<8} {totals[stage]:10.3f} {totals[stage] / count * 1000:10.2f} "
+                f"{totals[stage] / grand_total * 100:6.1f}%"
+            )
+        lines.append(
+            f"  letti {bytes_read / 1e6:.1f} MB ({bytes_read / 1e6 / max(totals['read'], 1e-9):.1f} MB/s), "
+            f"scritti {bytes_written / 1e6:.1f} MB ({bytes_written / 1e6 / max(totals['write'], 1e-9):.1f} MB/s)"
+        )
+        slowest = sorted(self.records, key=lambda record: self._total(record[1]), reverse=True)[: self.slowest]
+        if slowest:
+            lines.append(f"  {len(slowest)} file più lenti:")
+            for fname, profile in slowest:
+                dominant = max(STAGES, key=lambda stage: profile.get(stage, 0.0))
+                lines.append(f"    {self._total(profile) * 1000:9.1f} ms  {fname} (soprattutto {dominant})")
+        return "\n".join(lines)
+
+    def write_trace(self, path: str) -> None:
+        """Write one row per file as CSV, or as JSON when ``path`` ends in ``.json``."""
+        columns = ["file", *STAGES, "total", "bytes_read", "bytes_written"]
+        rows = []
+        for fname, profile in self.records:
+            row: Dict[str, object] = {"file": fname}
+            for stage in STAGES:
+                row[stage] = round(profile.get(stage, 0.0), 6)
+            row["total"] = round(self._total(profile), 6)
+            row["bytes_read"] = int(profile.get("bytes_read", 0))
+            row["bytes_written"] = int(profile.get("bytes_written", 0))
+            rows.append(row)
+        if path.lower().endswith(".json"):
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(rows, fh, indent=1)
+            return
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,187 @@
+import io
+import struct
+import warnings
+from typing import BinaryIO, Optional, Tuple, Union
+
+from PIL import Image, JpegImagePlugin, PngImagePlugin, TiffImagePlugin
+
+from jpeg_lossless import read_jpeg_header
+
+Box = Tuple[int, int, int, int]
+# Bytes per pixel of the raw modes whose rows can be sliced by column.
+_RAW_PIXEL_BYTES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4, "CMYK": 4}
+_SEQUENTIAL_SOF = {0xC0, 0xC1}
+# TIFF orientation tag: Pillow transposes such TIFFs when loading them.
+_ORIENTATION_TAG = 0x0112
+_PLUGINS = (
+    (b"\x89PNG\r\n\x1a\n", PngImagePlugin.PngImageFile),
+    (b"\xff\xd8\xff", JpegImagePlugin.JpegImageFile),
+    (b"II*\x00", TiffImagePlugin.TiffImageFile),
+    (b"MM\x00*", TiffImagePlugin.TiffImageFile),
+)
+
+
+def decode_region(data: bytes, box: Box) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Decode only the part of the encoded image ``data`` that ``box`` needs.
+
+    Returns the decoded image and the position of its top-left pixel in the
+    source, so the caller crops ``box`` shifted by that origin. Depending on
+    the format this is:
+
+    * uncompressed TIFF (strips or tiles): only the strips/tiles, or for a
+      single strip only the bytes, that intersect ``box``;
+    * non-interlaced PNG and baseline JPEG: the rows from the top of the
+      image down to ``bottom`` (one MCU row further for JPEG), after which
+      decoding stops;
+    * anything else: the whole image, as a plain ``Image.open`` would.
+
+    Pillow's decompression-bomb limit is applied to the pixels actually
+    decoded instead of the declared image size, so a small crop of a huge
+    scan is allowed while a full decode of the same scan is still refused.
+    """
+    data = _truncate_jpeg(data, box[3])
+    img = open_unchecked(data)
+    if img is None:
+        img = Image.open(io.BytesIO(data))
+        origin = (0, 0)
+    else:
+        origin = _restrict_tiles(img, box) or (0, 0)
+        _check_pixels(img.size)
+    img.load()
+    return img, origin
+
+
+def open_unchecked(source: Union[bytes, BinaryIO]) -> Optional[Image.Image]:
+    """Open PNG, JPEG and TIFF data (bytes or a file object) without the size check done by ``Image.open``."""
+    fp = io.BytesIO(source) if isinstance(source, bytes) else source
+    magic = fp.read(8)
+    fp.seek(0)
+    for prefix, plugin in _PLUGINS:
+        if magic.startswith(prefix):
+            return plugin(fp)
+    return None
+
+
+def _check_pixels(size: Tuple[int, int]) -> None:
+    """Same thresholds as Pillow's own check, applied to the region decoded."""
+    limit = Image.MAX_IMAGE_PIXELS
+    if limit is None:
+        return
+    pixels = size[0] * size[1]
+    if pixels > 2 * limit:
+        raise Image.DecompressionBombError(
+            f"L'area da decodificare ({pixels} pixel) supera il limite di {2 * limit} pixel."
+        )
+    if pixels > limit:
+        warnings.warn(
+            f"L'area da decodificare ({pixels} pixel) supera il limite di {limit} pixel.",
+            Image.DecompressionBombWarning,
+        )
+
+
+def _truncate_jpeg(data: bytes, bottom: int) -> bytes:
+    """Shrink the frame height of a baseline JPEG so libjpeg stops after ``bottom``.
+
+    One extra MCU row is kept so chroma upsampling of the last needed row sees
+    the same neighbours as in a full decode. Other data is returned unchanged.
+    """
+    header = read_jpeg_header(data)
+    if header is None or header["marker"] not in _SEQUENTIAL_SOF:
+        return data
+    mcu = header["mcu_height"]
+    height = min(header["height"], (-(-bottom // mcu) + 1) * mcu)
+    if height >= header["height"] or height <= 0:
+        return data
+    offset = _frame_height_offset(data)
+    if offset is None:
+        return data
+    return data[:offset] + struct.pack(">H", height) + data[offset + 2 :]
+
+
+def _frame_height_offset(data: bytes) -> Optional[int]:
+    """Offset of the height field in the SOF segment of ``data``."""
+    index = 2
+    while index + 4 <= len(data):
+        if data[index] != 0xFF:
+            return None
+        code = data[index + 1]
+        if code == 0xFF:
+            index += 1
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            index += 2
+            continue
+        (length,) = struct.unpack(">H", data[index + 2 : index + 4])
+        if code in _SEQUENTIAL_SOF:
+            return index + 5
+        if code == 0xDA:
+            return None
+        index += 2 + length
+    return None
+
+
+def _restrict_tiles(img: Image.Image, box: Box) -> Optional[Tuple[int, int]]:
+    """Rewrite ``img.tile`` (before ``load``) to cover only what ``box`` needs.
+
+    Returns the source position of the new top-left pixel, or ``None`` when
+    the layout does not allow it and the image is decoded as is.
+    """
+    if img.format == "TIFF" and img.tag_v2.get(_ORIENTATION_TAG, 1) != 1:
+        return None  # the tiles are laid out in stored pixels, while size and box are as displayed
+    width, height = img.size
+    left, top = max(0, box[0]), max(0, box[1])
+    right, bottom = min(width, box[2]), min(height, box[3])
+    if right <= left or bottom <= top:
+        return None
+    tiles = img.tile
+    if len(tiles) == 1 and tiles[0].extents == (0, 0, width, height):
+        tile = tiles[0]
+        if tile.codec_name == "raw":
+            return _slice_raw(img, tile, (left, top, right, bottom))
+        if tile.codec_name == "zip" and not img.info.get("interlace"):
+            img._size = (width, bottom)
+            img.tile = [tile._replace(extents=(0, 0, width, bottom))]
+            return 0, 0
+        return None
+    if len(tiles) > 1 and all(tile.codec_name == "raw" for tile in tiles):
+        needed = [
+            tile
+            for tile in tiles
+            if tile.extents[0] < right and tile.extents[2] > left and tile.extents[1] < bottom and tile.extents[3] > top
+        ]
+        if not needed:
+            return None
+        x0 = min(tile.extents[0] for tile in needed)
+        y0 = min(tile.extents[1] for tile in needed)
+        x1 = max(tile.extents[2] for tile in needed)
+        y1 = max(tile.extents[3] for tile in needed)
+        img._size = (x1 - x0, y1 - y0)
+        img.tile = [_shift(tile, x0, y0) for tile in needed]
+        return x0, y0
+    return None
+
+
+def _shift(tile, x0: int, y0: int):
+    left, top, right, bottom = tile.extents
+    return tile._replace(extents=(left - x0, top - y0, right - x0, bottom - y0))
+
+
+def _slice_raw(img: Image.Image, tile, region: Box) -> Optional[Tuple[int, int]]:
+    """Point a single uncompressed tile at the bytes of ``region`` only."""
+    if not isinstance(tile.args, tuple) or len(tile.args) != 3:
+        return None
+    rawmode, stride, ystep = tile.args
+    pixel_bytes = _RAW_PIXEL_BYTES.get(rawmode)
+    if pixel_bytes is None or rawmode != img.mode or ystep != 1:
+        return None
+    left, top, right, bottom = region
+    stride = stride or img.size[0] * pixel_bytes
+    img._size = (right - left, bottom - top)
+    img.tile = [
+        tile._replace(
+            extents=(0, 0, right - left, bottom - top),
+            offset=tile.offset + top * stride + left * pixel_bytes,
+            args=(rawmode, stride, 1),
+        )
+    ]
+    return left, top
@@ -0,0 +1,212 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from crop_engine import CropResult, bounding_box, crop_job
+from preflight import DEFAULT_THREADS, ImageHeader, read_header
+
+# Files whose header is read ahead per worker, so backfilling has candidates to pick from.
+_LOOKAHEAD_PER_WORKER = 4
+# Smaller files that may start ahead of a file waiting for budget before that
+# file gets a reservation: then nothing else starts until it fits.
+_MAX_BYPASS_PER_WORKER = 2
+_TIMELINE_STEPS = 10
+
+
+def decoded_bytes(header: ImageHeader, outputs, roi: bool = False) -> int:
+    """Estimated peak memory, in bytes, of decoding the image of ``header`` and cropping ``outputs``.
+
+    Pillow keeps 1-bit, grayscale and palette images in one byte per pixel,
+    16-bit grayscale in two and every other mode in four. With ``roi`` only
+    the rows down to the lowest crop are counted.
+    """
+    if header.error is not None:
+        return 0
+    mode = header.mode
+    pixel_bytes = 1 if mode in ("1", "L", "P") else 2 if mode.startswith("I;16") else 4
+    height = header.height
+    if roi and outputs:
+        height = min(height, max(0, bounding_box([output[0] for output in outputs])[3]))
+    crops = sum(max(0, box[2] - box[0]) * max(0, box[3] - box[1]) for box, _, _ in outputs)
+    return (header.width * height + crops) * pixel_bytes
+
+
+class BudgetUsage:
+    """Memory budget in use over time, sampled whenever a file starts or finishes."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.samples: List[Tuple[float, int]] = [(0.0, 0)]
+        self.peak = 0
+        self.alone = 0
+
+    def sample(self, in_use: int) -> None:
+        self.samples.append((time.perf_counter() - self.started, in_use))
+        self.peak = max(self.peak, in_use)
+
+    def _mean(self, start: float, end: float) -> float:
+        """Time-weighted mean use between ``start`` and ``end`` seconds."""
+        if end <= start:
+            return float(self.samples[-1][1])
+        total = 0.0
+        for (at, in_use), (next_at, _) in zip(self.samples, self.samples[1:] + [(end, 0)]):
+            overlap = min(next_at, end) - max(at, start)
+            if overlap > 0:
+                total += in_use * overlap
+        return total / (end - start)
+
+    def report(self) -> List[str]:
+        elapsed = time.perf_counter() - self.started
+        mb = 1024 * 1024
+        lines = [
+            f"Budget di memoria: {self.budget / mb:.0f} MB; picco {self.peak / mb:.0f} MB "
+            f"({100 * self.peak / self.budget:.0f}%), media {100 * self._mean(0.0, elapsed) / self.budget:.0f}%."
+        ]
+        if self.alone:
+            lines.append(f"File oltre il budget elaborati da soli: {self.alone}.")
+        if elapsed > 0:
+            step = elapsed / _TIMELINE_STEPS
+            timeline = " ".join(
+                f"{100 * self._mean(index * step, (index + 1) * step) / self.budget:.0f}%"
+                for index in range(_TIMELINE_STEPS)
+            )
+            lines.append(f"Uso nel tempo (ogni {step:.1f}s): {timeline}")
+        return lines
+
+
+class _Waiting:
+    __slots__ = ("index", "fname", "input_path", "outputs", "header", "bypassed")
+
+    def __init__(self, index: int, fname: str, input_path: str, outputs, header: Future):
+        self.index = index
+        self.fname = fname
+        self.input_path = input_path
+        self.outputs = outputs
+        self.header = header
+        self.bypassed = 0
+
+
+def _outcome(future: Future) -> CropResult:
+    """Result of a pool job; a file lost with a dead worker gets an error result."""
+    try:
+        return future.result()
+    except BrokenProcessPool as exc:
+        return CropResult(None, f"{type(exc).__name__}: {exc}", 0.0)
+
+
+def run_budgeted(
+    jobs: Iterable[Tuple[str, str, tuple]],
+    workers: int,
+    budget: int,
+    jpegtran: Optional[str] = None,
+    profile: bool = False,
+    roi: bool = False,
+    usage: Optional[BudgetUsage] = None,
+    executor: Optional[ProcessPoolExecutor] = None,
+    headers: Optional[Dict[str, ImageHeader]] = None,
+) -> Iterator[Tuple[str, CropResult]]:
+    """Yield ``(fname, result)`` for every job, in input order, admitting files against a memory ``budget``.
+
+    Headers are read ahead on threads to estimate each file's decoded size
+    (:func:`decoded_bytes`). A file starts when a worker is free and its
+    estimate fits in what is left of ``budget``; a file over the whole budget
+    runs alone. While the oldest waiting file does not fit, later and smaller
+    ones may start in its place, but only a few times: after that it holds a
+    reservation and nothing else starts until enough memory is released, so
+    huge scans are never starved by a stream of small photos. Results of
+    files that started early are held back until those before them are
+    yielded. ``usage`` receives the budget in use over time; ``executor`` is
+    a process pool to reuse. ``headers`` maps input paths to headers already
+    read (e.g. for routing); they are used, and removed, instead of reading
+    the files again.
+    """
+    workers = max(1, workers)
+    usage = usage if usage is not None else BudgetUsage(budget)
+    lookahead = workers * _LOOKAHEAD_PER_WORKER
+    max_bypass = workers * _MAX_BYPASS_PER_WORKER
+    jobs = iter(jobs)
+    exhausted = False
+    read = 0
+    waiting: deque = deque()
+    running: Dict[Future, Tuple[int, str, int]] = {}
+    finished: Dict[int, Tuple[str, CropResult]] = {}
+    next_index = 0
+    in_use = 0
+    owned = None  # a pool created here (none given, or a worker died), shut down here
+
+    # Pillow imports its format plugins on first use. A worker forked while a
+    # reader thread holds that import lock would hang, so they are loaded first.
+    Image.init()
+    try:
+        with ThreadPoolExecutor(max_workers=DEFAULT_THREADS) as readers:
+            if executor is None:
+                executor = owned = ProcessPoolExecutor(max_workers=workers)
+            while True:
+                while not exhausted and len(waiting) < lookahead:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    fname, input_path, outputs = job
+                    known = headers.pop(input_path, None) if headers else None
+                    if known is None:
+                        header = readers.submit(read_header, input_path)
+                    else:
+                        header = Future()
+                        header.set_result(known)
+                    waiting.append(_Waiting(read, fname, input_path, outputs, header))
+                    read += 1
+
+                while waiting and len(running) < workers:
+                    head = waiting[0]
+                    chosen = None
+                    for position, entry in enumerate(waiting):
+                        if position > 0 and head.bypassed >= max_bypass:
+                            break
+                        cost = decoded_bytes(entry.header.result(), entry.outputs, roi)
+                        if not running or in_use + cost <= budget:
+                            chosen = position, entry, cost
+                            break
+                    if chosen is None:
+                        break
+                    position, entry, cost = chosen
+                    del waiting[position]
+                    if position > 0:
+                        head.bypassed += 1
+                    if cost > budget:
+                        usage.alone += 1
+                    args = (crop_job, entry.input_path, entry.outputs, jpegtran, profile, roi)
+                    try:
+                        future = executor.submit(*args)
+                    except BrokenProcessPool:
+                        # A worker died (e.g. killed for memory): its files already
+                        # failed, the rest of the batch goes on in a fresh pool.
+                        if owned is not None:
+                            owned.shutdown(wait=False)
+                        executor = owned = ProcessPoolExecutor(max_workers=workers)
+                        future = executor.submit(*args)
+                    running[future] = entry.index, entry.fname, cost
+                    in_use += cost
+                    usage.sample(in_use)
+
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+                if not running:
+                    if exhausted and not waiting:
+                        return
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, fname, cost = running.pop(future)
+                    in_use -= cost
+                    usage.sample(in_use)
+                    finished[index] = fname, _outcome(future)
+    finally:
+        if owned is not None:
+            owned.shutdown(cancel_futures=True)
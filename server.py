@@ -0,0 +1,201 @@
+import importlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from typing import List, Optional
+
+# Paths in the command line that the server must resolve against the client's
+# working directory (its worker processes never change directory).
+_PATH_ARGS = ("input", "output", "template_group", "profile_trace", "stack")
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "bulk_crop.sock")
+    return os.path.join("/tmp", f"bulk_crop-{os.getuid()}.sock")
+
+
+class _StreamWriter:
+    """Text stream that forwards each completed line to the client as a JSON message."""
+
+    def __init__(self, wfile, key: str):
+        self._wfile = wfile
+        self._key = key
+        self._buffer = ""
+        self.broken = False
+
+    def write(self, text: str) -> int:
+        self._buffer += text
+        if "\n" in self._buffer:
+            lines, self._buffer = self._buffer.rsplit("\n", 1)
+            self._send(lines + "\n")
+        return len(text)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._send(self._buffer)
+            self._buffer = ""
+
+    def _send(self, text: str) -> None:
+        if not self.broken:
+            self.broken = not _send(self._wfile, {self._key: text})
+
+
+def _send(wfile, message: dict) -> bool:
+    """Send one message; a client that went away does not interrupt the job."""
+    try:
+        wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        wfile.flush()
+    except OSError:
+        return False
+    return True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            argv = [str(arg) for arg in request["argv"]]
+            cwd = str(request["cwd"])
+        except (ValueError, KeyError, TypeError):
+            _send(self.wfile, {"err": "Richiesta non valida.\n"})
+            _send(self.wfile, {"exit": 2})
+            return
+        out = _StreamWriter(self.wfile, "out")
+        err = _StreamWriter(self.wfile, "err")
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                code = self.server.run_job(argv, cwd)
+            except SystemExit as exc:  # argparse errors and --help
+                code = exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+            except Exception as exc:  # one bad job must not take the server down
+                print(f"Errore del server: {type(exc).__name__}: {exc}")
+                code = 1
+        out.flush()
+        err.flush()
+        _send(self.wfile, {"exit": code})
+
+
+class _Server(socketserver.UnixStreamServer):
+    """Runs one job at a time on a process pool started once.
+
+    Jobs are serialized because the command's output is captured by
+    redirecting ``sys.stdout``; their crops still run on every worker.
+    """
+
+    def __init__(self, path: str, executor):
+        super().__init__(path, _Handler)
+        self.executor = executor
+
+    def run_job(self, argv: List[str], cwd: str) -> int:
+        from main import parse_args, run
+
+        previous = os.getcwd()
+        os.chdir(cwd)  # templates/ is looked up relative to the client's directory
+        try:
+            args = parse_args(argv)
+            if args.serve or args.watch:
+                print("--serve e --watch non sono disponibili tramite il server.")
+                return 1
+            for name in _PATH_ARGS:
+                value = getattr(args, name)
+                if value:
+                    setattr(args, name, os.path.abspath(value))
+            return run(args, self.executor)
+        finally:
+            os.chdir(previous)
+
+
+def _warm(_) -> int:
+    return os.getpid()
+
+
+def _is_listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _stop(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(path: Optional[str], workers: int) -> int:
+    """Serve crop jobs on the Unix socket ``path`` until interrupted.
+
+    Pillow and the crop modules are imported, the templates parsed and the
+    ``workers`` processes started once, before the first job; each job is a
+    ``main.py`` command line sent by :func:`run_client`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from template_manager import list_templates
+
+    importlib.import_module("crop_engine")  # loaded before the workers are forked
+
+    path = path or default_socket_path()
+    if os.path.exists(path):
+        if _is_listening(path):
+            print(f"Un server è già in ascolto su '{path}'.")
+            return 1
+        os.unlink(path)
+    list_templates()
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(_warm, range(max(1, workers))))
+        old_umask = os.umask(0o177)
+        try:
+            server = _Server(path, executor)
+        finally:
+            os.umask(old_umask)
+        signal.signal(signal.SIGTERM, _stop)
+        print(f"Server in ascolto su '{path}' con {max(1, workers)} worker (Ctrl+C per terminare).")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    print("Server terminato.")
+    return 0
+
+
+def run_client(path: str, argv: List[str]) -> int:
+    """Send the command line ``argv`` to the server on ``path``, relay its output and return its exit code.
+
+    When no server answers, the command is run in this process instead.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError as exc:
+        conn.close()
+        print(f"Server non raggiungibile su '{path}' ({exc}): eseguo in locale.", file=sys.stderr)
+        from main import parse_args, run
+
+        return run(parse_args(argv))
+    with conn, conn.makefile("rwb") as stream:
+        stream.write(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+            elif "exit" in message:
+                return int(message["exit"])
+    print("Connessione al server interrotta.", file=sys.stderr)
+    return 1
@@ -0,0 +1,167 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+SHARD_LOG_VERSION = 1
+_SHARD_PATTERN = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+_LOG_PREFIX = ".bulk_crop_shard-"
+
+
+class ShardError(ValueError):
+    """Raised for a malformed ``--shard`` value or unreadable shard logs."""
+
+
+class Shard(NamedTuple):
+    """Shard ``index`` (1-based) out of ``count``."""
+
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    @property
+    def suffix(self) -> str:
+        """Tag used in the names of the files owned by this shard."""
+        return f"{self.index}-of-{self.count}"
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse ``"i/N"`` with ``1 <= i <= N``."""
+    match = _SHARD_PATTERN.match(value)
+    if match is None:
+        raise ShardError(f"Shard '{value}' non valido: usa il formato i/N, es. 1/4.")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise ShardError(f"Shard '{value}' non valido: serve 1 <= i <= N.")
+    return Shard(index, count)
+
+
+def shard_of(rel_path: str, count: int) -> int:
+    """Return the 1-based shard owning ``rel_path``.
+
+    The hash of the ``/``-separated relative path is the same on every
+    machine and Python version (unlike ``hash()``), so nodes agree on the
+    split without talking to each other.
+    """
+    digest = hashlib.blake2b(rel_path.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count + 1
+
+
+def log_path(output_folder: str, shard: Shard) -> str:
+    return os.path.join(output_folder, f"{_LOG_PREFIX}{shard.suffix}.json")
+
+
+class ShardLog:
+    """Inputs a shard covered (cropped now or already up to date) and those that failed."""
+
+    def __init__(self, shard: Shard):
+        self.shard = shard
+        self.covered: List[str] = []
+        self.failed: Dict[str, str] = {}
+
+    def owns(self, rel_path: str) -> bool:
+        return shard_of(rel_path, self.shard.count) == self.shard.index
+
+    def save(self, output_folder: str, finished: bool = True) -> str:
+        """Write the log atomically into ``output_folder`` and return its path."""
+        path = log_path(output_folder, self.shard)
+        data = {
+            "version": SHARD_LOG_VERSION,
+            "shard": [self.shard.index, self.shard.count],
+            "host": socket.gethostname(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "finished": finished,
+            "covered": sorted(self.covered),
+            "failed": self.failed,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_logs(output_folder: str) -> List[Dict[str, object]]:
+    """Load every shard log found in ``output_folder``."""
+    logs = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(output_folder), f"{_LOG_PREFIX}*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError) as exc:
+            raise ShardError(f"Impossibile leggere il log '{path}': {exc}") from exc
+        if data.get("version") != SHARD_LOG_VERSION:
+            raise ShardError(f"Versione del log '{path}' non supportata.")
+        data["path"] = path
+        logs.append(data)
+    return logs
+
+
+def verify_coverage(inputs: Iterable[str], logs: List[Dict[str, object]]) -> Tuple[List[str], bool]:
+    """Check that the shard logs cover every input exactly once.
+
+    Returns the report lines and whether the run is complete.
+    """
+    report: List[str] = []
+    if not logs:
+        return ["Nessun log di shard trovato."], False
+    counts = {int(log["shard"][1]) for log in logs}
+    if len(counts) != 1:
+        return [f"I log usano numeri di shard diversi: {sorted(counts)}."], False
+    count = counts.pop()
+    present = sorted(int(log["shard"][0]) for log in logs)
+    missing_shards = sorted(set(range(1, count + 1)) - set(present))
+    ok = True
+    if missing_shards:
+        report.append(f"Shard senza log: {', '.join(f'{index}/{count}' for index in missing_shards)}.")
+        ok = False
+    unfinished = [log for log in logs if not log.get("finished")]
+    for log in unfinished:
+        report.append(f"Shard {log['shard'][0]}/{count} non terminato ({log.get('host')}).")
+        ok = False
+
+    owners: Dict[str, List[int]] = {}
+    failed: Dict[str, str] = {}
+    for log in logs:
+        index = int(log["shard"][0])
+        for name in log.get("covered") or ():
+            owners.setdefault(name, []).append(index)
+        failed.update(log.get("failed") or {})
+
+    expected = set(inputs)
+    uncovered = sorted(expected - set(owners))
+    duplicated = sorted(name for name, shards in owners.items() if len(shards) > 1)
+    misplaced = sorted(
+        name for name, shards in owners.items() if len(shards) == 1 and shard_of(name, count) != shards[0]
+    )
+    stale = sorted(set(owners) - expected)
+    for label, names in (
+        ("Input non coperti", uncovered),
+        ("Input coperti da più shard", duplicated),
+        ("Input coperti dallo shard sbagliato", misplaced),
+    ):
+        if names:
+            ok = False
+            report.append(f"{label}: {len(names)}")
+            report.extend(f"  {name}" + (f" ({failed[name]})" if name in failed else "") for name in names[:20])
+            if len(names) > 20:
+                report.append(f"  ... e altri {len(names) - 20}")
+    if stale:
+        report.append(f"Nei log ma non più tra gli input: {len(stale)}")
+    covered = len(expected) - len(uncovered)
+    report.append(f"Shard: {len(present)}/{count}; input coperti: {covered}/{len(expected)}.")
+    return report, ok
+
+
+def manifest_filename(base: str, shard: Optional[Shard]) -> str:
+    """Per-shard manifest name, so nodes sharing an output folder never write the same file."""
+    if shard is None:
+        return base
+    stem, extension = os.path.splitext(base)
+    return f"{stem}.shard-{shard.suffix}{extension}"
@@ -1,11 +1,17 @@
 import json
 import os
 import re
+import threading
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+from encoding_presets import EncodingError, encoding_from_dict
 
 TEMPLATES_DIR = "templates"
 DEFAULT_TEMPLATE_NAME = "default"
+INDEX_FILENAME = ".template_index.json"
+# Bump whenever _normalize_template's output changes, so stale records are re-parsed.
+INDEX_VERSION = 2
 _TEMPLATE_EXTENSION = ".json"
 _SAFE_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_-]+")
 
@@ -18,30 +24,212 @@ def _template_path(name: str) -> str:
     return os.path.join(TEMPLATES_DIR, f"{name}.json")
 
 
+class _TemplateIndex:
+    """Normalized templates of one directory, cached in memory and on disk.
+
+    Each record is keyed by template name and holds the file's ``mtime_ns``
+    and size with either the normalized template or the error it raised.
+    The records are persisted to :data:`INDEX_FILENAME`, so a new process
+    only re-parses the files that changed since the index was written. The
+    directory is rescanned only when its own mtime changes (a file added,
+    removed or renamed); otherwise the records are trusted, so listing and
+    searching cost no ``stat`` per template. A template edited in place does
+    not move the directory's mtime: it is picked up when loaded, since single
+    lookups re-stat just the requested file.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        self.records: Dict[str, Dict[str, object]] = {}
+        self.dir_mtime_ns: Optional[int] = None
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return
+        if isinstance(data, dict) and data.get("version") == INDEX_VERSION:
+            self.records = dict(data.get("templates") or {})
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        data = {"version": INDEX_VERSION, "templates": self.records}
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(data, fh, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # the index is only an accelerator; a read-only folder still works
+
+    def refresh(self) -> None:
+        """Bring the records in line with the directory and its files."""
+        try:
+            dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self.records = {}
+            self.dir_mtime_ns = None
+            return
+        if dir_mtime_ns == self.dir_mtime_ns:
+            return
+        changed = False
+        seen = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name == INDEX_FILENAME or not entry.name.lower().endswith(_TEMPLATE_EXTENSION):
+                    continue
+                name = os.path.splitext(entry.name)[0]
+                seen.add(name)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if not self._is_current(name, stat):
+                    self._parse(name, entry.path, stat)
+                    changed = True
+        for name in set(self.records) - seen:
+            del self.records[name]
+            changed = True
+        if changed:
+            self.save()
+        # Recorded before our own save touched the directory, so the next
+        # call rescans once, finds nothing to do and settles.
+        self.dir_mtime_ns = dir_mtime_ns
+
+    def lookup(self, name: str) -> Optional[Dict[str, object]]:
+        """Return the record of ``name``, re-parsing the file only if it changed."""
+        path = os.path.join(self.directory, f"{name}{_TEMPLATE_EXTENSION}")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if self.records.pop(name, None) is not None:
+                self.save()
+            return None
+        if not self._is_current(name, stat):
+            self._parse(name, path, stat)
+            self.save()
+        return self.records[name]
+
+    def _is_current(self, name: str, stat: os.stat_result) -> bool:
+        record = self.records.get(name)
+        return record is not None and record["mtime_ns"] == stat.st_mtime_ns and record["size"] == stat.st_size
+
+    def _parse(self, name: str, path: str, stat: os.stat_result) -> None:
+        record: Dict[str, object] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        try:
+            with open(path, "r", encoding="utf-8-sig") as fh:
+                data = json.load(fh)
+            record["template"] = _normalize_template(data, name)
+        except OSError as exc:
+            record["error"] = f"Impossibile leggere il template '{name}': {exc}"
+        except json.JSONDecodeError as exc:
+            record["error"] = f"File JSON non valido: {exc}"
+        except (TemplateError, TypeError, ValueError, AttributeError) as exc:
+            record["error"] = str(exc) if isinstance(exc, TemplateError) else f"Template non valido: {exc}"
+        self.records[name] = record
+
+
+_indexes: Dict[str, _TemplateIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _index() -> _TemplateIndex:
+    """Return the index of the current :data:`TEMPLATES_DIR`."""
+    directory = os.path.abspath(TEMPLATES_DIR)
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = _TemplateIndex(directory)
+        return index
+
+
+def _copy_template(template: Dict[str, object]) -> Dict[str, object]:
+    return {
+        **template,
+        "encoding": dict(template.get("encoding") or {}),
+        "derivatives": list(template.get("derivatives") or ()),
+    }
+
+
 def list_templates() -> List[str]:
     """Return the available template names (without extensions)."""
-    if not os.path.isdir(TEMPLATES_DIR):
-        return []
-    names: List[str] = []
-    for entry in os.listdir(TEMPLATES_DIR):
-        if entry.lower().endswith(_TEMPLATE_EXTENSION):
-            names.append(os.path.splitext(entry)[0])
-    return sorted(names)
+    index = _index()
+    with index.lock:
+        index.refresh()
+        return sorted(index.records)
+
+
+def search_templates(query: str) -> List[Tuple[str, Dict[str, object]]]:
+    """Return ``(name, template)`` for the valid templates whose name or description contains ``query``.
+
+    The match is case-insensitive and runs over the index, without opening
+    any template file; an empty query returns every valid template.
+    """
+    needle = query.strip().casefold()
+    index = _index()
+    with index.lock:
+        index.refresh()
+        matches = []
+        for name in sorted(index.records):
+            template = index.records[name].get("template")
+            if template is None:
+                continue
+            haystack = f"{name}\n{template['template_name']}\n{template['description']}".casefold()
+            if needle in haystack:
+                matches.append((name, _copy_template(template)))
+        return matches
 
 
 def load_template(name: str = DEFAULT_TEMPLATE_NAME) -> Dict[str, int]:
     """Load a template by name and return normalized crop coordinates."""
-    path = _template_path(name)
-    if not os.path.isfile(path):
+    index = _index()
+    with index.lock:
+        record = index.lookup(name)
+    if record is None:
         available = list_templates()
         hint = f" Disponibili: {', '.join(available)}." if available else ""
         raise TemplateError(f"Template '{name}' non trovato in '{TEMPLATES_DIR}'.{hint}")
+    if "error" in record:
+        raise TemplateError(str(record["error"]))
+    return _copy_template(record["template"])
+
+
+def load_template_group(source_path: str) -> Dict[str, Dict[str, int]]:
+    """Load a template group file and return its templates keyed by a folder-safe name.
+
+    The file holds either a JSON list or an object with a ``templates`` list;
+    each entry is the name of a stored template or an inline template object.
+    """
+    path = Path(source_path).expanduser()
     try:
-        with open(path, "r", encoding="utf-8-sig") as fh:
+        with path.open("r", encoding="utf-8-sig") as fh:
             data = json.load(fh)
     except OSError as exc:
-        raise TemplateError(f"Impossibile leggere il template '{name}': {exc}") from exc
-    return _normalize_template(data, name)
+        raise TemplateError(f"Impossibile leggere il gruppo di template: {exc}") from exc
+    except json.JSONDecodeError as exc:
+        raise TemplateError(f"File JSON non valido: {exc}") from exc
+
+    entries = data.get("templates") if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        raise TemplateError("Il gruppo deve contenere una lista 'templates' non vuota.")
+
+    group: Dict[str, Dict[str, int]] = {}
+    for index, entry in enumerate(entries, start=1):
+        if isinstance(entry, str):
+            key = entry
+            template = load_template(entry)
+        elif isinstance(entry, dict):
+            template = _normalize_template(entry, fallback_name=f"{path.stem}_{index}")
+            key = _slugify(template["template_name"]) or f"{path.stem}_{index}"
+        else:
+            raise TemplateError(f"Voce {index} del gruppo non valida: atteso un nome o un oggetto.")
+        if key in group:
+            raise TemplateError(f"Template '{key}' ripetuto nel gruppo.")
+        group[key] = template
+    return group
 
 
 def import_template_from_file(source_path: str, overwrite: bool = False) -> str:
@@ -78,14 +266,38 @@ def import_template_from_file(source_path: str, overwrite: bool = False) -> str:
     except OSError as exc:
         raise TemplateError(f"Impossibile salvare il template importato: {exc}") from exc
 
+    index = _index()
+    with index.lock:
+        index.lookup(dest_name)
     return dest_name
 
 
+def save_template(data: Dict[str, object], overwrite: bool = False) -> str:
+    """Validate ``data``, store it in the templates directory and return its stored name."""
+    normalized = _normalize_template(data, fallback_name="template")
+    name = _slugify(normalized["template_name"]) or "template"
+    dest = Path(_template_path(name))
+    if dest.exists() and not overwrite:
+        raise TemplateError(f"Il template '{name}' esiste già.")
+    try:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    except OSError as exc:
+        raise TemplateError(f"Impossibile salvare il template: {exc}") from exc
+
+    index = _index()
+    with index.lock:
+        index.lookup(name)
+    return name
+
+
 def export_template_to_file(name: str, destination_path: str, overwrite: bool = False) -> str:
     """Export a stored template to an external JSON file and return the final path."""
     src = Path(_template_path(name))
-    if not src.is_file():
-        raise TemplateError(f"Template '{name}' non trovato in '{TEMPLATES_DIR}'.")
+    index = _index()
+    with index.lock:
+        if index.lookup(name) is None:
+            raise TemplateError(f"Template '{name}' non trovato in '{TEMPLATES_DIR}'.")
 
     try:
         content = src.read_text(encoding="utf-8-sig")
@@ -106,6 +318,10 @@ def export_template_to_file(name: str, destination_path: str, overwrite: bool =
     except OSError as exc:
         raise TemplateError(f"Impossibile scrivere il file di destinazione: {exc}") from exc
 
+    # Exporting into the templates folder itself adds a template.
+    if dest.parent.resolve() == Path(index.directory).resolve():
+        with index.lock:
+            index.lookup(dest.stem)
     return str(dest)
 
 
@@ -142,6 +358,11 @@ def _normalize_template(data: Dict[str, int], fallback_name: str) -> Dict[str, i
 
     template_name = str(data.get("name") or fallback_name)
     description = str(data.get("description") or "")
+    try:
+        encoding = encoding_from_dict(data.get("encoding"))
+    except EncodingError as exc:
+        raise TemplateError(f"Codifica del template non valida: {exc}") from exc
+    derivatives = _normalize_derivatives(data.get("derivatives"))
 
     return {
         "template_name": template_name,
@@ -152,9 +373,23 @@ def _normalize_template(data: Dict[str, int], fallback_name: str) -> Dict[str, i
         "bottom": bottom,
         "width": width,
         "height": height,
+        "encoding": encoding,
+        "derivatives": derivatives,
     }
 
 
+def _normalize_derivatives(value) -> List[int]:
+    """Longest sides of the scaled copies of the crop, largest first."""
+    if not value:
+        return []
+    # bool is an int subclass: "derivatives": [true] must not become a 1 px copy.
+    if not isinstance(value, list) or not all(
+        isinstance(size, int) and not isinstance(size, bool) and size > 0 for size in value
+    ):
+        raise TemplateError("'derivatives' deve essere una lista di lati in pixel positivi, es. [1024, 512, 256].")
+    return sorted(set(value), reverse=True)
+
+
 def _slugify(value: str) -> str:
     slug = _SAFE_NAME_PATTERN.sub("_", value.strip())
     slug = slug.strip("_")
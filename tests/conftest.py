@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The modules live flat at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def noise():
+    """Factory of RGB noise images, so every pixel position is distinguishable."""
+
+    def make(width=100, height=60, seed=0):
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        return Image.fromarray(pixels)
+
+    return make
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, noise):
+    """A working directory with ``templates/`` and an ``input/`` folder of noise images.
+
+    Returns a function writing a template; ``main.run`` resolves both
+    folders against the working directory, as the CLI does.
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "templates").mkdir()
+    (tmp_path / "input").mkdir()
+
+    def template(name="default", left=10, top=5, right=60, bottom=45, **extra):
+        data = {"template_name": name, "left": left, "top": top, "right": right, "bottom": bottom, **extra}
+        (tmp_path / "templates" / f"{name}.json").write_text(json.dumps(data), encoding="utf-8")
+
+    template()
+    return template
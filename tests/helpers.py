@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+
+def run_main(*argv):
+    """Run ``main.py`` with the command line ``argv`` in this process; return its exit code."""
+    import main
+
+    saved = sys.argv
+    sys.argv = ["main.py", *argv]
+    try:
+        return main.main()
+    finally:
+        sys.argv = saved
+
+
+def add_inputs(count, folder="input", prefix="img", start=0, width=100, height=60, ext="png"):
+    """Write ``count`` distinct noise images into ``folder``; return their names."""
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for index in range(start, start + count):
+        name = f"{prefix}{index:02d}.{ext}"
+        pixels = np.random.default_rng(index).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(folder, name))
+        names.append(name)
+    return names
+
+
+def count_opens(monkeypatch):
+    """Record the source of every ``Image.open`` call from now on; each decoded input is opened once."""
+    opened = []
+    real_open = Image.open
+
+    def counting_open(fp, *args, **kwargs):
+        opened.append(fp)
+        return real_open(fp, *args, **kwargs)
+
+    monkeypatch.setattr(Image, "open", counting_open)
+    return opened
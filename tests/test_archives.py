@@ -0,0 +1,46 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from helpers import add_inputs, run_main
+
+BOX = (10, 5, 60, 45)
+
+
+def _expected(names, folder="input"):
+    crops = {}
+    for name in names:
+        with Image.open(os.path.join(folder, name)) as source:
+            crops[name] = np.asarray(source.crop(BOX))
+    return crops
+
+
+def _check(members, expected):
+    assert list(members) == list(expected)
+    for name, data in members.items():
+        with Image.open(io.BytesIO(data)) as out:
+            assert out.size == (BOX[2] - BOX[0], BOX[3] - BOX[1])
+            assert np.array_equal(np.asarray(out), expected[name])
+
+
+def test_folder_to_zip_keeps_member_paths_and_pixels(workspace):
+    names = add_inputs(3) + [f"sub/{name}" for name in add_inputs(2, folder="input/sub", start=3)]
+    assert run_main("-r", "-w", "2", "-o", "crops.zip") == 0
+    with zipfile.ZipFile("crops.zip") as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+    _check(members, _expected(names))
+
+
+def test_tar_to_tar_streams_members_in_order(workspace):
+    names = add_inputs(4)
+    with tarfile.open("scans.tar.gz", "w:gz") as archive:
+        for name in names:
+            archive.add(os.path.join("input", name), arcname=f"batch/{name}")
+    assert run_main("-i", "scans.tar.gz", "-w", "2", "-o", "crops.tar") == 0
+    with tarfile.open("crops.tar") as archive:
+        members = {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+    _check(members, {f"batch/{name}": crop for name, crop in _expected(names).items()})
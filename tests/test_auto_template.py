@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+from auto_template import AutoTemplateError, detect_box, template_data
+from helpers import run_main
+
+CONTENT = (40, 30, 160, 120)
+
+
+def _scans(folder, count):
+    """White 200x150 pages with a dark block at :data:`CONTENT`, as cropped scans would have."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        page = Image.new("RGB", (200, 150), "white")
+        ImageDraw.Draw(page).rectangle((CONTENT[0], CONTENT[1], CONTENT[2] - 1, CONTENT[3] - 1), fill=(20, 20, 20))
+        path = os.path.join(folder, f"scan{index:02d}.png")
+        page.save(path)
+        paths.append(path)
+    return paths
+
+
+def test_detect_box_finds_the_content_and_skips_a_corrupt_sample(tmp_path):
+    paths = _scans(str(tmp_path), 5)
+    bad = tmp_path / "bad.png"
+    bad.write_bytes(b"not an image")
+    detected = detect_box(paths + [str(bad)])
+    assert (detected["left"], detected["top"], detected["right"], detected["bottom"]) == CONTENT
+    assert detected["image_size"] == (200, 150)
+    assert detected["samples"] == 5
+    assert [path for path, _ in detected["unreadable"]] == [str(bad)]
+    assert "UnidentifiedImageError" in detected["unreadable"][0][1]
+
+    data = template_data("scans", {**detected, "left": 35})
+    assert data["name"] == "scans"
+    assert (data["left"], data["top"], data["right"], data["bottom"]) == (35,) + CONTENT[1:]
+    assert "5 immagini 200x150" in data["description"]
+
+
+def test_detect_box_fails_only_without_readable_samples(tmp_path):
+    for index in range(3):
+        (tmp_path / f"bad{index}.png").write_bytes(b"not an image")
+    with pytest.raises(AutoTemplateError):
+        detect_box([str(path) for path in sorted(tmp_path.iterdir())])
+
+
+def test_cli_saves_the_template_and_reports_the_corrupt_file(workspace, capsys):
+    _scans("input", 4)
+    with open(os.path.join("input", "bad.png"), "wb") as fh:
+        fh.write(b"not an image")
+    assert run_main("--auto-template", "scans", "--margin", "2") == 0
+    out = capsys.readouterr().out
+    assert "Ignorate 1 immagini campionate illeggibili:" in out
+    assert " - bad.png: UnidentifiedImageError" in out
+    with open(os.path.join("templates", "scans.json"), encoding="utf-8") as fh:
+        saved = json.load(fh)
+    assert (saved["left"], saved["top"], saved["right"], saved["bottom"]) == (38, 28, 162, 122)
@@ -0,0 +1,59 @@
+import os
+
+from batch import iter_image_files
+
+
+def _tree(root):
+    for rel_path in (
+        "b.png",
+        "a.jpg",
+        "notes.txt",
+        "sub/c.png",
+        "sub/deep/d.tif",
+        "sub/skip.jpeg",
+        "raw/e.png",
+        "out/f.png",
+        "z/g.png",
+    ):
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    (root / "sub" / "folder.png").mkdir()  # a directory with an image name is not a file
+    os.symlink(root / "sub", root / "linked")
+
+
+def test_files_come_before_subfolders_and_symlinked_folders_are_not_followed(tmp_path):
+    _tree(tmp_path)
+    assert list(iter_image_files(str(tmp_path))) == ["a.jpg", "b.png"]
+    assert list(iter_image_files(str(tmp_path), recursive=True)) == [
+        "a.jpg",
+        "b.png",
+        "out/f.png",
+        "raw/e.png",
+        "sub/c.png",
+        "sub/skip.jpeg",
+        "sub/deep/d.tif",
+        "z/g.png",
+    ]
+
+
+def test_globs_and_skipped_folders(tmp_path):
+    _tree(tmp_path)
+    listed = iter_image_files(
+        str(tmp_path),
+        recursive=True,
+        include=["*.png", "sub/*"],
+        exclude=["raw", "*.jpeg"],
+        skip_dirs=[str(tmp_path / "out")],
+    )
+    assert list(listed) == ["b.png", "sub/c.png", "sub/deep/d.tif", "z/g.png"]
+    unsorted = iter_image_files(str(tmp_path), recursive=True, sort=False, skip_dirs=[str(tmp_path / "out")])
+    assert sorted(unsorted) == [
+        "a.jpg",
+        "b.png",
+        "raw/e.png",
+        "sub/c.png",
+        "sub/deep/d.tif",
+        "sub/skip.jpeg",
+        "z/g.png",
+    ]
@@ -0,0 +1,64 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from crop_engine import crop_image, crop_images
+
+BOX = (10, 5, 60, 45)
+
+
+def _sources(tmp_path, image):
+    path = tmp_path / "source.png"
+    image.save(path)
+    data = path.read_bytes()
+    return {"path": str(path), "pathlike": path, "bytes": data, "file": io.BytesIO(data)}
+
+
+@pytest.mark.parametrize("kind", ["path", "pathlike", "bytes", "file"])
+def test_crop_image_accepts_every_source_kind(tmp_path, noise, kind):
+    image = noise()
+    encoded = crop_image(_sources(tmp_path, image)[kind], BOX)
+    assert isinstance(encoded, bytes)
+    with Image.open(io.BytesIO(encoded)) as out:
+        assert out.format == "PNG"
+        assert np.array_equal(np.asarray(out), np.asarray(image.crop(BOX)))
+
+
+def test_crop_image_returns_a_pil_image_or_the_template_encoding(tmp_path, noise):
+    image = noise()
+    cropped = crop_image(_sources(tmp_path, image)["bytes"], BOX, as_image=True)
+    assert isinstance(cropped, Image.Image)
+    assert np.array_equal(np.asarray(cropped), np.asarray(image.crop(BOX)))
+
+    template = {"left": 10, "top": 5, "right": 60, "bottom": 45, "encoding": {"format": "jpeg", "quality": 80}}
+    encoded = crop_image(_sources(tmp_path, image)["path"], template)
+    assert encoded[:2] == b"\xff\xd8"
+    with Image.open(io.BytesIO(encoded)) as out:
+        assert out.size == (50, 40)
+
+
+def test_crop_images_in_a_pool_match_serial_crops_in_order(tmp_path, noise):
+    sources = []
+    for seed in range(8):
+        path = tmp_path / f"{seed}.png"
+        noise(seed=seed).save(path)
+        sources.append(str(path) if seed % 2 else io.BytesIO(path.read_bytes()))
+    serial = list(crop_images(sources, BOX))
+    for source in sources:
+        if isinstance(source, io.BytesIO):
+            source.seek(0)
+    assert list(crop_images(sources, BOX, workers=3)) == serial
+    for seed, encoded in enumerate(serial):
+        with Image.open(io.BytesIO(encoded)) as out:
+            assert np.array_equal(np.asarray(out), np.asarray(noise(seed=seed).crop(BOX)))
+
+
+def test_crop_images_raises_for_the_first_bad_source(tmp_path, noise):
+    path = tmp_path / "good.png"
+    noise().save(path)
+    crops = crop_images([str(path), b"not an image", str(path)], BOX, workers=2)
+    assert isinstance(next(crops), bytes)
+    with pytest.raises(UnidentifiedImageError):
+        next(crops)
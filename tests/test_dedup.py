@@ -0,0 +1,55 @@
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from helpers import add_inputs, count_opens, run_main
+
+
+def _inode(name, folder="output"):
+    return os.stat(os.path.join(folder, name)).st_ino
+
+
+def test_identical_inputs_are_cropped_once_and_linked(workspace, monkeypatch, capsys):
+    names = add_inputs(2)
+    shutil.copyfile("input/img00.png", "input/copy_a.png")
+    shutil.copyfile("input/img00.png", "input/copy_b.png")
+    opened = count_opens(monkeypatch)
+    assert run_main("-w", "1", "--dedup") == 0
+    out = capsys.readouterr().out
+    assert len(opened) == 2
+    assert out.count("Duplicato") == 2
+    assert _inode("copy_a.png") == _inode("copy_b.png") == _inode("img00.png")
+    assert _inode(names[1]) != _inode(names[0])
+    with Image.open("input/img00.png") as source, Image.open("output/copy_b.png") as out_img:
+        assert np.array_equal(np.asarray(out_img), np.asarray(source.crop((10, 5, 60, 45))))
+
+
+def test_duplicate_in_a_later_run_reuses_earlier_output(workspace, monkeypatch, capsys):
+    add_inputs(2)
+    run_main("-w", "1", "--dedup")
+    shutil.copyfile("input/img01.png", "input/again.png")
+    opened = count_opens(monkeypatch)
+    capsys.readouterr()
+    run_main("-w", "1", "--dedup")
+    assert opened == []
+    assert "esecuzione precedente" in capsys.readouterr().out
+    assert _inode("again.png") == _inode("img01.png")
+
+
+def test_force_rewrites_without_touching_linked_duplicates(workspace):
+    """Rewriting an output must not change the content of the other names hardlinked to it."""
+    add_inputs(1)
+    shutil.copyfile("input/img00.png", "input/copy.png")
+    run_main("-w", "1", "--dedup")
+    with Image.open("output/copy.png") as img:
+        before = np.asarray(img)
+
+    workspace(left=0, top=0, right=30, bottom=30)
+    os.remove("input/copy.png")
+    run_main("-w", "1", "--dedup", "--force")
+    with Image.open("output/img00.png") as img:
+        assert img.size == (30, 30)
+    with Image.open("output/copy.png") as img:
+        assert np.array_equal(np.asarray(img), before)
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from helpers import add_inputs, run_main
+
+BOX = (10, 5, 60, 45)
+
+
+def test_derivatives_are_scaled_from_the_crop_into_size_folders(workspace, capsys):
+    workspace(derivatives=[20, 40])
+    names = add_inputs(3)
+    assert run_main("-w", "2") == 0
+    for name in names:
+        with Image.open(os.path.join("input", name)) as source:
+            crop = source.crop(BOX)
+        large = crop.resize((40, 32), Image.LANCZOS)
+        small = large.resize((20, 16), Image.LANCZOS)
+        for folder, expected in (("output", crop), ("output/40", large), ("output/20", small)):
+            with Image.open(os.path.join(folder, name)) as out:
+                assert np.array_equal(np.asarray(out), np.asarray(expected))
+
+    capsys.readouterr()
+    run_main("-w", "1")
+    assert "Saltate 3 immagini" in capsys.readouterr().out
+
+
+def test_derivative_larger_than_the_crop_is_not_enlarged(workspace):
+    workspace(derivatives=[500])
+    names = add_inputs(1)
+    run_main("-w", "1")
+    with Image.open(os.path.join("output", "500", names[0])) as out:
+        assert out.size == (50, 40)
+
+
+def test_jpeg_decoded_at_reduced_scale_when_only_derivatives_are_needed(workspace, monkeypatch):
+    workspace(left=0, top=0, right=800, bottom=600, derivatives=[100])
+    names = add_inputs(1, width=800, height=600, ext="jpg")
+    run_main("-w", "1")
+    with Image.open(os.path.join("output", "100", names[0])) as out:
+        full_decode = np.asarray(out, dtype=np.int16)
+    # Only the derivative is missing now: the full-size crop is current in its manifest.
+    os.remove(os.path.join("output", "100", names[0]))
+    drafts = []
+    real_draft = JpegImagePlugin.JpegImageFile.draft
+    monkeypatch.setattr(
+        JpegImagePlugin.JpegImageFile, "draft", lambda img, *args: drafts.append(args) or real_draft(img, *args)
+    )
+    run_main("-w", "1")
+    assert drafts
+    with Image.open(os.path.join("output", "100", names[0])) as out:
+        assert out.size == (100, 75)
+        # Decoded at a reduced DCT scale: close to, not exactly, the resize of the full decode.
+        assert np.abs(np.asarray(out, dtype=np.int16) - full_decode).mean() < 8
@@ -0,0 +1,43 @@
+import os
+
+from PIL import Image
+
+from helpers import add_inputs, run_main
+
+
+def test_format_change_converts_and_prunes_old_extension(workspace, capsys):
+    names = add_inputs(3)
+    run_main("-w", "1")
+    assert sorted(os.listdir("output")) == [".bulk_crop_manifest.json", *names]
+
+    run_main("-w", "1", "--format", "webp", "--prune")
+    out = capsys.readouterr().out
+    webps = [name.replace(".png", ".webp") for name in names]
+    assert sorted(name for name in os.listdir("output") if not name.startswith(".")) == webps
+    assert "sostituita da img00.webp" in out
+    with Image.open(os.path.join("output", webps[0])) as img:
+        assert img.format == "WEBP" and img.size == (50, 40)
+
+
+def test_old_extension_is_kept_without_prune(workspace):
+    names = add_inputs(2)
+    run_main("-w", "1")
+    run_main("-w", "1", "--format", "webp")
+    assert os.path.exists(os.path.join("output", names[0]))
+    run_main("-w", "1", "--format", "webp", "--prune")
+    assert not os.path.exists(os.path.join("output", names[0]))
+
+
+def test_routed_encoding_change_recrops(workspace, capsys):
+    """The manifest template is the main one: a routed template's encoding is checked per entry."""
+    names = add_inputs(3, ext="jpg")
+    workspace("routed", encoding={"quality": 90})
+    run_main("-w", "1", "--route", "100x60=routed")
+    sizes = {name: os.path.getsize(os.path.join("output", name)) for name in names}
+
+    workspace("routed", encoding={"quality": 20})
+    capsys.readouterr()
+    run_main("-w", "1", "--route", "100x60=routed")
+    assert "Saltate" not in capsys.readouterr().out
+    for name in names:
+        assert os.path.getsize(os.path.join("output", name)) < sizes[name]
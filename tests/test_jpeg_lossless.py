@@ -0,0 +1,72 @@
+import io
+import os
+import stat
+
+from PIL import Image
+
+from crop_engine import crop_bytes
+from helpers import add_inputs, run_main
+from jpeg_lossless import is_croppable, read_jpeg_header, snap_to_mcu
+
+BOX = (21, 13, 60, 45)
+
+
+def _jpeg(noise, **options):
+    buffer = io.BytesIO()
+    noise().save(buffer, "JPEG", **options)
+    return buffer.getvalue()
+
+
+def _fake_jpegtran(tmp_path):
+    """A jpegtran that records its arguments and returns its input unchanged."""
+    path = tmp_path / "jpegtran"
+    path.write_text(f'#!/bin/sh\necho "$@" > "{tmp_path / "args"}"\ncat\n')
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+def test_mcu_size_follows_the_chroma_subsampling(noise):
+    subsampled = read_jpeg_header(_jpeg(noise, subsampling="4:2:0"))
+    full = read_jpeg_header(_jpeg(noise, subsampling="4:4:4"))
+    assert (subsampled["mcu_width"], subsampled["mcu_height"]) == (16, 16)
+    assert (full["mcu_width"], full["mcu_height"]) == (8, 8)
+    assert snap_to_mcu(BOX, subsampled) == (16, 0, 60, 45)
+    assert snap_to_mcu(BOX, full) == (16, 8, 60, 45)
+
+
+def test_only_baseline_jpegs_with_a_box_inside_are_croppable(noise):
+    header = read_jpeg_header(_jpeg(noise))
+    assert is_croppable(BOX, header)
+    assert not is_croppable((50, 20, 110, 45), header)
+    assert not is_croppable(BOX, read_jpeg_header(_jpeg(noise, progressive=True)))
+    buffer = io.BytesIO()
+    noise().save(buffer, "PNG")
+    assert not is_croppable(BOX, read_jpeg_header(buffer.getvalue()))
+
+
+def test_snapped_box_is_passed_to_jpegtran_and_reported(tmp_path, noise):
+    data = _jpeg(noise, subsampling="4:2:0")
+    encoded, warning = crop_bytes(data, [(BOX, "out.jpg", None)], jpegtran=_fake_jpegtran(tmp_path))
+    assert encoded == [("out.jpg", data)]
+    assert (tmp_path / "args").read_text().split() == ["-copy", "all", "-crop", "44x45+16+0"]
+    assert warning == (
+        "area allineata ai blocchi MCU per il ritaglio JPEG senza perdita: (21, 13, 60, 45) -> (16, 0, 60, 45)"
+    )
+
+
+def test_progressive_jpegs_fall_back_to_the_decode_path(tmp_path, noise):
+    encoded, warning = crop_bytes(_jpeg(noise, progressive=True), [(BOX, "out.jpg", None)], _fake_jpegtran(tmp_path))
+    assert warning is None
+    assert not (tmp_path / "args").exists()
+    with Image.open(io.BytesIO(encoded[0][1])) as out:
+        assert out.size == (39, 32)
+
+
+def test_without_jpegtran_the_crop_is_decoded_and_reencoded(workspace, tmp_path, monkeypatch, capsys):
+    names = add_inputs(2, ext="jpg")
+    monkeypatch.setenv("PATH", str(tmp_path / "no-such-dir"))
+    assert run_main("--lossless-jpeg") == 0
+    assert "Attenzione: jpegtran non trovato" in capsys.readouterr().out
+    for name in names:
+        with Image.open(os.path.join("output", name)) as out:
+            assert (out.format, out.size) == ("JPEG", (50, 40))
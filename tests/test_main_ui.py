@@ -0,0 +1,42 @@
+import os
+import queue
+
+import numpy as np
+import pytest
+
+from helpers import count_opens
+
+main_ui = pytest.importorskip("main_ui")  # needs tkinter
+
+SIZE = (50, 30)
+
+
+def _preview(path):
+    results = queue.Queue()
+    main_ui.CropUI._load_preview(path, SIZE, results)
+    return results.get_nowait()
+
+
+def test_non_jpeg_preview_is_decoded_once_then_read_from_the_cache(tmp_path, noise, monkeypatch):
+    monkeypatch.setattr(main_ui, "PREVIEW_CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "scan.png")
+    noise().save(path)
+    opened = count_opens(monkeypatch)
+    first = _preview(path)
+    second = _preview(path)
+    assert first.size == second.size == SIZE
+    assert np.array_equal(np.asarray(first), np.asarray(second))
+    assert opened.count(path) == 1
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+    os.utime(path, ns=(0, 0))  # a changed source is decoded again
+    _preview(path)
+    assert opened.count(path) == 2
+
+
+def test_jpeg_preview_uses_draft_mode_and_is_not_cached(tmp_path, noise, monkeypatch):
+    monkeypatch.setattr(main_ui, "PREVIEW_CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "photo.jpg")
+    noise().save(path)
+    assert _preview(path).size == SIZE
+    assert not os.path.exists(tmp_path / "cache")
@@ -0,0 +1,62 @@
+import json
+import os
+
+from helpers import add_inputs, run_main
+from manifest import MANIFEST_FILENAME
+
+
+def _mtimes(folder="output"):
+    return {
+        name: os.stat(os.path.join(folder, name)).st_mtime_ns
+        for name in os.listdir(folder)
+        if not name.startswith(".")
+    }
+
+
+def test_unchanged_inputs_are_skipped(workspace, capsys):
+    add_inputs(5)
+    assert run_main("-w", "1") == 0
+    before = _mtimes()
+    assert run_main("-w", "1") == 0
+    assert "Saltate 5 immagini" in capsys.readouterr().out
+    assert _mtimes() == before
+
+
+def test_modified_input_is_cropped_again(workspace):
+    names = add_inputs(3)
+    run_main("-w", "1")
+    before = _mtimes()
+    add_inputs(1, start=7)  # different content, moved over an existing input
+    os.replace("input/img07.png", f"input/{names[1]}")
+    run_main("-w", "1")
+    after = _mtimes()
+    assert after[names[1]] != before[names[1]]
+    assert after[names[0]] == before[names[0]]
+
+
+def test_template_change_survives_a_partial_run(workspace, capsys):
+    """A run cut short after a template change must not mark the untouched files as current."""
+    names = add_inputs(8, ext="jpg")
+    run_main("-w", "1")
+    # Only part of the folder is re-encoded, as when a run is interrupted; the manifest is saved anyway.
+    run_main("-w", "1", "--quality", "30", "--include", "img0[0-2].jpg")
+    capsys.readouterr()
+    before = _mtimes()
+
+    run_main("-w", "1", "--quality", "30")
+    out = capsys.readouterr().out
+    assert "Saltate 3 immagini" in out
+    after = _mtimes()
+    assert [name for name in names if after[name] != before[name]] == names[3:]
+
+
+def test_prune_finds_outputs_of_stale_entries(workspace):
+    names = add_inputs(3)
+    run_main("-w", "1")
+    workspace(left=20)
+    os.remove(f"input/{names[2]}")
+    run_main("-w", "1", "--prune")
+    assert sorted(_mtimes()) == names[:2]
+    with open(os.path.join("output", MANIFEST_FILENAME), encoding="utf-8") as fh:
+        data = json.load(fh)
+    assert sorted(data["files"]) == names[:2] and not data["stale"]
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from helpers import add_inputs, count_opens, run_main
+
+BOXES = {"left_half": (0, 0, 50, 60), "band": (10, 20, 90, 30)}
+
+
+def test_each_template_gets_its_subfolder_from_one_decode(workspace, monkeypatch):
+    for name, (left, top, right, bottom) in BOXES.items():
+        workspace(name, left=left, top=top, right=right, bottom=bottom)
+    names = add_inputs(4)
+    opened = count_opens(monkeypatch)
+    assert run_main("-w", "1", "-t", *BOXES) == 0
+    assert len(opened) == len(names)
+
+    for name in names:
+        with Image.open(os.path.join("input", name)) as source:
+            for subfolder, box in BOXES.items():
+                with Image.open(os.path.join("output", subfolder, name)) as out:
+                    assert np.array_equal(np.asarray(out), np.asarray(source.crop(box)))
+
+
+def test_changing_one_template_recrops_only_its_subfolder(workspace):
+    for name, (left, top, right, bottom) in BOXES.items():
+        workspace(name, left=left, top=top, right=right, bottom=bottom)
+    names = add_inputs(3)
+    run_main("-w", "1", "-t", *BOXES)
+    mtime = {sub: os.stat(os.path.join("output", sub, names[0])).st_mtime_ns for sub in BOXES}
+
+    workspace("band", left=10, top=20, right=90, bottom=40)
+    run_main("-w", "1", "-t", *BOXES)
+    assert os.stat(os.path.join("output", "left_half", names[0])).st_mtime_ns == mtime["left_half"]
+    with Image.open(os.path.join("output", "band", names[0])) as out:
+        assert out.size == (80, 20)
@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+from crop_engine import crop_bytes, crop_image, read_input
+from orientation import ORIENTATION_TAG
+from preflight import read_header
+
+FORMATS = {
+    "png": {},
+    "jpg": {"quality": 95},
+    "tif": {},
+    "tif-deflate": {"compression": "tiff_deflate"},
+}
+BOX = (5, 7, 33, 41)
+
+
+def _save(image, path, orientation, options):
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    image.save(path, exif=exif.tobytes(), **options)
+
+
+def _displayed(path):
+    with Image.open(path) as img:
+        return np.asarray(ImageOps.exif_transpose(img))
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+@pytest.mark.parametrize("kind", sorted(FORMATS))
+@pytest.mark.parametrize("roi", [False, True])
+def test_crop_matches_exif_transpose(tmp_path, noise, orientation, kind, roi):
+    path = str(tmp_path / f"image.{kind.split('-')[0]}")
+    _save(noise(), path, orientation, FORMATS[kind])
+    displayed = _displayed(path)
+    height, width = displayed.shape[:2]
+
+    for box in ((0, 0, width, height), BOX):
+        expected = displayed[box[1] : box[3], box[0] : box[2]]
+        assert np.array_equal(np.asarray(crop_image(path, box, as_image=True, roi=roi)), expected)
+
+        encoded, _ = crop_bytes(read_input(path), [(box, "out.png", None)], roi=roi)
+        with Image.open(io.BytesIO(encoded[0][1])) as out:
+            assert np.array_equal(np.asarray(out), expected)
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+@pytest.mark.parametrize("kind", sorted(FORMATS))
+def test_header_reports_displayed_size(tmp_path, noise, orientation, kind):
+    path = str(tmp_path / f"image.{kind.split('-')[0]}")
+    _save(noise(), path, orientation, FORMATS[kind])
+    header = read_header(path)
+    height, width = _displayed(path).shape[:2]
+    assert (header.width, header.height) == (width, height)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+from helpers import add_inputs
+
+BOX = (10, 5, 60, 45)
+_crop_bytes_job = pipeline.crop_bytes_job
+
+
+def _dying_job(data, outputs, jpegtran, profile, roi=False):
+    if data == b"die":
+        os._exit(1)  # as when the kernel kills a worker for memory
+    return _crop_bytes_job(data, outputs, jpegtran, profile, roi)
+
+
+def _jobs(folder, names, output):
+    for name in names:
+        yield name, os.path.join(folder, name), ((BOX, os.path.join(output, name), None),)
+
+
+def test_results_in_input_order_with_cropped_pixels(tmp_path):
+    names = add_inputs(10, folder=str(tmp_path / "in"))
+    (tmp_path / "out").mkdir()
+    results = list(pipeline.run_pipelined(_jobs(tmp_path / "in", names, tmp_path / "out"), 2, write_queue=1))
+    assert [name for name, _ in results] == names
+    assert all(result.error is None for _, result in results)
+    for name in names:
+        with Image.open(tmp_path / "in" / name) as source, Image.open(tmp_path / "out" / name) as out:
+            assert np.array_equal(np.asarray(out), np.asarray(source.crop(BOX)))
+
+
+def test_dead_worker_fails_its_files_and_the_rest_goes_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "crop_bytes_job", _dying_job)
+    names = add_inputs(8, folder=str(tmp_path / "in"))
+    (tmp_path / "in" / names[2]).write_bytes(b"die")
+    (tmp_path / "out").mkdir()
+    results = dict(pipeline.run_pipelined(_jobs(tmp_path / "in", names, tmp_path / "out"), 1, read_ahead=1))
+    assert list(results) == names
+    assert "BrokenProcessPool" in results[names[2]].error
+    assert results[names[-1]].error is None
+    assert os.path.exists(tmp_path / "out" / names[-1])
@@ -0,0 +1,48 @@
+import os
+from collections import Counter
+
+from PIL import Image
+
+import preflight
+import scheduler
+from helpers import add_inputs, run_main
+
+
+def _inputs():
+    return add_inputs(3), add_inputs(2, prefix="small", width=80, height=50)
+
+
+def test_dry_run_counts_each_size_bucket_and_routes_it(workspace, capsys):
+    workspace("narrow", left=0, top=0, right=40, bottom=30)
+    _inputs()
+    assert run_main("--dry-run", "--route", "80x50=narrow") == 0
+    lines = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert lines[0][:3] == ["Analizzate", "5", "immagini"]
+    assert ["100x60", "RGB", "3", "file", "ok"] in lines
+    assert ["80x50", "RGB", "2", "file", "->", "template", "'narrow',", "ok"] in lines
+
+    workspace(left=10, top=5, right=90, bottom=45)  # wider than the 80x50 images
+    assert run_main("--dry-run") == 1
+    lines = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert ["80x50", "RGB", "2", "file", "non", "rientra:", "default"] in lines
+    assert ["es.", "small00.png,", "small01.png"] in lines
+
+
+def test_routed_files_get_their_bucket_box_and_headers_are_read_once(workspace, monkeypatch):
+    workspace("narrow", left=0, top=0, right=40, bottom=30)
+    large, small = _inputs()
+    reads = Counter()
+    read_header = preflight.read_header
+
+    def counting_read(path):
+        reads[os.path.basename(path)] += 1
+        return read_header(path)
+
+    monkeypatch.setattr(preflight, "read_header", counting_read)
+    monkeypatch.setattr(scheduler, "read_header", counting_read)
+    assert run_main("-w", "2", "--route", "80x50=narrow", "--memory-budget", "64") == 0
+    assert reads == Counter(large + small)
+    for names, size in ((large, (50, 40)), (small, (40, 30))):
+        for name in names:
+            with Image.open(os.path.join("output", name)) as out:
+                assert out.size == size
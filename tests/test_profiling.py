@@ -0,0 +1,28 @@
+import json
+import os
+
+import pytest
+
+from helpers import add_inputs, run_main
+from profiling import STAGES
+
+
+@pytest.mark.parametrize("mode", [["-w", "1"], ["-w", "2"], ["-w", "2", "--pipeline"], ["--memory-budget", "64"]])
+def test_profile_reports_every_stage_and_the_bytes_moved(workspace, capsys, mode):
+    names = add_inputs(3)
+    assert run_main(*mode, "--profile", "--profile-trace", "trace.json") == 0
+    out = capsys.readouterr().out
+    assert "Profilo per fase (3 file, tempo cumulato dei worker):" in out
+    for stage in STAGES:
+        assert f"  {stage} " in out
+    assert "3 file più lenti:" in out
+
+    with open("trace.json", encoding="utf-8") as fh:
+        rows = json.load(fh)
+    assert [row["file"] for row in rows] == names
+    for row in rows:
+        assert list(row) == ["file", *STAGES, "total", "bytes_read", "bytes_written"]
+        assert row["total"] == pytest.approx(sum(row[stage] for stage in STAGES), abs=1e-5)
+        assert row["decode"] > 0
+        assert row["bytes_read"] == os.path.getsize(os.path.join("input", row["file"]))
+        assert row["bytes_written"] == os.path.getsize(os.path.join("output", row["file"]))
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from crop_engine import crop_image, shift_box
+from roi import decode_region
+
+BOXES = [(0, 0, 400, 300), (37, 51, 201, 133), (350, 10, 400, 20)]
+FORMATS = {"PNG": {}, "JPEG": {"quality": 90}, "TIFF": {}}
+
+
+def _encoded(noise, image_format):
+    buffer = io.BytesIO()
+    noise(400, 300).save(buffer, format=image_format, **FORMATS[image_format])
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("image_format", sorted(FORMATS))
+@pytest.mark.parametrize("box", BOXES)
+def test_region_decode_matches_full_decode(noise, image_format, box):
+    data = _encoded(noise, image_format)
+    with Image.open(io.BytesIO(data)) as full:
+        expected = np.asarray(full.crop(box))
+    region, origin = decode_region(data, box)
+    with region:
+        assert np.array_equal(np.asarray(region.crop(shift_box(box, origin))), expected)
+    assert np.array_equal(np.asarray(crop_image(data, box, as_image=True, roi=True)), expected)
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "TIFF"])
+def test_only_the_needed_rows_are_decoded(noise, image_format):
+    region, origin = decode_region(_encoded(noise, image_format), (37, 51, 201, 133))
+    with region:
+        assert origin[1] + region.size[1] <= 133
+        assert region.size[0] * region.size[1] < 400 * 300
+
+
+def test_small_crop_of_an_image_over_the_pixel_limit(noise, monkeypatch):
+    data = _encoded(noise, "PNG")
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 400 * 300 // 4)
+    with pytest.raises(Image.DecompressionBombError):
+        crop_image(data, (0, 0, 20, 20))
+    assert crop_image(data, (0, 0, 20, 20), as_image=True, roi=True).size == (20, 20)
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import scheduler
+from crop_engine import CropResult
+from helpers import add_inputs
+from preflight import ImageHeader
+
+BOX = (0, 0, 10, 10)
+BUDGET = 100_000  # four 100x60 RGB files, (100 * 60 + 100) * 4 bytes each
+_crop_job = scheduler.crop_job
+
+
+class _RecordingPool(ThreadPoolExecutor):
+    """A thread pool standing in for the process pool, recording what is submitted."""
+
+    def __init__(self, workers):
+        super().__init__(max_workers=workers)
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append(os.path.basename(args[0]))
+        return super().submit(fn, *args, **kwargs)
+
+
+class _OverlappingPool:
+    """Finishes a job only once a later one was submitted, or when nothing was submitted for a moment.
+
+    Like workers finishing in turn: while small files keep coming something
+    is always running, which is what starves a file waiting for the budget.
+    """
+
+    def __init__(self):
+        self.submitted = []
+        self.running = deque()
+        self.changed = threading.Condition()
+        threading.Thread(target=self._finish, daemon=True).start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        with self.changed:
+            self.submitted.append(os.path.basename(args[0]))
+            self.running.append(future)
+            self.changed.notify()
+        return future
+
+    def _finish(self):
+        with self.changed:
+            while True:
+                if len(self.running) > 1 or (self.running and not self.changed.wait(0.05)):
+                    self.running.popleft().set_result(CropResult(None, None, 0.0))
+                elif not self.running:
+                    self.changed.wait()
+
+
+def _jobs(folder, names, output):
+    for name in names:
+        yield name, os.path.join(folder, name), ((BOX, os.path.join(output, name), None),)
+
+
+def _dying_job(input_path, outputs, jpegtran, profile=False, roi=False):
+    with open(input_path, "rb") as fh:
+        if fh.read() == b"die":
+            os._exit(1)  # as when the kernel kills a worker for memory
+    return _crop_job(input_path, outputs, jpegtran, profile, roi)
+
+
+def test_decoded_bytes_counts_the_decoded_image_and_its_crops():
+    outputs = [(BOX, "a.png", None), ((0, 0, 20, 5), "b.png", None)]
+    assert scheduler.decoded_bytes(ImageHeader(100, 50, "RGB"), outputs) == (100 * 50 + 200) * 4
+    assert scheduler.decoded_bytes(ImageHeader(100, 50, "L"), outputs) == 100 * 50 + 200
+    assert scheduler.decoded_bytes(ImageHeader(100, 50, "I;16"), outputs) == (100 * 50 + 200) * 2
+    assert scheduler.decoded_bytes(ImageHeader(100, 50, "RGB"), outputs, roi=True) == (100 * 10 + 200) * 4
+    assert scheduler.decoded_bytes(ImageHeader(error="OSError: broken"), outputs) == 0
+
+
+def test_a_file_over_the_budget_runs_alone_and_results_keep_input_order(tmp_path, monkeypatch):
+    active, seen, lock = set(), [], threading.Lock()
+
+    def job(input_path, outputs, jpegtran, profile, roi):
+        name = os.path.basename(input_path)
+        with lock:
+            active.add(name)
+            seen.append(set(active))
+        time.sleep(0.01)
+        with lock:
+            active.discard(name)
+        return CropResult(None, None, 0.0)
+
+    monkeypatch.setattr(scheduler, "crop_job", job)
+    names = add_inputs(3, folder=str(tmp_path), prefix="a")
+    names += add_inputs(1, folder=str(tmp_path), prefix="b", width=400, height=300)
+    names += add_inputs(6, folder=str(tmp_path), prefix="c")
+    usage = scheduler.BudgetUsage(BUDGET)
+    with _RecordingPool(4) as pool:
+        results = list(scheduler.run_budgeted(_jobs(tmp_path, names, tmp_path), 4, BUDGET, usage=usage, executor=pool))
+        assert pool.submit(len, "still open").result() == 10  # a pool passed in is left running
+    assert [name for name, _ in results] == names
+    big = names[3]
+    assert [group for group in seen if big in group] == [{big}]
+    assert usage.alone == 1
+
+
+def test_a_waiting_file_gets_a_reservation_after_a_few_bypasses(tmp_path):
+    first = add_inputs(1, folder=str(tmp_path), prefix="a")
+    medium = add_inputs(1, folder=str(tmp_path), prefix="b", width=200, height=110)  # fits alone only
+    smalls = add_inputs(12, folder=str(tmp_path), prefix="c")
+    names = first + medium + smalls
+    pool = _OverlappingPool()
+    results = list(scheduler.run_budgeted(_jobs(tmp_path, names, tmp_path), 2, BUDGET, executor=pool))
+    assert [name for name, _ in results] == names
+    # The first file, then as many bypasses as allowed, then the medium file once the memory is free.
+    assert pool.submitted.index(medium[0]) == 1 + 2 * scheduler._MAX_BYPASS_PER_WORKER
+
+
+def test_dead_worker_fails_its_files_and_the_rest_goes_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "crop_job", _dying_job)
+    names = add_inputs(8, folder=str(tmp_path / "in"))
+    (tmp_path / "in" / names[2]).write_bytes(b"die")
+    (tmp_path / "out").mkdir()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        jobs = _jobs(tmp_path / "in", names, tmp_path / "out")
+        results = dict(scheduler.run_budgeted(jobs, 1, BUDGET, executor=pool))
+    assert list(results) == names
+    assert "BrokenProcessPool" in results[names[2]].error
+    assert results[names[-1]].error is None
+    assert os.path.exists(tmp_path / "out" / names[-1])
@@ -0,0 +1,45 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from helpers import add_inputs
+from server import _is_listening, run_client
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+BOX = (10, 5, 60, 45)
+
+
+def test_client_job_runs_on_the_server_which_then_shuts_down(workspace, tmp_path, capsys):
+    names = add_inputs(3)
+    path = str(tmp_path / "crop.sock")
+    server = subprocess.Popen(
+        [sys.executable, MAIN, "--serve", "--socket", path, "-w", "2"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not (os.path.exists(path) and _is_listening(path)):
+            assert server.poll() is None and time.monotonic() < deadline
+            time.sleep(0.05)
+        assert run_client(path, ["-o", "crops"]) == 0
+        out = capsys.readouterr()
+        assert "eseguo in locale" not in out.err
+        assert [line for line in out.out.splitlines() if line.startswith("Ritagliata")] == [
+            f"Ritagliata {name}" for name in names
+        ]
+        for name in names:
+            with Image.open(os.path.join("input", name)) as source, Image.open(os.path.join("crops", name)) as out:
+                assert np.array_equal(np.asarray(out), np.asarray(source.crop(BOX)))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        log, _ = server.communicate(timeout=30)
+    assert server.returncode == 0
+    assert "Server terminato." in log
+    assert not os.path.exists(path)
@@ -0,0 +1,26 @@
+import os
+
+from helpers import add_inputs, run_main
+from sharding import load_logs, shard_of
+
+
+def test_three_shards_cover_every_input_once_and_a_missing_shard_is_reported(workspace, capsys):
+    names = add_inputs(20)
+    for index in (1, 2):
+        assert run_main("-w", "2", "--shard", f"{index}/3") == 0
+    capsys.readouterr()
+    assert run_main("--merge-shards") == 1
+    out = capsys.readouterr().out
+    assert "Shard senza log: 3/3." in out
+    assert "Copertura degli shard incompleta." in out
+
+    assert run_main("-w", "2", "--shard", "3/3") == 0
+    capsys.readouterr()
+    assert run_main("--merge-shards") == 0
+    assert "Tutti gli input sono stati coperti una sola volta." in capsys.readouterr().out
+
+    covered = {int(log["shard"][0]): log["covered"] for log in load_logs("output")}
+    assert sorted(name for shard in covered.values() for name in shard) == names
+    for index, shard in covered.items():
+        assert shard and all(shard_of(name, 3) == index for name in shard)
+    assert sorted(name for name in os.listdir("output") if not name.startswith(".")) == names
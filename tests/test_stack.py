@@ -0,0 +1,24 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from helpers import add_inputs, run_main
+
+
+def test_stack_rows_hold_the_crops_and_skip_the_output_folder(workspace):
+    names = add_inputs(3)
+    add_inputs(2, folder="input/sub", prefix="deep")
+    # Crops of an earlier run inside the input tree must not be stacked back in.
+    add_inputs(2, folder="input/crops", prefix="old")
+    assert run_main("-w", "2", "-r", "-o", "input/crops", "--stack", "stack.npy") == 0
+
+    rows = np.load("stack.npy", mmap_mode="r")
+    with open("stack.index.json", encoding="utf-8") as fh:
+        files = json.load(fh)["files"]
+    assert files == names + ["sub/deep00.png", "sub/deep01.png"]
+    assert rows.shape == (5, 40, 50, 3)
+    for row, name in enumerate(files):
+        with Image.open(os.path.join("input", name)) as source:
+            assert np.array_equal(rows[row], np.asarray(source.crop((10, 5, 60, 45))))
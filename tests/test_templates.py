@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+import template_manager
+from template_manager import TemplateError, list_templates, load_template, search_templates
+
+
+def _write(name, description, mtime_ns):
+    path = os.path.join("templates", f"{name}.json")
+    data = {"template_name": name, "left": 0, "top": 0, "right": 10, "bottom": 10, "description": description}
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_template_edited_in_place_is_picked_up_when_loaded(workspace, monkeypatch):
+    directory = os.path.abspath("templates")
+    _write("scan", "scansione A4", 1_000_000_000_000_000_000)
+    assert [name for name, _ in search_templates("a4")] == ["scan"]
+    search_templates("")  # settles after the index's own save touched the directory
+    dir_stat = os.stat(directory)
+
+    # The same file rewritten in place: the directory's mtime does not move.
+    _write("scan", "ricevuta", 1_000_000_001_000_000_000)
+    os.utime(directory, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    assert template_manager._index().dir_mtime_ns == os.stat(directory).st_mtime_ns
+
+    # Listing trusts the unchanged directory: no template file is stat'ed.
+    stat = os.stat
+    stated = []
+
+    def counting_stat(path, *args, **kwargs):
+        stated.append(os.path.basename(path))
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(template_manager.os, "stat", counting_stat)
+    assert list_templates() == ["default", "scan"]
+    assert not [name for name in stated if name.endswith(".json")]
+    monkeypatch.setattr(template_manager.os, "stat", stat)
+
+    assert load_template("scan")["description"] == "ricevuta"
+    assert search_templates("a4") == []
+    assert search_templates("ricevuta")[0][1]["description"] == "ricevuta"
+
+
+@pytest.mark.parametrize("derivatives", [[True], [512, False], [0], ["256"], 512])
+def test_invalid_derivatives_are_rejected(workspace, derivatives):
+    workspace("thumbs", derivatives=derivatives)
+    with pytest.raises(TemplateError, match="derivatives"):
+        load_template("thumbs")
@@ -0,0 +1,65 @@
+import io
+import os
+import signal
+import time
+
+import numpy as np
+from PIL import Image
+
+import watcher
+from crop_engine import CropTarget
+
+BOX = (10, 5, 60, 45)
+SETTLE = 0.15
+
+
+class _RewritingWriter:
+    """Stands in for inotify: a writer saves ``slow.png`` in several passes, each one reported as complete.
+
+    Once the crop appears (or after a while) it sends SIGTERM, which stops the daemon.
+    """
+
+    def __init__(self, root, noise, output):
+        buffer = io.BytesIO()
+        noise().save(buffer, "PNG")
+        self.data = buffer.getvalue()
+        self.path = os.path.join(root, "slow.png")
+        self.output = output
+        self.passes = 6
+        self.events = []
+        self.deadline = time.monotonic() + 10
+
+    def __call__(self, root, **kwargs):
+        return self
+
+    def read(self, timeout):
+        time.sleep(0.02)
+        if len(self.events) < self.passes:
+            with open(self.path, "wb") as fh:
+                fh.write(self.data[: len(self.data) * (len(self.events) + 1) // self.passes])
+            self.events.append(time.time())
+            return ["slow.png"], [], False
+        if os.path.exists(self.output) or time.monotonic() > self.deadline:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return [], [], False
+
+    def close(self):
+        pass
+
+
+def test_file_is_cropped_once_after_its_events_settle(tmp_path, noise, monkeypatch, capsys):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "out").mkdir()
+    output = tmp_path / "out" / "slow.png"
+    writer = _RewritingWriter(str(tmp_path / "in"), noise, str(output))
+    monkeypatch.setattr(watcher, "InotifyWatcher", writer)
+    processed = watcher.watch_folder(
+        str(tmp_path / "in"), str(tmp_path / "out"), [CropTarget("", BOX)], {}, 1, settle=SETTLE
+    )
+    lines = capsys.readouterr().out.splitlines()
+    assert processed == 1
+    assert [line for line in lines if "slow.png" in line] == ["Ritagliata slow.png"]
+    # Partial writes were never cropped: the only crop started a settle period after the last pass.
+    assert output.stat().st_mtime >= writer.events[-1] + SETTLE - 0.01
+    with Image.open(output) as out:
+        assert np.array_equal(np.asarray(out), np.asarray(noise().crop(BOX)))
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import crop_engine
+from helpers import add_inputs, run_main
+
+BOX = (10, 5, 60, 45)
+_crop_job = crop_engine.crop_job
+
+
+def _dying_job(input_path, outputs, jpegtran, profile=False, roi=False):
+    with open(input_path, "rb") as fh:
+        if fh.read() == b"die":
+            os._exit(1)  # as when the kernel kills a worker for memory
+    return _crop_job(input_path, outputs, jpegtran, profile, roi)
+
+
+def _crops(folder):
+    crops = {}
+    for name in sorted(os.listdir(folder)):
+        if not name.startswith("."):
+            with Image.open(os.path.join(folder, name)) as img:
+                crops[name] = np.asarray(img)
+    return crops
+
+
+def test_process_pool_matches_serial_crops(workspace):
+    names = add_inputs(9)
+    assert run_main("-w", "1", "-o", "serial") == 0
+    assert run_main("-w", "3", "-o", "pool") == 0
+    serial, pool = _crops("serial"), _crops("pool")
+    assert list(pool) == names
+    for name in names:
+        with Image.open(os.path.join("input", name)) as source:
+            expected = np.asarray(source.crop(BOX))
+        assert np.array_equal(serial[name], expected)
+        assert np.array_equal(pool[name], expected)
+
+
+def test_log_keeps_input_order_and_a_bad_file_does_not_stop_the_batch(workspace, capsys):
+    names = add_inputs(12)
+    with open(os.path.join("input", names[4]), "wb") as fh:
+        fh.write(b"not an image")
+    assert run_main("-w", "3") == 0
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith(("Ritagliata", "Errore su"))]
+    assert [line.split()[-1] if line.startswith("Ritagliata") else line.split()[2][:-1] for line in lines] == names
+    assert lines[4].startswith(f"Errore su {names[4]}:")
+    assert _crops("output").keys() == set(names) - {names[4]}
+
+
+def test_dead_worker_fails_its_files_and_the_rest_goes_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(crop_engine, "crop_job", _dying_job)
+    names = add_inputs(12, folder=str(tmp_path / "in"))
+    (tmp_path / "in" / names[2]).write_bytes(b"die")
+    (tmp_path / "out").mkdir()
+    jobs = [(name, str(tmp_path / "in" / name), ((BOX, str(tmp_path / "out" / name), None),)) for name in names]
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        results = dict(crop_engine.run_ordered(jobs, 1, executor=pool))
+    assert list(results) == names
+    assert "BrokenProcessPool" in results[names[2]].error
+    assert results[names[-1]].error is None
+    assert os.path.exists(tmp_path / "out" / names[-1])
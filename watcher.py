@@ -0,0 +1,334 @@
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from batch import is_selected, iter_image_files, matches_any, plan_outputs, record_outputs
+from crop_engine import CropResult, CropTarget, crop_job
+from manifest import Manifest
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+_POLL_INTERVAL = 0.2
+
+
+def _ignore_sigint() -> None:
+    # Ctrl+C reaches the whole process group: let the parent drain the pool instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WatchError(RuntimeError):
+    """Raised when the hot folder cannot be watched."""
+
+
+class InotifyWatcher:
+    """Minimal inotify binding (through ctypes) reporting completed files under a folder."""
+
+    def __init__(
+        self,
+        root: str,
+        recursive: bool = False,
+        exclude: Sequence[str] = (),
+        skip_dirs: Sequence[str] = (),
+    ):
+        if not sys.platform.startswith("linux"):
+            raise WatchError("La modalità --watch richiede Linux (inotify).")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError(f"inotify_init1 fallita: {os.strerror(ctypes.get_errno())}")
+        self.root = root
+        self.recursive = recursive
+        self.exclude = exclude
+        self._skipped = {os.path.realpath(path) for path in skip_dirs}
+        self._dirs: Dict[int, str] = {}
+        self.add_tree("")
+
+    def add_tree(self, rel_dir: str) -> List[str]:
+        """Watch ``rel_dir`` (and its subfolders when recursive); return the subfolders added."""
+        added = []
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            path = os.path.join(self.root, current)
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                raise WatchError(f"Impossibile osservare '{path}': {os.strerror(ctypes.get_errno())}")
+            self._dirs[wd] = current
+            added.append(current)
+            if not self.recursive:
+                continue
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and self._accepts_dir(entry):
+                        pending.append(f"{current}{entry.name}/")
+        return added
+
+    def _accepts_dir(self, entry: os.DirEntry) -> bool:
+        if os.path.realpath(entry.path) in self._skipped:
+            return False
+        rel_path = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+        return not (self.exclude and matches_any(rel_path, self.exclude))
+
+    def read(self, timeout: float) -> Tuple[List[str], List[str], bool]:
+        """Wait up to ``timeout`` seconds; return ``(completed files, new dirs, overflowed)``."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        files: List[str] = []
+        new_dirs: List[str] = []
+        overflow = False
+        if not ready:
+            return files, new_dirs, overflow
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return files, new_dirs, overflow
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    entry_path = os.path.join(self.root, directory, name)
+                    rel_dir = f"{directory}{name}"
+                    if os.path.realpath(entry_path) not in self._skipped and not (
+                        self.exclude and matches_any(rel_dir, self.exclude)
+                    ):
+                        new_dirs.extend(self.add_tree(f"{rel_dir}/"))
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                files.append(f"{directory}{name}")
+        return files, new_dirs, overflow
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Stats:
+    """Counters reported periodically by the daemon."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.window_processed = 0
+        self.latencies: List[float] = []
+        self.window_start = time.monotonic()
+
+    def done(self, arrived: float, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.processed += 1
+                self.window_processed += 1
+            else:
+                self.failed += 1
+            self.latencies.append(time.monotonic() - arrived)
+
+    def report(self, queue_depth: int, queue_size: int) -> str:
+        with self.lock:
+            now = time.monotonic()
+            elapsed = max(now - self.window_start, 1e-9)
+            rate = self.window_processed / elapsed
+            latencies = sorted(self.latencies)
+            self.latencies = []
+            self.window_processed = 0
+            self.window_start = now
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            latency = f"latenza p50 {p50:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s"
+        else:
+            latency = "latenza n/d"
+        return (
+            f"[watch] {rate:.1f} img/s, coda {queue_depth}/{queue_size}, {latency}, "
+            f"totale {self.processed} ritagliate, {self.failed} errori"
+        )
+
+
+def watch_folder(
+    input_folder: str,
+    output_folder: str,
+    targets: Sequence[CropTarget],
+    manifests: Dict[str, Manifest],
+    workers: int,
+    jpegtran: Optional[str] = None,
+    recursive: bool = False,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    queue_size: int = 0,
+    settle: float = 1.0,
+    stats_interval: float = 30.0,
+    roi: bool = False,
+) -> int:
+    """Stay resident and crop every image written into ``input_folder``.
+
+    inotify close-write/moved-to events mark a file as complete; it is queued
+    only after ``settle`` seconds without further events, so writers that
+    reopen a file are not raced. The bounded queue (``queue_size``, default
+    ``8 * workers``) applies backpressure when the pool falls behind. Files
+    already present and not in the manifests are queued at start-up.
+    Runs until SIGINT/SIGTERM and returns the number of cropped images.
+    """
+    queue_size = queue_size or workers * 8
+    work: "queue.Queue[Optional[Tuple[str, float]]]" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    created_dirs = {output_folder}
+    stats = _Stats()
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_ignore_sigint)
+
+    def handle_signal(signum, frame):
+        stop.set()
+
+    previous_handlers = {sig: signal.signal(sig, handle_signal) for sig in (signal.SIGINT, signal.SIGTERM)}
+
+    def consume():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            fname, arrived = item
+            input_path = os.path.join(input_folder, fname)
+            try:
+                with lock:
+                    stat, outputs, written = plan_outputs(
+                        fname, input_path, output_folder, targets, manifests, created_dirs
+                    )
+            except OSError as exc:
+                print(f"Errore su {fname}: {exc}")
+                stats.done(arrived, ok=False)
+                continue
+            if not outputs:
+                continue
+            if executor is None:
+                result = crop_job(input_path, outputs, jpegtran, roi=roi)
+            else:
+                try:
+                    result = executor.submit(crop_job, input_path, outputs, jpegtran, False, roi).result()
+                except Exception as exc:  # e.g. a worker killed by the OOM killer
+                    result = CropResult(None, f"{type(exc).__name__}: {exc}", 0.0)
+            warning, error = result.warning, result.error
+            with lock:
+                if error is not None:
+                    print(f"Errore su {fname}: {error}")
+                else:
+                    if warning is not None:
+                        print(f"Attenzione ({fname}): {warning}")
+                    print(f"Ritagliata {fname}")
+                    record_outputs(fname, input_path, stat, written, manifests)
+            stats.done(arrived, ok=error is None)
+
+    watcher = InotifyWatcher(input_folder, recursive=recursive, exclude=exclude, skip_dirs=(output_folder,))
+    consumers = [threading.Thread(target=consume, daemon=True) for _ in range(workers)]
+    for thread in consumers:
+        thread.start()
+
+    # Last inotify event per path; a path is queued once quiet for ``settle`` seconds.
+    pending: Dict[str, float] = {}
+    # First event per path, used to measure latency from arrival to finished crop.
+    arrivals: Dict[str, float] = {}
+
+    def enqueue_existing():
+        now = time.monotonic()
+        for fname in iter_image_files(
+            input_folder,
+            recursive=recursive,
+            include=include,
+            exclude=exclude,
+            sort=False,
+            skip_dirs=(output_folder,),
+        ):
+            pending.setdefault(fname, now)
+
+    print(f"In ascolto su '{input_folder}' (Ctrl+C per terminare)...")
+    enqueue_existing()
+    next_report = time.monotonic() + stats_interval
+    try:
+        while not stop.is_set():
+            files, new_dirs, overflow = watcher.read(_POLL_INTERVAL)
+            now = time.monotonic()
+            if overflow:
+                print("Attenzione: coda inotify piena, nuova scansione della cartella.")
+                enqueue_existing()
+            for rel_dir in new_dirs:
+                # Files may have landed before the watch was in place.
+                _scan_flat(input_folder, rel_dir, include, exclude, pending)
+            for fname in files:
+                if is_selected(fname, include, exclude):
+                    arrivals.setdefault(fname, now)
+                    pending[fname] = now
+            for fname, last_event in list(pending.items()):
+                if now - last_event < settle:
+                    continue
+                del pending[fname]
+                arrived = arrivals.pop(fname, last_event)
+                while not stop.is_set():
+                    try:
+                        work.put((fname, arrived), timeout=_POLL_INTERVAL)
+                        break
+                    except queue.Full:
+                        continue
+            if now >= next_report:
+                print(stats.report(work.qsize(), queue_size))
+                with lock:
+                    for manifest in manifests.values():
+                        manifest.save()
+                next_report = now + stats_interval
+    finally:
+        watcher.close()
+        for _ in consumers:
+            work.put(None)
+        for thread in consumers:
+            thread.join()
+        if executor is not None:
+            executor.shutdown()
+        for manifest in manifests.values():
+            manifest.save()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        print(stats.report(work.qsize(), queue_size))
+    return stats.processed
+
+
+def _scan_flat(
+    input_folder: str,
+    rel_dir: str,
+    include: Sequence[str],
+    exclude: Sequence[str],
+    pending: Dict[str, float],
+) -> None:
+    """Queue the images already inside a newly watched folder (not its subfolders)."""
+    now = time.monotonic()
+    for fname in iter_image_files(os.path.join(input_folder, rel_dir), sort=False):
+        rel_path = f"{rel_dir}{fname}"
+        if is_selected(rel_path, include, exclude):
+            pending.setdefault(rel_path, now)